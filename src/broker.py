@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import time
+import uuid
+
+from launcher import kill_process_tree, load_config, popen_kwargs, script_command, solver_env
+from solvers import LocalSolver
+
+# A job is a folder that moves between these subfolders of the broker root. Moves
+# are os.rename calls, which are atomic on one file system, so exactly one worker
+# wins a job and a finished job is never half visible. A leased job is renamed to
+# <job_id>__<worker token> so that only the current lease holder can finish it.
+# Dropping CANCEL_FILE into a lease folder asks its worker to abandon the job.
+QUEUE_DIR = "queue"
+LEASED_DIR = "leased"
+DONE_DIR = "done"
+STAGING_DIR = "staging"
+CANCEL_FILE = "cancel.json"
+
+def ensure_broker_dirs(root):
+    for name in (QUEUE_DIR, LEASED_DIR, DONE_DIR, STAGING_DIR):
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+
+def read_json(path, default=None):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def write_json(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def move_job(root, name, src, dst, new_name=None):
+    """Move a job folder between broker states. Returns False if someone else moved it first."""
+    try:
+        os.rename(os.path.join(root, src, name), os.path.join(root, dst, new_name or name))
+        return True
+    except OSError:
+        return False
+
+
+class BrokerSolver(LocalSolver):
+    """Sends modeling + simulation jobs through a shared-folder queue to worker agents.
+
+    Workers (worker.py) may run on any host that sees the broker folder. The
+    solver publishes a job, waits for its result and copies the solved AEDB back
+    to where the engine expects it. A worker whose heartbeat stops for
+    lease_timeout seconds is considered lost and its job is queued again.
+    Building the full stackup stays on this machine (inherited from LocalSolver).
+    """
+
+    remote = True  # solves may run on another host, which cannot open this machine's files
+
+    def __init__(self, root, lease_timeout=300, poll_interval=2, max_attempts=3, local_workers=0):
+        super().__init__()
+        self.root = os.path.abspath(root)
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.heartbeats = {}  # lease name -> (last beat seen, local time it was seen)
+        ensure_broker_dirs(self.root)
+        self.workers = [self.start_local_worker() for _ in range(local_workers)]
+
+    def start_local_worker(self):
+        config = load_config()
+        return subprocess.Popen(script_command("worker.py", self.root, config=config),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                env=solver_env(config), **popen_kwargs())
+
+    def submit(self, job):
+        job_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{job['layer']}_{job['iteration']}_{uuid.uuid4().hex[:8]}"
+        with open(job['params_path'], 'r') as f:
+            modeling_params = json.load(f)
+
+        staging_path = os.path.join(self.root, STAGING_DIR, job_id)
+        os.makedirs(staging_path)
+        write_json(os.path.join(staging_path, "job.json"), {
+            "job_id": job_id,
+            "layer": job['layer'],
+            "iteration": job['iteration'],
+            "aedb_name": os.path.basename(job['aedb_path']),
+            "modeling_params": modeling_params,
+            "attempts": 0,
+            "submitted_by": socket.gethostname(),
+        })
+        os.rename(staging_path, os.path.join(self.root, QUEUE_DIR, job_id))
+        return job_id
+
+    def find_lease(self, job_id):
+        """Name of the leased folder of job_id (<job_id>__<worker token>), or None."""
+        prefix = f"{job_id}__"
+        for name in os.listdir(os.path.join(self.root, LEASED_DIR)):
+            if name.startswith(prefix):
+                return name
+        return None
+
+    def reap_expired_lease(self, job_id, lease_name):
+        """Re-queue a job whose worker stopped sending heartbeats. Returns an error message when giving up."""
+        lease_path = os.path.join(self.root, LEASED_DIR, lease_name)
+        heartbeat = read_json(os.path.join(lease_path, "heartbeat.json"), {})
+        beat = heartbeat.get("beat")
+        last_beat, seen_at = self.heartbeats.get(lease_name, (None, None))
+        now = time.time()
+        if lease_name not in self.heartbeats or beat != last_beat:
+            # Beats are timed on this host's clock only, so worker clock skew does not matter
+            self.heartbeats[lease_name] = (beat, now)
+            return None
+        if now - seen_at < self.lease_timeout:
+            return None
+
+        del self.heartbeats[lease_name]
+        job_info = read_json(os.path.join(lease_path, "job.json"), {})
+        job_info["attempts"] = job_info.get("attempts", 0) + 1
+        worker = heartbeat.get("worker", "unknown worker")
+        try:
+            write_json(os.path.join(lease_path, "job.json"), job_info)
+            for name in ("heartbeat.json", "lease.json"):
+                if os.path.exists(os.path.join(lease_path, name)):
+                    os.remove(os.path.join(lease_path, name))
+            shutil.rmtree(os.path.join(lease_path, "output"), ignore_errors=True)
+        except OSError:
+            # The worker finished after all and moved the job on
+            return None
+
+        # Renaming the lease folder away makes a late finish by the lost worker fail harmlessly
+        if job_info["attempts"] >= self.max_attempts:
+            move_job(self.root, lease_name, LEASED_DIR, DONE_DIR)
+            shutil.rmtree(os.path.join(self.root, DONE_DIR, lease_name), ignore_errors=True)
+            return f"job lost {job_info['attempts']} times, last on {worker}"
+        try:
+            os.rename(lease_path, os.path.join(self.root, QUEUE_DIR, job_id))
+        except OSError:
+            pass
+        return None
+
+    def withdraw(self, job_id):
+        """Take back a job whose result is no longer wanted, wherever it is."""
+        if move_job(self.root, job_id, QUEUE_DIR, STAGING_DIR):
+            shutil.rmtree(os.path.join(self.root, STAGING_DIR, job_id), ignore_errors=True)
+        lease_name = self.find_lease(job_id)
+        if lease_name:
+            try:
+                write_json(os.path.join(self.root, LEASED_DIR, lease_name, CANCEL_FILE), {"by": socket.gethostname()})
+            except OSError:
+                pass
+        shutil.rmtree(os.path.join(self.root, DONE_DIR, job_id), ignore_errors=True)
+
+    def stage_output(self, done_path, output_dir):
+        """Move the solved project (aedb plus the .aedt/.aedtresults AEDT wrote next to it) back to output_dir."""
+        staged_dir = os.path.join(done_path, "output")
+        if not os.path.isdir(staged_dir):
+            return
+        for name in os.listdir(staged_dir):
+            target = os.path.join(output_dir, name)
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            elif os.path.exists(target):
+                os.remove(target)
+            shutil.move(os.path.join(staged_dir, name), target)
+
+    def poll(self, job_id):
+        """Look at a job once, re-queueing it when its lease expired.
+
+        Returns (result, lease name, worker, requeued); result is None until the job is done.
+        """
+        result = read_json(os.path.join(self.root, DONE_DIR, job_id, "result.json"))
+        if result is not None:
+            return result, None, None, False
+        lease_name = self.find_lease(job_id)
+        if not lease_name:
+            return None, None, None, False
+        worker = read_json(os.path.join(self.root, LEASED_DIR, lease_name, "lease.json"), {}).get("worker")
+        error = self.reap_expired_lease(job_id, lease_name)
+        if error:
+            raise RuntimeError(f"Broker job {job_id} failed: {error}")
+        requeued = not self.find_lease(job_id) and os.path.isdir(os.path.join(self.root, QUEUE_DIR, job_id))
+        return None, lease_name, worker, requeued
+
+    async def evaluate_async(self, job, log):
+        layer_name = job['layer']
+        iteration = job['iteration']
+        # Folder work on the shared drive runs in threads, so other solve slots, pause and cancel are not held up
+        job_id = await asyncio.to_thread(self.submit, job)
+        log(f"[{layer_name}] Iter {iteration}: Queued as {job_id}")
+        try:
+            result = await self.wait_for_result(job_id, layer_name, iteration, log)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self.withdraw, job_id)
+            raise
+
+        done_path = os.path.join(self.root, DONE_DIR, job_id)
+        try:
+            if result.get("error"):
+                log(f"[{layer_name}] Worker {result.get('worker', '')} output:\n{result.get('output', '')}")
+                raise RuntimeError(result["error"])
+            await asyncio.to_thread(self.stage_output, done_path, os.path.dirname(job['aedb_path']))
+            return {k: result[k] for k in ("zdiff", "dbs21", "coupons", "timing") if k in result}
+        finally:
+            await asyncio.to_thread(shutil.rmtree, done_path, ignore_errors=True)
+
+    async def wait_for_result(self, job_id, layer_name, iteration, log):
+        current_lease = None
+        while True:
+            result, lease_name, worker, requeued = await asyncio.to_thread(self.poll, job_id)
+            if result is not None:
+                return result
+            if lease_name and lease_name != current_lease:
+                log(f"[{layer_name}] Iter {iteration}: Running on {worker or 'a worker'}")
+                current_lease = lease_name
+            if requeued:
+                log(f"[{layer_name}] Iter {iteration}: Worker lost, job re-queued")
+                current_lease = None
+            await asyncio.sleep(self.poll_interval)
+
+    def close(self):
+        for process in self.workers:
+            kill_process_tree(process)
+        self.workers = []
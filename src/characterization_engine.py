@@ -1,93 +1,121 @@
+import asyncio
 import json
 import os
-import sys
-import subprocess
 import csv
+import copy
 import time
 from datetime import datetime
 import shutil
+import numpy as np
+from coarse_model import CoarseModel, SpaceMapping
+from cost_model import COST_FILE, SolveCostModel, append_solve_time, format_duration, load_solve_times, recorded_solve_times, solve_features
+from line_extraction import REFERENCE_LENGTH_MIL, STRUCTURE_LENGTHS_MIL
+from material_fit import fit_loss_parameters, load_curve, sweep_path
+from retention import RetentionManager
+from rlgc import RLGC_FILE, append_rlgc, extract_rlgc, insertion_s21_db, loss_query
+from scheduler import SolveSlots, expected_solves, layer_chains
+from sparam_archive import SParamArchive, load_sdd, sdd_path
+from stackup_model import Stackup, coupon_geometries, value_or
+from solvers import LocalSolver
 
-# Helper functions from original script
-def _get_python_exe():
-    """Get the python.exe path, even when launched via pythonw.exe.
-    
-    When the GUI is started with pythonw.exe, sys.executable points to pythonw.exe
-    which suppresses stdout/stderr. Subprocess calls need the console python.exe
-    to properly capture output and report errors.
-    """
-    exe = sys.executable
-    if exe.lower().endswith('pythonw.exe'):
-        exe = exe[:-len('pythonw.exe')] + 'python.exe'
-    return exe
+# Largest factor by which pre-flight widens the variation bounds of a phase
+MAX_BOUND_WIDENING = 3.0
+
+# Remaining errors within this many standard deviations of the solver noise are not chased further
+NOISE_SIGMAS = 2.0
+# Relative copper thickness change of the repeated solves that measure the noise: a new mesh, a negligible geometry change
+NOISE_PERTURBATION = 5e-4
+
+# Candidate values that change the meshed geometry; the rest are material and roughness values
+GEOMETRY_KEYS = ("thickness", "etch_factor")
+
+LAYER_SOURCES_FILE = "layer_sources.json"
 
-def _hidden_startupinfo():
-    si = subprocess.STARTUPINFO()
-    si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-    si.wShowWindow = subprocess.SW_HIDE
-    return si
+LOG_HEADER = ["iteration", "layer", "phase", "tuning_param", "width", "spacing", "thickness", "etch_factor", "hallhuray_surface_ratio", "nodule_radius", "dk_up", "dk_down", "df_up", "df_down", "Zdiff", "S21", "z_pass", "loss_pass", "solution"]
 
 def format_float(val):
     return "{:.9f}".format(float(val)).rstrip('0').rstrip('.')
 
-def safe_float(val, default=0):
-    """Convert value to float, returning default if value is empty string or None."""
-    if val is None or val == '':
-        return default
-    return float(val)
-
-def get_signal_layers(stackup_data):
-    signal_layers = []
-    for i, layer in enumerate(stackup_data['rows']):
-        if layer['type'] == 'conductor' and layer.get('width') and layer.get('spacing'):
-            signal_layers.append(i)
-    return signal_layers
-
-def extract_layer_params(stackup_data, layer_index):
-    rows = stackup_data['rows']
-    layer = rows[layer_index]
-    
-    # Search upwards for the nearest dielectric
-    diel_above = None
-    diel_above_idx = None
-    for j in range(layer_index - 1, -1, -1):
-        if rows[j]['type'] == 'dielectric':
-            diel_above = rows[j]
-            diel_above_idx = j
-            break
-            
-    # Search downwards for the nearest dielectric
-    diel_below = None
-    diel_below_idx = None
-    for j in range(layer_index + 1, len(rows)):
-        if rows[j]['type'] == 'dielectric':
-            diel_below = rows[j]
-            diel_below_idx = j
-            break
-    
+def extract_layer_params(stackup, layer_index):
+    """The signal layer at layer_index and its nearest dielectric on either side."""
+    layer = stackup.layers[layer_index]
     return {
         'layer_index': layer_index,
-        'diel_above_index': diel_above_idx,
-        'diel_below_index': diel_below_idx,
+        'diel_above_index': layer.diel_above,
+        'diel_below_index': layer.diel_below,
         'layer': layer,
-        'diel_above': diel_above,
-        'diel_below': diel_below
+        'diel_above': stackup.layers[layer.diel_above] if layer.diel_above is not None else None,
+        'diel_below': stackup.layers[layer.diel_below] if layer.diel_below is not None else None
     }
 
-def create_modeling_params(stackup_data, layer_params, current_values, output_aedb_path, signal_half, max_delta_s=0.02, freq_stop=5):
+def layer_values(layer_info):
+    """The tunable values of a signal layer and its neighbouring dielectrics, keyed as in the iteration log."""
+    layer = layer_info['layer']
+    values = {
+        'thickness': value_or(layer.thickness, 0),
+        'etch_factor': value_or(layer.etch_factor, 0),
+        'hallhuray_surface_ratio': value_or(layer.hallhuray_surface_ratio, 0),
+        'nodule_radius': value_or(layer.nodule_radius, 0),
+    }
+    
+    if layer_info['diel_above']:
+        values['dk_up'] = value_or(layer_info['diel_above'].dk, 1)
+        values['df_up'] = value_or(layer_info['diel_above'].df, 0)
+        
+    if layer_info['diel_below']:
+        values['dk_down'] = value_or(layer_info['diel_below'].dk, 1)
+        values['df_down'] = value_or(layer_info['diel_below'].df, 0)
+    return values
+
+def physical_bounds(key, lower, upper, etch_sign=1.0):
+    """Clip bounds to physical values:
+      - thickness, dk, df, hallhuray_surface_ratio, nodule_radius must be > 0
+      - etch_factor must keep the same sign as the initial input value (etch_sign)
+    """
+    if 'etch_factor' in key:
+        if etch_sign < 0:
+            upper = min(upper, -1e-9)  # Must stay negative
+        else:
+            lower = max(lower, 1e-9)   # Must stay positive
+    elif 'dk' in key:
+        # Dielectric constant must be >= 1
+        lower = max(lower, 1.0)
+    else:
+        lower = max(lower, 1e-9)
+    return lower, upper
+
+def variation_bounds(key, val, settings):
+    """Search range of a tunable value: its variation setting around the input value."""
+    variation = 0.2
+    if 'etch_factor' in key: variation = float(settings['etchfactor']['variation'].strip('%'))/100
+    elif 'thickness' in key: variation = float(settings['thickness']['variation'].strip('%'))/100
+    elif 'dk' in key: variation = float(settings['dk']['variation'].strip('%'))/100
+    elif 'df' in key: variation = float(settings['df']['variation'].strip('%'))/100
+    elif 'surface_ratio' in key: variation = float(settings['hallhuray_surface_ratio']['variation'].strip('%'))/100
+    elif 'nodule_radius' in key: variation = float(settings['nodule_radius']['variation'].strip('%'))/100
+
+    lower = val * (1 - variation) if val > 0 else val * (1 + variation)
+    upper = val * (1 + variation) if val > 0 else val * (1 - variation)
+    if lower > upper: lower, upper = upper, lower
+    return physical_bounds(key, lower, upper, 1.0 if val >= 0 else -1.0)
+
+def target_tolerances(settings):
+    """Relative (impedance, loss) tolerances."""
+    return (float(settings['impedance_target']['tolerance'].strip('%')) / 100,
+            float(settings['loss_target']['tolerance'].strip('%')) / 100)
+
+def create_modeling_params(stackup, layer_params, current_values, output_aedb_path, signal_half, max_delta_s=0.02, freq_stop=5, structure="full"):
     layer = layer_params['layer']
     diel_above = layer_params['diel_above']
     diel_below = layer_params['diel_below']
     
-    ref_layers_str = layer.get('reference_layers', '')
-    refs = [r.strip() for r in ref_layers_str.split('/')]
-    
     model_layers = []
     
     def make_layer_dict(l_data, override_params=None):
         d = {
-            "layername": l_data['layername'],
-            "type": "signal" if l_data['type'] == 'conductor' else "dielectric",
-            "thickness": f"{safe_float(l_data.get('thickness', 0))}mil",
+            "layername": l_data.name,
+            "type": "signal" if l_data.type == 'conductor' else "dielectric",
+            "thickness": f"{value_or(l_data.thickness, 0)}mil",
         }
         
         if override_params:
@@ -98,9 +126,9 @@ def create_modeling_params(stackup_data, layer_params, current_values, output_ae
 
         if d['type'] == 'signal':
             d['material'] = "copper"
-            d['etch_factor'] = safe_float(l_data.get('etchfactor'), 0)
-            d['hallhuray_surface_ratio'] = safe_float(l_data.get('hallhuray_surface_ratio'), 0)
-            d['nodule_radius'] = f"{safe_float(l_data.get('nodule_radius'), 0)}um"
+            d['etch_factor'] = value_or(l_data.etch_factor, 0)
+            d['hallhuray_surface_ratio'] = value_or(l_data.hallhuray_surface_ratio, 0)
+            d['nodule_radius'] = f"{value_or(l_data.nodule_radius, 0)}um"
             
             if override_params:
                 if 'etch_factor' in override_params: d['etch_factor'] = override_params['etch_factor']
@@ -108,8 +136,8 @@ def create_modeling_params(stackup_data, layer_params, current_values, output_ae
                 if 'nodule_radius' in override_params: d['nodule_radius'] = f"{override_params['nodule_radius']}um"
 
         else:
-            dk_val = safe_float(l_data.get('dk'), 1)
-            df_val = safe_float(l_data.get('df'), 0)
+            dk_val = value_or(l_data.dk, 1)
+            df_val = value_or(l_data.df, 0)
             
             if override_params:
                 if 'dk' in override_params: dk_val = override_params['dk']
@@ -117,22 +145,14 @@ def create_modeling_params(stackup_data, layer_params, current_values, output_ae
             
             d['dk'] = format_float(dk_val)
             d['df'] = format_float(df_val)
-            d['material_name'] = f"mat_{l_data['layername']}"
+            d['material_name'] = f"mat_{l_data.name}"
         
         return d
 
-    def find_layer_by_name(name):
-        for l in stackup_data['rows']:
-            if l['layername'] == name:
-                return l
-        return None
-
-    ref_top_name = refs[0] if len(refs) > 0 and refs[0] != 'None' else None
-    ref_bot_name = refs[1] if len(refs) > 1 and refs[1] != 'None' else None
+    ref_top_name, ref_bot_name = layer.ref_names
 
-    if ref_top_name:
-        l = find_layer_by_name(ref_top_name)
-        if l: model_layers.append(make_layer_dict(l))
+    if layer.ref_above is not None:
+        model_layers.append(make_layer_dict(stackup.layers[layer.ref_above]))
         
     if diel_above:
         overrides = {}
@@ -154,55 +174,240 @@ def create_modeling_params(stackup_data, layer_params, current_values, output_ae
         if 'df_down' in current_values: overrides['df'] = current_values['df_down']
         model_layers.append(make_layer_dict(diel_below, overrides))
         
-    if ref_bot_name:
-        l = find_layer_by_name(ref_bot_name)
-        if l: model_layers.append(make_layer_dict(l))
+    if layer.ref_below is not None:
+        model_layers.append(make_layer_dict(stackup.layers[layer.ref_below]))
 
     trace_params = {
-        "width_mil": float(layer['width']),
-        "spacing_mil": float(layer['spacing'])
+        "width_mil": layer.width,
+        "spacing_mil": layer.spacing
     }
     
     ref_layers_list = []
     if ref_top_name: ref_layers_list.append(ref_top_name)
     if ref_bot_name: ref_layers_list.append(ref_bot_name)
 
-    return {
+    params = {
         "output_aedb_path": output_aedb_path,
-        "frequency": stackup_data['frequency'],
+        "frequency": stackup.frequency,
         "max_delta_s": max_delta_s,
         "freq_stop": freq_stop,
-        "target_layer": layer['layername'],
+        "structure": {
+            "mode": structure,
+            "line_lengths_mil": STRUCTURE_LENGTHS_MIL[structure],
+            "reference_length_mil": REFERENCE_LENGTH_MIL,
+        },
+        "target_layer": layer.name,
         "trace_params": trace_params,
         "ref_layers": ref_layers_list,
         "layers": model_layers,
         "signal_half": signal_half,
-        "copper_conductivity": stackup_data.get('copper_conductivity', 5.8e7)
+        "copper_conductivity": stackup.copper_conductivity
     }
+    # Coupon geometries are laid out next to the layer's own pair, each with its own ports
+    coupons = coupon_geometries(layer)
+    if coupons:
+        params["coupons"] = [{"width_mil": c["width"], "spacing_mil": c["spacing"]} for c in coupons]
+    return params
+
+def canonical_problem_key(stackup, layer_params, signal_half, max_delta_s=0.02, freq_stop=5, structure="full"):
+    """Name-independent key of a layer's modeling problem.
+
+    Two signal layers with the same key build the same model (geometry, materials,
+    reference structure, solver settings) and chase the same targets, so one
+    characterization serves both.
+    """
+    layer = layer_params['layer']
+    params = create_modeling_params(stackup, layer_params, {}, "", signal_half,
+                                    max_delta_s=max_delta_s, freq_stop=freq_stop, structure=structure)
+    layer_names = [l['layername'] for l in params['layers']]
+    params['ref_layers'] = [layer_names.index(name) if name in layer_names else None for name in params['ref_layers']]
+
+    # signal_half only matters through the fill material modeling.py picks for the
+    # signal layer, so key on the resolved fill dielectric instead.
+    model_layers = params['layers']
+    sig_pos = layer_names.index(params['target_layer'])
+    above = model_layers[sig_pos - 1] if sig_pos > 0 and model_layers[sig_pos - 1]['type'] == 'dielectric' else None
+    below = model_layers[sig_pos + 1] if sig_pos < len(model_layers) - 1 and model_layers[sig_pos + 1]['type'] == 'dielectric' else None
+    if signal_half == 'top' and sig_pos > 0:
+        fill = above
+    elif signal_half == 'bottom' and sig_pos < len(model_layers) - 1:
+        fill = below
+    else:
+        fill = above or below
+    params['fill'] = [fill['dk'], fill['df']] if fill else None
+    del params['signal_half']
+    params['layers'] = [{k: v for k, v in l.items() if k not in ('layername', 'material_name')} for l in params['layers']]
+    del params['output_aedb_path']
+    del params['target_layer']
+    params['targets'] = [value_or(layer.impedance_target, 0), value_or(layer.loss_target, 0), layer.get('measured_s21') or None,
+                         layer.get('loss_length') or None, layer.get('loss_frequency') or None,
+                         [[c['impedance_target'], c['loss_target']] for c in coupon_geometries(layer)] or None]
+    return json.dumps(params, sort_keys=True)
+
+def solved_project(aedb_path):
+    """The saved AEDT project of a solve (its warm-started copy if it has one), or None while missing or still open."""
+    stem = os.path.splitext(aedb_path)[0]
+    for project in (stem + "_warm.aedt", stem + ".aedt"):
+        if os.path.exists(project):
+            return None if os.path.exists(project + ".lock") else project
+    return None
+
+def warm_start_source(solved, values):
+    """The nearest solved candidate with the same geometry as values, as (iteration, project).
+
+    solved holds (iteration, values, aedb_path) of a layer's finished solves.
+    Only material and roughness values may differ: they do not move the mesh,
+    while any change of copper thickness or etch factor makes AEDT discard it.
+    Returns None when no such project is left on disk.
+    """
+    best = None
+    for iteration, past, aedb_path in solved:
+        if any(abs(values[k] - past[k]) > 1e-9 * max(abs(past[k]), 1) for k in GEOMETRY_KEYS if k in values):
+            continue
+        distance = sum(((values[k] - past[k]) / (abs(past[k]) or 1)) ** 2 for k in values)
+        if best is None or distance < best[0]:
+            project = solved_project(aedb_path)
+            if project:
+                best = (distance, iteration, project)
+    return best[1:] if best else None
 
 def save_json(data, json_path):
     with open(json_path, 'w') as f:
         json.dump(data, f, indent=2)
 
+def load_history(log_path):
+    """Read a characterization_log.csv into a list of row dicts (empty if missing)."""
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path, 'r', newline='') as f:
+        return list(csv.DictReader(f))
+
+def reconstruct_input(characterized, history):
+    """Rebuild the input stackup of a run that predates input_stackup.json.
+
+    Each layer's 'initial' history row holds the values it started from. A shared
+    dielectric takes the values seen by the first layer that used it, because later
+    layers already start from that layer's tuned result.
+    """
+    stackup = characterized.copy()
+    seen_diels = set()
+    for row in history:
+        layer = stackup.layer(row['layer'])
+        if row['tuning_param'] != 'initial' or layer is None:
+            continue
+        for col in ('thickness', 'etch_factor', 'hallhuray_surface_ratio', 'nodule_radius'):
+            if row.get(col, '') != '':
+                setattr(layer, col, float(row[col]))
+        for diel_idx, suffix in ((layer.diel_above, 'up'), (layer.diel_below, 'down')):
+            if diel_idx is None or diel_idx in seen_diels:
+                continue
+            seen_diels.add(diel_idx)
+            for prop in ('dk', 'df'):
+                if row.get(f'{prop}_{suffix}', '') != '':
+                    setattr(stackup.layers[diel_idx], prop, float(row[f'{prop}_{suffix}']))
+    return stackup
+
+def find_changed_layers(new, prev, symmetry=False, max_delta_s=0.02, freq_stop=5, structure="full"):
+    """Return the signal row indices of new_data that must be re-characterized.
+
+    A layer is changed when its canonical modeling problem differs from the previous
+    input. Layers that share a dielectric with a changed layer (or are its symmetric
+    partner) are affected too, since re-tuning one moves the other's dielectric.
+    """
+    signal_indices = new.signal_indices
+    same_structure = [(l.name, l.type) for l in new.layers] == [(l.name, l.type) for l in prev.layers]
+    same_globals = all(new.meta.get(k) == prev.meta.get(k) for k in ('frequency', 'settings', 'copper_conductivity'))
+    if not same_structure or not same_globals or prev.signal_indices != signal_indices:
+        return set(signal_indices)
+
+    midpoint = len(signal_indices) // 2
+    changed = set()
+    for i, idx in enumerate(signal_indices):
+        signal_half = "top" if i < midpoint else "bottom"
+        new_key = canonical_problem_key(new, extract_layer_params(new, idx), signal_half, max_delta_s, freq_stop, structure)
+        prev_key = canonical_problem_key(prev, extract_layer_params(prev, idx), signal_half, max_delta_s, freq_stop, structure)
+        if new_key != prev_key:
+            changed.add(idx)
+
+    # Link layers that share a dielectric or mirror each other, then close over the links
+    links = {idx: set() for idx in signal_indices}
+    users = {}
+    for idx in signal_indices:
+        for diel_idx in (new.layers[idx].diel_above, new.layers[idx].diel_below):
+            if diel_idx is not None:
+                users.setdefault(diel_idx, set()).add(idx)
+    for group in users.values():
+        for idx in group:
+            links[idx] |= group - {idx}
+    if symmetry:
+        for i, idx in enumerate(signal_indices):
+            partner = signal_indices[len(signal_indices) - 1 - i]
+            if partner != idx:
+                links[idx].add(partner)
+
+    pending = list(changed)
+    while pending:
+        idx = pending.pop()
+        for other in links[idx]:
+            if other not in changed:
+                changed.add(other)
+                pending.append(other)
+    return changed
+
 class CharacterizationEngine:
-    def __init__(self, json_data, max_iter, log_callback=None, stats_callback=None, output_base_dir=None, symmetry=False, max_delta_s=0.02, freq_stop=5):
-        self.data = json_data
+    def __init__(self, json_data, max_iter, log_callback=None, stats_callback=None, output_base_dir=None, symmetry=False, max_delta_s=0.02, freq_stop=5, dedup=False, previous_run_dir=None, solver=None, structure="full", touchstone=False, retention=None, warm_start=False, port_only=False, solver_slots=1, cores=20, preflight=None, noise_repeats=0, optimizer="bisection", joint=False):
+        self.stackup = Stackup.from_json(json_data)
+        self.solver = solver if solver is not None else LocalSolver()
+        self.input_data = copy.deepcopy(json_data)
+        self.previous_run_dir = previous_run_dir
         self.max_iter = max_iter
         self.log_callback = log_callback
         self.stats_callback = stats_callback
         self.symmetry = symmetry
+        self.dedup = dedup
+        self.layer_stats = {}
+        self._loop = None
+        self._task = None
+        self._cancel_requested = False  # cancel() may come before run_async has a loop to cancel on
+        self._resume_event = None
         self.max_delta_s = max_delta_s
         self.freq_stop = freq_stop
+        self.structure = structure
+        self.touchstone = touchstone
+        self.retention_options = retention or {}
+        self.warm_start = bool(warm_start)  # solves reuse the mesh of an earlier candidate with the same geometry
+        self.port_only = port_only  # impedance-phase candidates get a port-only (2D) solve
+        self.solver_slots = max(1, int(solver_slots))  # solves running at the same time, shared by all layers
+        self.slots = None
+        self.remaining = {}  # layer -> predicted solves still needed
+        self.chain_tail = {}  # layer -> predicted solves of the layers queued after it in its chain
+        self.history_solves = {}  # layer -> solves it took in the previous run
+        self.active_layers = 0
+        self.preflight = preflight  # None, "skip" or "widen": what to do with a layer whose targets lie beyond its bounds
+        self.noise_repeats = max(0, int(noise_repeats))  # extra solves of the starting point that measure solver noise
+        self.optimizer = optimizer  # "bisection" (one parameter at a time) or "space_mapping" (on a coarse analytic model)
+        self.joint = joint  # layers sharing a dielectric are characterized together, the dielectric as one unknown
+        self.tuned_by = {}  # dielectric row index -> signal layer whose result set its dk/df
+        self.layer_sources = {}  # layer copied from another -> {"source": layer name, "mirror": up/down swapped}
+        self.total_cores = max(1, int(cores))  # cores shared by the solves running at the same time
+        self.cores_in_use = 0
+        self.cost_model = SolveCostModel()
+        self.layer_features = {}  # layer -> cost model inputs of its latest full-wave solve
+        self.schedule = []  # chains of layer names still to characterize, for the run ETA
+        self.last_eta_log = 0
         
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
         base = output_base_dir if output_base_dir else os.getcwd()
+        self.base_dir = base
         self.output_dir = os.path.join(base, f"stackup_characterization_{ts}")
         os.makedirs(self.output_dir, exist_ok=True)
         
         self.log_file = os.path.join(self.output_dir, "characterization_log.csv")
         with open(self.log_file, 'w', newline='') as f:
             writer = csv.writer(f)
-            writer.writerow(["iteration", "layer", "phase", "tuning_param", "width", "spacing", "thickness", "etch_factor", "hallhuray_surface_ratio", "nodule_radius", "dk_up", "dk_down", "df_up", "df_down", "Zdiff", "S21", "z_pass", "loss_pass"])
+            writer.writerow(LOG_HEADER)
+        self.sparams = SParamArchive(self.output_dir)
+        self.rlgc_path = os.path.join(self.output_dir, RLGC_FILE)
 
     def log(self, msg):
         print(msg)
@@ -210,148 +415,551 @@ class CharacterizationEngine:
             self.log_callback(msg)
 
     def update_stats(self, layer_name, stats):
+        self.layer_stats[layer_name] = dict(stats)
         if self.stats_callback:
             self.stats_callback(layer_name, stats)
 
+    def apply_optimized_params(self, layer_index, optimized_params, mirror=False):
+        """Write optimized values into the signal row at layer_index and its dielectrics.
+
+        With mirror=True the up/down dielectric values are swapped, which is how a
+        top-half result maps onto its symmetric bottom-half layer.
+        """
+        layer = self.stackup.layers[layer_index]
+        for key in ('thickness', 'etch_factor', 'hallhuray_surface_ratio', 'nodule_radius'):
+            if key in optimized_params:
+                setattr(layer, key, float(optimized_params[key]))
+
+        layer_info = extract_layer_params(self.stackup, layer_index)
+        above_suffix, below_suffix = ('down', 'up') if mirror else ('up', 'down')
+        for diel, suffix in ((layer_info['diel_above'], above_suffix), (layer_info['diel_below'], below_suffix)):
+            if diel:
+                if f'dk_{suffix}' in optimized_params: diel.dk = float(optimized_params[f'dk_{suffix}'])
+                if f'df_{suffix}' in optimized_params: diel.df = float(optimized_params[f'df_{suffix}'])
+
+    def carry_over_previous_run(self, signal_indices):
+        """Copy results of layers whose modeling problem did not change since the previous run.
+
+        Returns the set of signal row indices that were carried over and need no
+        optimization in this run.
+        """
+        prev_dir = self.previous_run_dir
+        prev_final_path = os.path.join(prev_dir, "characterized_stackup.json")
+        if not os.path.exists(prev_final_path):
+            self.log(f"Incremental: {prev_final_path} not found, characterizing all layers.")
+            return set()
+
+        with open(prev_final_path, 'r', encoding='utf-8-sig') as f:
+            prev_final = Stackup.from_json(json.load(f))
+        history = load_history(os.path.join(prev_dir, "characterization_log.csv"))
+
+        prev_input_path = os.path.join(prev_dir, "input_stackup.json")
+        if os.path.exists(prev_input_path):
+            with open(prev_input_path, 'r', encoding='utf-8-sig') as f:
+                prev_input = Stackup.from_json(json.load(f))
+        else:
+            self.log("Incremental: previous input not saved, reconstructing it from the iteration history.")
+            prev_input = reconstruct_input(prev_final, history)
+
+        prev_info_path = os.path.join(prev_dir, "run_info.json")
+        if os.path.exists(prev_info_path):
+            with open(prev_info_path, 'r') as f:
+                prev_info = json.load(f)
+            prev_info.setdefault("structure", "full")  # runs from before compact structures
+            if prev_info != self.run_info():
+                self.log(f"Incremental: run settings changed ({prev_info} -> {self.run_info()}), characterizing all layers.")
+                return set()
+
+        changed = find_changed_layers(self.stackup, prev_input, symmetry=self.symmetry,
+                                      max_delta_s=self.max_delta_s, freq_stop=self.freq_stop, structure=self.structure)
+        carried = set(idx for idx in signal_indices if idx not in changed)
+
+        history_rows = []
+        for idx in sorted(carried):
+            layer = self.stackup.layers[idx]
+            prev_layer = prev_final.layers[idx]
+            for key in ('thickness', 'etch_factor', 'hallhuray_surface_ratio', 'nodule_radius'):
+                setattr(layer, key, getattr(prev_layer, key))
+            for diel_idx in (layer.diel_above, layer.diel_below):
+                if diel_idx is not None:
+                    self.stackup.layers[diel_idx].dk = prev_final.layers[diel_idx].dk
+                    self.stackup.layers[diel_idx].df = prev_final.layers[diel_idx].df
+
+            layer_rows = [r for r in history if r['layer'] == layer.name]
+            full_rows = [r for r in layer_rows if r['S21'] != '']
+            history_rows.extend(layer_rows)
+            self.update_stats(layer.name, {
+                "status": "Done (carried)",
+                "iterations": len(layer_rows) if layer_rows else "-",
+                "target_z": value_or(layer.impedance_target, 0),
+                "target_loss": value_or(layer.loss_target, 0),
+                "best_z": float(layer_rows[-1]['Zdiff']) if layer_rows else "-",
+                "best_loss": float(full_rows[-1]['S21']) if full_rows else "-",
+                "time_elapsed": "-"
+            })
+
+        # Carried layers that were copied from another keep pointing at it
+        prev_sources_path = os.path.join(prev_dir, LAYER_SOURCES_FILE)
+        if os.path.exists(prev_sources_path):
+            with open(prev_sources_path, 'r') as f:
+                prev_sources = json.load(f)
+            for idx in carried:
+                if self.stackup.layers[idx].name in prev_sources:
+                    self.layer_sources[self.stackup.layers[idx].name] = prev_sources[self.stackup.layers[idx].name]
+
+        # Keep the history of carried layers so this run's log stays complete
+        with open(self.log_file, 'a', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            for r in history_rows:
+                writer.writerow([r.get(col, '') for col in LOG_HEADER])
+
+        changed_names = [self.stackup.layers[idx].name for idx in signal_indices if idx in changed]
+        self.log(f"Incremental: {len(carried)} layers carried over, re-characterizing {', '.join(changed_names) or 'none'}")
+        return carried
+
+    def predicted_solves(self, layer_name):
+        """Solves a layer still needs: from its errors once it runs, else its previous run, else max_iter."""
+        if layer_name in self.remaining:
+            return self.remaining[layer_name]
+        return min(self.history_solves.get(layer_name, self.max_iter), self.max_iter)
+
+    def speculation_width(self, budget):
+        """Candidates a layer may solve at once: the free slots, less one kept for each other running layer."""
+        return max(1, min(budget, self.slots.free - (self.active_layers - 1)))
+
+    def allocate_cores(self, features):
+        """Cores for a solve about to start: the knee of its predicted speedup curve within its share of the idle cores.
+
+        A share is kept back for each other unfinished chain that may claim an idle slot next.
+        """
+        open_chains = sum(1 for chain in self.schedule if any(self.remaining.get(name) != 0 for name in chain))
+        claimants = max(0, min(self.slots.slots - self.slots.busy, open_chains - 1))
+        share = (self.total_cores - self.cores_in_use) // (1 + claimants)
+        return self.cost_model.pick_cores(features, max(1, share))
+
+    def layer_eta(self, layer_name):
+        """Predicted seconds a layer still needs, or None until the cost model has data."""
+        features = self.layer_features.get(layer_name) or next(iter(self.layer_features.values()), None)
+        if features is None:
+            return None
+        cores = self.cost_model.knee_cores(features, max(1, self.total_cores // self.solver_slots))
+        per_solve = self.cost_model.predict(features, cores)
+        return None if per_solve is None else per_solve * self.predicted_solves(layer_name)
+
+    def run_eta(self):
+        """Predicted seconds until all layers are done: the longest chain, or the total work spread over the slots."""
+        chains = [[self.layer_eta(name) for name in chain] for chain in self.schedule]
+        if any(eta is None for chain in chains for eta in chain):
+            return None
+        totals = [sum(chain) for chain in chains]
+        return max(max(totals, default=0), sum(totals) / self.solver_slots)
+
+    def full_stackup_params(self, full_aedb_path, mode):
+        return {
+            "mode": mode,
+            "output_aedb_path": full_aedb_path,
+            "stackup_data": self.stackup.to_json(),
+            "copper_conductivity": self.stackup.copper_conductivity
+        }
+
+    def resolve_input_path(self, path):
+        """Files named in the stackup JSON may be relative to the working or the output base folder."""
+        if os.path.isabs(path) or os.path.exists(path):
+            return path
+        return os.path.join(self.base_dir, path)
+
+    def run_info(self):
+        return {"symmetry": self.symmetry, "max_delta_s": self.max_delta_s, "freq_stop": self.freq_stop, "structure": self.structure}
+
     def run(self):
+        """Blocking entry point. Raises asyncio.CancelledError if cancel() was called."""
+        asyncio.run(self.run_async())
+
+    def cancel(self):
+        """Stop the run from any thread. Running solver processes are killed."""
+        self._cancel_requested = True
+        if self._loop and self._task:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+    def pause(self):
+        """Hold new evaluations from any thread; evaluations already running finish."""
+        if self._loop and self._resume_event:
+            self.log("Pausing after the running evaluations finish...")
+            self._loop.call_soon_threadsafe(self._resume_event.clear)
+
+    def resume(self):
+        if self._loop and self._resume_event:
+            self.log("Resuming.")
+            self._loop.call_soon_threadsafe(self._resume_event.set)
+
+    async def wait_if_paused(self):
+        if not self._resume_event.is_set():
+            self.log("Paused.")
+            await self._resume_event.wait()
+
+    async def run_async(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        if self._cancel_requested:
+            raise asyncio.CancelledError()
+        self._resume_event = asyncio.Event()
+        self._resume_event.set()
+
         self.log(f"Starting characterization. Output dir: {self.output_dir}")
         self.log(f"Symmetry Mode: {'Enabled' if self.symmetry else 'Disabled'}")
+        self.log(f"Layer Deduplication: {'Enabled' if self.dedup else 'Disabled'}")
+        self.log(f"Structure: {self.structure} ({' + '.join(f'{l} mil' for l in STRUCTURE_LENGTHS_MIL[self.structure])})")
+        self.retention = RetentionManager(self.output_dir, log=self.log, **self.retention_options)
+        if self.retention.mode != "keep":
+            self.log(f"Retention: {self.retention.mode} all but the best {self.retention.keep_best} and last {self.retention.keep_last} iterations per layer")
+        if self.warm_start and getattr(self.solver, "remote", False):
+            # A source project is a path on this machine, which a worker on another host cannot open
+            self.warm_start = False
+            self.log("Warning: warm start is disabled, broker workers cannot open the solved projects of this machine")
+        if self.warm_start:
+            self.log("Warm start: solves reuse the mesh of the nearest solved candidate with the same copper thickness and etch factor")
+        if self.port_only:
+            self.log("Port-only impedance: impedance tuning solves the wave port only, loss and results are verified full-wave")
+        if self.joint:
+            self.log("Joint dielectrics: layers sharing a dielectric are fitted together by space mapping, each shared dk/df once")
+            ignored = self.joint_ignored_options()
+            if ignored:
+                self.log(f"Warning: layers fitted jointly ignore {', '.join(ignored)}; "
+                         "layers that share no dielectric are not affected")
+        save_json(self.input_data, os.path.join(self.output_dir, "input_stackup.json"))
+        save_json(self.run_info(), os.path.join(self.output_dir, "run_info.json"))
         
-        signal_indices = get_signal_layers(self.data)
+        signal_indices = self.stackup.signal_indices
         self.log(f"Found {len(signal_indices)} signal layers to characterize.")
+
+        carried = set()
+        if self.previous_run_dir:
+            self.log(f"Incremental Mode: comparing against {self.previous_run_dir}")
+            carried = self.carry_over_previous_run(signal_indices)
+
+        # Build the full stackup model in the background while layers are optimized
+        full_aedb_path = os.path.join(self.output_dir, "full_stackup.aedb")
+        builder = None
+        try:
+            builder_params_path = os.path.join(self.output_dir, "full_stackup_builder_params.json")
+            save_json(self.full_stackup_params(full_aedb_path, "full_stackup_server"), builder_params_path)
+            builder = self.solver.full_stackup_builder(builder_params_path, self.log)
+        except Exception as e:
+            self.log(f"Failed to start full stackup builder: {e}")
         
-        midpoint = len(signal_indices) // 2
-        
-        for i, idx in enumerate(signal_indices):
-            layer_name = self.data['rows'][idx]['layername']
-            
-            if self.symmetry and i >= midpoint:
-                self.log(f"Skipping optimization for bottom layer {layer_name} (Symmetry enabled)")
-                continue
+        self.slots = SolveSlots(self.solver_slots)
+        self.cost_path = os.path.join(self.output_dir, COST_FILE)
+        cost_rows = recorded_solve_times(self.base_dir)
+        if self.previous_run_dir and os.path.dirname(os.path.abspath(self.previous_run_dir)) != os.path.abspath(self.base_dir):
+            cost_rows += load_solve_times(os.path.join(self.previous_run_dir, COST_FILE))
+        self.cost_model = SolveCostModel(cost_rows)
+        if self.cost_model.rows:
+            self.log(f"Solve time model: fitted on {len(self.cost_model.rows)} recorded solves, {self.total_cores} cores")
+        if self.previous_run_dir:
+            for row in load_history(os.path.join(self.previous_run_dir, "characterization_log.csv")):
+                self.history_solves[row['layer']] = self.history_solves.get(row['layer'], 0) + 1
 
-            signal_half = "top" if i < midpoint else "bottom"
-            optimized_params = self.optimize_layer(idx, signal_half)
-            
-            # Update data with optimized params
-            layer = self.data['rows'][idx]
-            if 'thickness' in optimized_params: layer['thickness'] = str(optimized_params['thickness'])
-            if 'etch_factor' in optimized_params: layer['etchfactor'] = str(optimized_params['etch_factor'])
-            if 'hallhuray_surface_ratio' in optimized_params: layer['hallhuray_surface_ratio'] = str(optimized_params['hallhuray_surface_ratio'])
-            if 'nodule_radius' in optimized_params: layer['nodule_radius'] = str(optimized_params['nodule_radius'])
-            
-            layer_info = extract_layer_params(self.data, idx)
-            if layer_info['diel_above']:
-                if 'dk_up' in optimized_params: layer_info['diel_above']['dk'] = str(optimized_params['dk_up'])
-                if 'df_up' in optimized_params: layer_info['diel_above']['df'] = str(optimized_params['df_up'])
-                
-            if layer_info['diel_below']:
-                if 'dk_down' in optimized_params: layer_info['diel_below']['dk'] = str(optimized_params['dk_down'])
-                if 'df_down' in optimized_params: layer_info['diel_below']['df'] = str(optimized_params['df_down'])
-
-            # Apply to symmetric layer if enabled
-            if self.symmetry:
-                sym_idx_in_list = len(signal_indices) - 1 - i
-                if sym_idx_in_list > i: # Ensure we don't double apply to middle layer if odd count
-                    sym_layer_idx = signal_indices[sym_idx_in_list]
-                    sym_layer_name = self.data['rows'][sym_layer_idx]['layername']
-                    self.log(f"Applying symmetric params from {layer_name} to {sym_layer_name}")
-                    
-                    sym_layer = self.data['rows'][sym_layer_idx]
-                    if 'thickness' in optimized_params: sym_layer['thickness'] = str(optimized_params['thickness'])
-                    if 'etch_factor' in optimized_params: sym_layer['etchfactor'] = str(optimized_params['etch_factor'])
-                    if 'hallhuray_surface_ratio' in optimized_params: sym_layer['hallhuray_surface_ratio'] = str(optimized_params['hallhuray_surface_ratio'])
-                    if 'nodule_radius' in optimized_params: sym_layer['nodule_radius'] = str(optimized_params['nodule_radius'])
-                    
-                    sym_layer_info = extract_layer_params(self.data, sym_layer_idx)
-                    
-                    # Map Top-Up -> Bottom-Down, Top-Down -> Bottom-Up
-                    # diel_above (Top) -> diel_below (Bottom)
-                    if sym_layer_info['diel_below']:
-                         if 'dk_up' in optimized_params: sym_layer_info['diel_below']['dk'] = str(optimized_params['dk_up'])
-                         if 'df_up' in optimized_params: sym_layer_info['diel_below']['df'] = str(optimized_params['df_up'])
-                    
-                    # diel_below (Top) -> diel_above (Bottom)
-                    if sym_layer_info['diel_above']:
-                         if 'dk_down' in optimized_params: sym_layer_info['diel_above']['dk'] = str(optimized_params['dk_down'])
-                         if 'df_down' in optimized_params: sym_layer_info['diel_above']['df'] = str(optimized_params['df_down'])
-                    
-                    # Update stats for symmetric layer to show it's done
-                    self.update_stats(sym_layer_name, {
-                        "status": "Done (Sym)",
+        try:
+            midpoint = len(signal_indices) // 2
+            position = {idx: i for i, idx in enumerate(signal_indices)}
+            solved_problems = {}  # canonical problem key -> future of (source layer name, optimized params)
+
+            async def characterize_layer(idx):
+                i = position[idx]
+                layer_name = self.stackup.layers[idx].name
+                signal_half = "top" if i < midpoint else "bottom"
+
+                # The key is taken from the current data, so a layer whose dielectric was
+                # re-tuned by an earlier layer no longer matches that layer's problem.
+                problem_key = None
+                if self.dedup:
+                    problem_key = canonical_problem_key(self.stackup, extract_layer_params(self.stackup, idx), signal_half,
+                                                        max_delta_s=self.max_delta_s, freq_stop=self.freq_stop, structure=self.structure)
+
+                if problem_key in solved_problems:
+                    # With several chains the source layer may still be running
+                    source_name, optimized_params = await solved_problems[problem_key]
+                    self.log(f"Layer {layer_name} has the same modeling problem as {source_name}, sharing its results")
+                    self.layer_sources[layer_name] = {"source": source_name, "mirror": False}
+                    source_stats = self.layer_stats.get(source_name, {})
+                    self.update_stats(layer_name, {
+                        "status": "Done (shared)",
                         "iterations": "-",
-                        "target_z": float(sym_layer.get('impedance_target', 0)),
-                        "target_loss": float(sym_layer.get('loss_target', 0)),
-                        "best_z": "-",
-                        "best_loss": "-",
+                        "target_z": value_or(self.stackup.layers[idx].impedance_target, 0),
+                        "target_loss": value_or(self.stackup.layers[idx].loss_target, 0),
+                        "best_z": source_stats.get('best_z', '-'),
+                        "best_loss": source_stats.get('best_loss', '-'),
                         "time_elapsed": "-"
                     })
+                else:
+                    for diel_idx in (self.stackup.layers[idx].diel_above, self.stackup.layers[idx].diel_below):
+                        if diel_idx in self.tuned_by:
+                            self.log(f"[{layer_name}] Re-tuning dielectric {self.stackup.layers[diel_idx].name}, already characterized "
+                                     f"with {self.tuned_by[diel_idx]}; --joint-dielectrics fits both layers together")
+                    shared = None
+                    if problem_key is not None:
+                        shared = solved_problems[problem_key] = asyncio.get_running_loop().create_future()
+                    self.active_layers += 1
+                    try:
+                        optimized_params = await self.optimize_layer(idx, signal_half)
+                        if shared is not None:
+                            shared.set_result((layer_name, optimized_params))
+                    finally:
+                        self.active_layers -= 1
+                        self.remaining[layer_name] = 0
+                        if shared is not None and not shared.done():
+                            shared.cancel()
+
+                apply_result(idx, optimized_params)
+
+            async def characterize_joint(chain):
+                names = [self.stackup.layers[idx].name for idx in chain]
+                self.active_layers += len(chain)
+                try:
+                    results = await self.optimize_joint(chain, {idx: "top" if position[idx] < midpoint else "bottom" for idx in chain})
+                finally:
+                    self.active_layers -= len(chain)
+                    for name in names:
+                        self.remaining[name] = 0
+                for idx in chain:
+                    apply_result(idx, results[idx])
+
+            def apply_result(idx, optimized_params):
+                i = position[idx]
+                layer_name = self.stackup.layers[idx].name
+
+                # Update data with optimized params
+                self.apply_optimized_params(idx, optimized_params)
+                for diel_idx in (self.stackup.layers[idx].diel_above, self.stackup.layers[idx].diel_below):
+                    if diel_idx is not None:
+                        self.tuned_by[diel_idx] = layer_name
+
+                # Apply to symmetric layer if enabled
+                if self.symmetry:
+                    sym_idx_in_list = len(signal_indices) - 1 - i
+                    if sym_idx_in_list > i: # Ensure we don't double apply to middle layer if odd count
+                        sym_layer_idx = signal_indices[sym_idx_in_list]
+                        sym_layer = self.stackup.layers[sym_layer_idx]
+                        sym_layer_name = sym_layer.name
+                        self.log(f"Applying symmetric params from {layer_name} to {sym_layer_name}")
+                    
+                        # Map Top-Up -> Bottom-Down, Top-Down -> Bottom-Up
+                        self.apply_optimized_params(sym_layer_idx, optimized_params, mirror=True)
+                        self.layer_sources[sym_layer_name] = {"source": layer_name, "mirror": True}
+                    
+                        # Update stats for symmetric layer to show it's done
+                        self.update_stats(sym_layer_name, {
+                            "status": "Done (Sym)",
+                            "iterations": "-",
+                            "target_z": value_or(sym_layer.impedance_target, 0),
+                            "target_loss": value_or(sym_layer.loss_target, 0),
+                            "best_z": "-",
+                            "best_loss": "-",
+                            "time_elapsed": "-"
+                        })
+
+                if builder:
+                    builder.update(self.stackup.to_json())
+
+            pending = []
+            for i, idx in enumerate(signal_indices):
+                if idx in carried:
+                    continue
+                if self.symmetry and i >= midpoint:
+                    self.log(f"Skipping optimization for bottom layer {self.stackup.layers[idx].name} (Symmetry enabled)")
+                    continue
+                pending.append(idx)
 
-        # Final Step: Create Full Stackup
-        self.log("Creating full stackup model...")
-        final_json_path = os.path.join(self.output_dir, "characterized_stackup.json")
-        save_json(self.data, final_json_path)
-        
-        full_aedb_path = os.path.join(self.output_dir, "full_stackup.aedb")
+            if self.solver_slots == 1 and not self.joint:
+                self.schedule = [[self.stackup.layers[idx].name for idx in pending]]
+                for idx in pending:
+                    await characterize_layer(idx)
+            else:
+                # Layers sharing a dielectric run in stackup order, separate chains run side by side.
+                # The longest predicted chain starts first so the run ends with its critical path.
+                # Chains are grouped over all signal layers, so layers linked through a carried or
+                # mirrored layer stay in one chain.
+                chains = [[idx for idx in chain if idx in pending] for chain in layer_chains(self.stackup, signal_indices)]
+                chains = [chain for chain in chains if chain]
+                names = {idx: self.stackup.layers[idx].name for idx in pending}
+                for chain in chains:
+                    for n, idx in enumerate(chain):
+                        self.chain_tail[names[idx]] = sum(self.predicted_solves(names[other]) for other in chain[n + 1:])
+                chains.sort(key=lambda chain: -sum(self.predicted_solves(names[idx]) for idx in chain))
+                self.schedule = [[names[idx] for idx in chain] for chain in chains]
+                self.log(f"Layer scheduling: {self.solver_slots} solver slots, {len(chains)} independent chains: "
+                         + "; ".join(f"{' -> '.join(names[idx] for idx in chain)} (~{sum(self.predicted_solves(names[idx]) for idx in chain)} solves)"
+                                     for chain in chains))
+
+                async def chain_worker():
+                    while chains:
+                        chain = chains.pop(0)
+                        if self.joint and len(chain) > 1:
+                            await characterize_joint(chain)
+                            continue
+                        for idx in chain:
+                            await characterize_layer(idx)
+
+                await asyncio.gather(*(chain_worker() for _ in range(min(self.solver_slots, len(chains)))))
+
+            # Solves report their result before their project is saved; let them finish
+            await self.solver.finish_pending()
+
+            # Final Step: Create Full Stackup
+            final_json_path = os.path.join(self.output_dir, "characterized_stackup.json")
+            save_json(self.stackup.to_json(), final_json_path)
+            # Layers without iteration history of their own, for the tolerance analysis
+            save_json(self.layer_sources, os.path.join(self.output_dir, LAYER_SOURCES_FILE))
         
-        # Call modeling.py to create full stackup
-        # We need to implement create_full_stackup in modeling.py and call it here
-        # Or we can just call it via subprocess if we add a flag to modeling.py
-        # But better to import it if possible, or create a separate script.
-        # Since modeling.py is a script, let's just use subprocess with a special flag or new script?
-        # The plan said "Modify modeling.py".
-        # Let's assume we can call it via subprocess by passing a special "mode" in the json or a different argument.
-        # Or just create a temporary json for full stackup and run modeling.py with a flag.
+            temp_full_path = os.path.join(self.output_dir, "full_stackup_params.json")
+            save_json(self.full_stackup_params(full_aedb_path, "full_stackup"), temp_full_path)
+
+            created = False
+            if builder:
+                self.log("Finalizing full stackup model...")
+                created = await asyncio.to_thread(builder.finish)
+                if not created:
+                    self.log("Full stackup builder did not finish, rebuilding the model from scratch.")
+
+            if not created:
+                self.log("Creating full stackup model...")
+                try:
+                    created = await self.solver.create_full_stackup_async(temp_full_path, self.log)
+                except Exception as e:
+                    self.log(f"Failed to create full stackup: {e}")
+
+            if created:
+                self.log(f"Full stackup created at {full_aedb_path}")
+
+            self.log(f"Characterization complete. Saved to {final_json_path}")
+        except asyncio.CancelledError:
+            for name, stats in list(self.layer_stats.items()):
+                if stats.get('status') == "Running":
+                    self.update_stats(name, dict(stats, status="Cancelled"))
+            if builder:
+                builder.cancel()
+            self.log("Characterization cancelled.")
+            raise
+        finally:
+            # Let the background thread finish zipping/deleting retired iterations
+            await asyncio.to_thread(self.retention.close)
+
+    def log_iteration(self, iteration, layer, phase, tuning_param, values, zdiff, dbs21, z_pass, loss_pass, solution):
+        with open(self.log_file, 'a', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            row = [
+                iteration, layer.name, phase, tuning_param,
+                layer.width, layer.spacing,
+                values.get('thickness', ''), values.get('etch_factor', ''),
+                values.get('hallhuray_surface_ratio', ''), values.get('nodule_radius', ''),
+                values.get('dk_up', ''), values.get('dk_down', ''),
+                values.get('df_up', ''), values.get('df_down', ''),
+                zdiff, dbs21 if solution == "full" else '', z_pass, loss_pass if solution == "full" else '', solution
+            ]
+            writer.writerow(row)
+
+    def log_coupons(self, layer_name, coupons, coupon_metrics):
+        """Final Zdiff and S21 of each coupon geometry against its targets."""
+        z_tol_percent, loss_tol_percent = target_tolerances(self.stackup.settings)
+        for coupon, (zdiff, dbs21) in zip(coupons, coupon_metrics or []):
+            target_z, target_loss = coupon['impedance_target'], coupon['loss_target']
+            z_converged = abs(zdiff - target_z) / target_z <= z_tol_percent if target_z else True
+            loss_converged = abs(dbs21 - target_loss) / abs(target_loss) <= loss_tol_percent if target_loss else True
+            self.log(f"[{layer_name}] Coupon W={coupon['width']:g}/S={coupon['spacing']:g}: "
+                     f"Z={zdiff:.2f} (target={target_z:.2f}, {'PASS' if z_converged else 'FAIL'}), "
+                     f"Loss={dbs21:.2f} (target={target_loss}, {'PASS' if loss_converged else 'FAIL'})")
+
+    async def solve_candidate(self, layer_info, signal_half, iteration, values, solution="full", loss_at=None, solved_candidates=()):
+        """Model and solve one candidate of a layer in a solver slot. Returns (zdiff, dbs21, aedb_path, coupons).
+
+        Records the solve time and the RLGC of a full-wave solve; with loss_at the
+        S21 is taken from the RLGC at that length and frequency. A full-wave solve
+        may warm start from the nearest of solved_candidates. coupons are the
+        (zdiff, dbs21) of the layer's coupon geometries, empty when none were solved.
+        """
+        layer_name = layer_info['layer'].name
+        temp_params_path = os.path.join(self.output_dir, f"params_{layer_name}_{iteration}.json")
+        aedb_path = os.path.join(self.output_dir, f"sim_{layer_name}_{iteration}.aedb")
         
-        # Actually, let's just add a new CLI entry point to modeling.py or a new function we can call via a wrapper script.
-        # Since we are in python, we can't easily import modeling.py if it has top-level code that runs.
-        # But modeling.py has `if __name__ == "__main__":`.
-        # So we could import it if we fix the path.
-        # But `gui_app.py` imports `CharacterizationEngine`.
-        # `CharacterizationEngine` is here.
-        # `modeling.py` uses `pyedb` which might conflict with `pywebview` if run in same process? 
-        # Usually AEDT scripting is safer in subprocess.
+        modeling_params = create_modeling_params(self.stackup, layer_info, values, aedb_path, signal_half,
+                                               max_delta_s=self.max_delta_s, freq_stop=self.freq_stop, structure=self.structure)
+        modeling_params["solution"] = solution
+        if solution == "port_only":
+            # The port solve only calibrates the main pair's Zdiff
+            modeling_params.pop("coupons", None)
+        elif loss_at and modeling_params.get("coupons"):
+            # Coupon S21 is taken at the same length and frequency as the main pair's
+            modeling_params["loss_at"] = list(loss_at)
+        if self.warm_start and solution == "full" and solved_candidates:
+            source = warm_start_source(solved_candidates, values)
+            if source:
+                modeling_params["warm_start"] = {"source_iteration": source[0], "source_project": source[1]}
+                self.log(f"[{layer_name}] Iter {iteration}: Warm start from iteration {source[0]}")
+            else:
+                self.log(f"[{layer_name}] Iter {iteration}: No reusable solved candidate (geometry changed or project still saving), fresh mesh")
+        features = solve_features(modeling_params)
         
-        # Let's create a temp json for full stackup creation
-        full_stackup_params = {
-            "mode": "full_stackup",
-            "output_aedb_path": full_aedb_path,
-            "stackup_data": self.data,
-            "copper_conductivity": self.data.get('copper_conductivity', 5.8e7)
-        }
-        temp_full_path = os.path.join(self.output_dir, "full_stackup_params.json")
-        save_json(full_stackup_params, temp_full_path)
+        # Queued solves go to the layer with the most predicted work left, counting its chain
+        priority = self.predicted_solves(layer_name) + self.chain_tail.get(layer_name, 0)
+        async with self.slots.slot(priority):
+            cores = modeling_params["cores"] = self.allocate_cores(features)
+            save_json(modeling_params, temp_params_path)
+            self.cores_in_use += cores
+            try:
+                result = await self.solver.evaluate_async({
+                    "layer": layer_name,
+                    "iteration": iteration,
+                    "values": values,
+                    "params_path": temp_params_path,
+                    "aedb_path": aedb_path,
+                }, self.log)
+            finally:
+                self.cores_in_use -= cores
+        zdiff = result['zdiff']
+        dbs21 = result['dbs21']
+        coupons = [tuple(c) for c in result.get('coupons') or []]
+
+        timing = result.get('timing')
+        if timing:
+            row = dict(features, layer=layer_name, iteration=iteration, cores=timing.get('cores', cores),
+                       passes=timing.get('passes', 0), modeling_s=timing.get('modeling', 0),
+                       analyze_s=timing.get('analyze', 0), extract_s=timing.get('extract', 0))
+            append_solve_time(self.cost_path, row)
+            self.cost_model.add(row)
+        if solution == "full":
+            self.layer_features[layer_name] = features
         
-        try:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            modeling_script = os.path.join(script_dir, "modeling.py")
-            result = subprocess.run(
-                [_get_python_exe(), modeling_script, temp_full_path],
-                capture_output=True, text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
-                startupinfo=_hidden_startupinfo()
-            )
-            if result.returncode != 0:
-                err_msg = result.stderr.strip() if result.stderr else "No stderr"
-                out_msg = result.stdout.strip() if result.stdout else "No stdout"
-                self.log(f"Full stackup modeling.py STDERR:\n{err_msg}")
-                self.log(f"Full stackup modeling.py STDOUT:\n{out_msg}")
-                self.log(f"Failed to create full stackup (exit code {result.returncode})")
-            else:
-                self.log(f"Full stackup created at {full_aedb_path}")
-        except Exception as e:
-            self.log(f"Failed to create full stackup: {e}")
-
-        self.log(f"Characterization complete. Saved to {final_json_path}")
-
-    def optimize_layer(self, layer_index, signal_half):
-        layer_info = extract_layer_params(self.data, layer_index)
+        # Per-unit-length RLGC of the solved line, which gives S21 of any length and frequency
+        if solution == "full" and os.path.exists(sdd_path(aedb_path)):
+            freqs, lengths, sdd = load_sdd(sdd_path(aedb_path))
+            self.sparams.add(layer_name, iteration, freqs, lengths, sdd)
+            if self.touchstone:
+                self.sparams.export_touchstone(layer_name, iteration, os.path.join(self.output_dir, "touchstone"))
+            rlgc = extract_rlgc(freqs, lengths, sdd)
+            append_rlgc(self.rlgc_path, layer_name, iteration, freqs, rlgc)
+            if loss_at:
+                dbs21 = float(insertion_s21_db(freqs, rlgc, *loss_at)[0])
+        return zdiff, dbs21, aedb_path, coupons
+
+    async def optimize_layer(self, layer_index, signal_half):
+        layer_info = extract_layer_params(self.stackup, layer_index)
         layer = layer_info['layer']
-        layer_name = layer['layername']
+        layer_name = layer.name
         
         self.log(f"Characterizing layer: {layer_name}")
         
-        target_z = float(layer['impedance_target'])
-        target_loss = float(layer['loss_target'])
+        target_z = layer.impedance_target
+        target_loss = layer.loss_target
+        # The loss target may refer to another line length or frequency than the solved S21
+        loss_at = loss_query(layer, self.freq_stop)
+        if loss_at:
+            self.log(f"[{layer_name}] Loss target at {loss_at[0]:g} mil, {loss_at[1]:g} GHz (from the extracted RLGC)")
+        coupons = coupon_geometries(layer)
+        if coupons:
+            self.log(f"[{layer_name}] Coupon geometries solved with the pair: "
+                     + ", ".join(f"W={c['width']:g}/S={c['spacing']:g}" for c in coupons))
+            if self.optimizer != "space_mapping":
+                self.log(f"[{layer_name}] Coupon targets are only fitted by the space mapping optimizer; bisection tunes the layer's own pair")
         
         # Initial stats
         stats = {
@@ -366,64 +974,17 @@ class CharacterizationEngine:
         self.update_stats(layer_name, stats)
         start_time = time.time()
 
-        initial_values = {
-            'thickness': safe_float(layer['thickness']),
-            'etch_factor': safe_float(layer['etchfactor']),
-            'hallhuray_surface_ratio': safe_float(layer['hallhuray_surface_ratio']),
-            'nodule_radius': safe_float(layer['nodule_radius']),
-        }
-        
-        if layer_info['diel_above']:
-            initial_values['dk_up'] = safe_float(layer_info['diel_above']['dk'], 1)
-            initial_values['df_up'] = safe_float(layer_info['diel_above']['df'])
-            
-        if layer_info['diel_below']:
-            initial_values['dk_down'] = safe_float(layer_info['diel_below']['dk'], 1)
-            initial_values['df_down'] = safe_float(layer_info['diel_below']['df'])
-            
+        initial_values = layer_values(layer_info)
         keys = list(initial_values.keys())
         x0 = [initial_values[k] for k in keys]
         
-        # Bounds with physical constraints:
-        #   - thickness, dk, df, hallhuray_surface_ratio, nodule_radius must be > 0
-        #   - etch_factor must keep the same sign as the initial input value
-        settings = self.data['settings']
-        bounds = []
+        # Bounds with physical constraints; etch_factor keeps the sign of the input value
+        settings = self.stackup.settings
         initial_etch_sign = 1.0 if initial_values.get('etch_factor', 1) >= 0 else -1.0
-        
-        for k in keys:
-            val = initial_values[k]
-            variation = 0.2
-            if 'etch_factor' in k: variation = float(settings['etchfactor']['variation'].strip('%'))/100
-            elif 'thickness' in k: variation = float(settings['thickness']['variation'].strip('%'))/100
-            elif 'dk' in k: variation = float(settings['dk']['variation'].strip('%'))/100
-            elif 'df' in k: variation = float(settings['df']['variation'].strip('%'))/100
-            elif 'surface_ratio' in k: variation = float(settings['hallhuray_surface_ratio']['variation'].strip('%'))/100
-            elif 'nodule_radius' in k: variation = float(settings['nodule_radius']['variation'].strip('%'))/100
-            
-            lower = val * (1 - variation) if val > 0 else val * (1 + variation)
-            upper = val * (1 + variation) if val > 0 else val * (1 - variation)
-            if lower > upper: lower, upper = upper, lower
-            
-            # Apply physical constraints
-            if 'etch_factor' in k:
-                # Etch factor must keep same sign as input
-                if initial_etch_sign < 0:
-                    upper = min(upper, -1e-9)  # Must stay negative
-                else:
-                    lower = max(lower, 1e-9)   # Must stay positive
-            elif 'dk' in k:
-                # Dielectric constant must be >= 1
-                lower = max(lower, 1.0)
-            else:
-                # thickness, df, hallhuray_surface_ratio, nodule_radius must be > 0
-                lower = max(lower, 1e-9)
-            
-            bounds.append((lower, upper))
+        bounds = [variation_bounds(k, initial_values[k], settings) for k in keys]
 
         # Tolerances
-        z_tol_percent = float(settings['impedance_target']['tolerance'].strip('%')) / 100
-        loss_tol_percent = float(settings['loss_target']['tolerance'].strip('%')) / 100
+        z_tol_percent, loss_tol_percent = target_tolerances(settings)
 
         # Current metrics from the latest simulation
         current_metrics = (0, 0)  # (zdiff, dbs21)
@@ -432,101 +993,131 @@ class CharacterizationEngine:
         evaluated_history = []  # To cache objective evaluations and avoid duplicates
         current_phase = "impedance"  # Track which phase we are in
         current_tuning_param = ""  # Track which parameter is being tuned
-
-        def run_simulation_eval(x):
-            """Run modeling + simulation for parameter vector x. Returns (zdiff, dbs21)."""
-            nonlocal iteration_count, current_metrics, evaluated_history
+        last_sweep = None  # (x, (frequencies, S21 dB)) of the latest solve that saved its sweep
+        solved_candidates = []  # (iteration, values, aedb_path) of finished solves, for warm starts
+        coupon_history = []  # (x, [(zdiff, dbs21) per coupon geometry]) of full-wave solves
+        z_scale = 1.0  # full-wave Zdiff / port-only Zdiff, from candidates solved both ways
+        noise = (None, None)  # standard deviation of (Zdiff, S21) between repeated solves
+        noise_reported = set()
+        metrics_port_only = False  # current_metrics come from a port-only solve
+
+        measured_curve = None
+        if layer.get('measured_s21'):
+            try:
+                measured_curve = load_curve(self.resolve_input_path(layer.get('measured_s21')))
+                self.log(f"[{layer_name}] Loaded measured S21 curve ({len(measured_curve[0])} points)")
+            except OSError as e:
+                self.log(f"[{layer_name}] Could not read measured S21 curve: {e}")
+
+        def same_candidate(a, b):
+            return all(abs(u - v) < 1e-6 for u, v in zip(a, b))
+
+        def coupons_at(x):
+            """Solved (zdiff, dbs21) of every coupon geometry at candidate x, or None."""
+            for past_x, coupon_metrics in reversed(coupon_history):
+                if same_candidate(x, past_x) and len(coupon_metrics) == len(coupons):
+                    return coupon_metrics
+            return None
+
+        def calibrate_port_only(x):
+            """Update z_scale once candidate x has both a full-wave and a port-only Zdiff."""
+            nonlocal z_scale
+            solved = {solution: metrics[0] for past_x, metrics, solution in evaluated_history if same_candidate(x, past_x)}
+            if "full" in solved and solved.get("port_only"):
+                z_scale = solved["full"] / solved["port_only"]
+                self.log(f"[{layer_name}] Port-only Zdiff calibration: x{z_scale:.4f}")
+
+        async def run_simulation_eval(x, solution=None, verify=False, warm=True):
+            """Run modeling + simulation for parameter vector x. Returns (zdiff, dbs21).
+
+            Each call reserves its own iteration number before awaiting the solver,
+            so several candidates can be evaluated at once with asyncio.gather.
+            solution is "full" or "port_only"; by default impedance tuning uses the
+            port-only solve when it is enabled. A port-only Zdiff is scaled by the
+            full-wave calibration and keeps the S21 of the latest full-wave solve.
+            verify=True solves even when max_iter is used up; warm=False meshes from
+            scratch even with warm start enabled.
+            """
+            nonlocal iteration_count, current_metrics, evaluated_history, last_sweep, metrics_port_only
             
+            await self.wait_if_paused()
+
             # Check max iter
-            if iteration_count >= self.max_iter:
+            if iteration_count >= self.max_iter and not verify:
                 return current_metrics
 
-            # Check cache to avoid duplicate simulations
-            for past_x, past_metrics in evaluated_history:
-                if all(abs(a - b) < 1e-6 for a, b in zip(x, past_x)):
+            if solution is None:
+                solution = "port_only" if self.port_only and current_phase == "impedance" and current_tuning_param != "initial" else "full"
+
+            # Check cache to avoid duplicate simulations; a full-wave result also answers a port-only request
+            for past_x, past_metrics, past_solution in evaluated_history:
+                if same_candidate(x, past_x) and past_solution == "full":
                     current_metrics = past_metrics
+                    metrics_port_only = False
+                    return current_metrics
+            for past_x, past_metrics, past_solution in evaluated_history:
+                if same_candidate(x, past_x) and solution == "port_only":
+                    current_metrics = (past_metrics[0] * z_scale, current_metrics[1])
+                    metrics_port_only = True
                     return current_metrics
 
             iteration_count += 1
+            iteration = iteration_count
+            phase, tuning_param = current_phase, current_tuning_param
             current_vals = dict(zip(keys, x))
             
-            # Temp files
-            temp_params_path = os.path.join(self.output_dir, f"params_{layer_name}_{iteration_count}.json")
-            aedb_path = os.path.join(self.output_dir, f"sim_{layer_name}_{iteration_count}.aedb")
-            
-            modeling_params = create_modeling_params(self.data, layer_info, current_vals, aedb_path, signal_half,
-                                                   max_delta_s=self.max_delta_s, freq_stop=self.freq_stop)
-            save_json(modeling_params, temp_params_path)
-            
-            # Run Modeling
-            self.log(f"[{layer_name}] Iter {iteration_count}: Modeling...")
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            modeling_script = os.path.join(script_dir, "modeling.py")
-            result = subprocess.run(
-                [_get_python_exe(), modeling_script, temp_params_path],
-                capture_output=True,
-                text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW,
-                startupinfo=_hidden_startupinfo(),
-            )
-            if result.returncode != 0:
-                err_msg = result.stderr.strip() if result.stderr else "No stderr"
-                out_msg = result.stdout.strip() if result.stdout else "No stdout"
-                self.log(f"[{layer_name}] modeling.py STDERR:\n{err_msg}")
-                self.log(f"[{layer_name}] modeling.py STDOUT:\n{out_msg}")
-                raise RuntimeError(f"modeling.py failed (exit code {result.returncode})\n{err_msg}")
-            
-            # Run Simulation
-            self.log(f"[{layer_name}] Iter {iteration_count}: Simulating...")
-            simulation_script = os.path.join(script_dir, "simulation.py")
-            result = subprocess.run([_get_python_exe(), simulation_script, aedb_path], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW, startupinfo=_hidden_startupinfo())
-            if result.returncode != 0:
-                err_msg = result.stderr.strip() if result.stderr else "No stderr"
-                out_msg = result.stdout.strip() if result.stdout else "No stdout"
-                self.log(f"[{layer_name}] simulation.py STDERR:\n{err_msg}")
-                self.log(f"[{layer_name}] simulation.py STDOUT:\n{out_msg}")
-                raise RuntimeError(f"simulation.py failed (exit code {result.returncode})")
-            
-            zdiff = 0
-            dbs21 = 0
-            for line in result.stdout.splitlines():
-                if line.startswith("RESULT:"):
-                    parts = line.split(":")[1].split(",")
-                    zdiff = float(parts[0])
-                    dbs21 = float(parts[1])
-                    break
-            
-            self.log(f"[{layer_name}] Iter {iteration_count}: Zdiff={zdiff:.2f}, S21={dbs21:.2f}")
+            zdiff, dbs21, aedb_path, coupon_metrics = await self.solve_candidate(layer_info, signal_half, iteration, current_vals,
+                                                                                 solution, loss_at, solved_candidates if warm else ())
+
+            if solution == "port_only":
+                port_zdiff = zdiff
+                zdiff = port_zdiff * z_scale
+                dbs21 = current_metrics[1]
+                self.log(f"[{layer_name}] Iter {iteration}: Port-only Zdiff={port_zdiff:.2f} (calibrated {zdiff:.2f})")
+            else:
+                self.log(f"[{layer_name}] Iter {iteration}: Zdiff={zdiff:.2f}, S21={dbs21:.2f}")
+            for coupon, (coupon_z, coupon_s21) in zip(coupons, coupon_metrics):
+                self.log(f"[{layer_name}] Iter {iteration}: Coupon W={coupon['width']:g}/S={coupon['spacing']:g}: "
+                         f"Zdiff={coupon_z:.2f}, S21={coupon_s21:.2f}")
+            if coupon_metrics:
+                coupon_history.append((list(x), coupon_metrics))
             
             current_metrics = (zdiff, dbs21)
+            metrics_port_only = solution == "port_only"
 
             z_error_pct = abs(zdiff - target_z) / target_z
             loss_error_pct = abs(dbs21 - target_loss) / abs(target_loss) if target_loss != 0 else 0
             z_pass = z_error_pct <= z_tol_percent
             loss_pass = loss_error_pct <= loss_tol_percent
+            self.remaining[layer_name] = expected_solves([z_error_pct, loss_error_pct], [z_tol_percent, loss_tol_percent],
+                                                         self.max_iter - iteration_count)
+            if solution == "port_only":
+                # No S21 was solved; the project is only a port solve, never the one to keep
+                loss_error_pct = float('inf')
             
-            # Log to CSV
-            with open(self.log_file, 'a', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                row = [
-                    iteration_count, layer_name, current_phase, current_tuning_param,
-                    layer['width'], layer['spacing'],
-                    current_vals.get('thickness', ''), current_vals.get('etch_factor', ''),
-                    current_vals.get('hallhuray_surface_ratio', ''), current_vals.get('nodule_radius', ''),
-                    current_vals.get('dk_up', ''), current_vals.get('dk_down', ''),
-                    current_vals.get('df_up', ''), current_vals.get('df_down', ''),
-                    zdiff, dbs21, z_pass, loss_pass
-                ]
-                writer.writerow(row)
+            self.log_iteration(iteration, layer, phase, tuning_param, current_vals, zdiff, dbs21, z_pass, loss_pass, solution)
             
             # Update Stats
             stats['iterations'] = iteration_count
             stats['best_z'] = zdiff
             stats['best_loss'] = dbs21
             stats['time_elapsed'] = f"{int(time.time() - start_time)}s"
+            stats['eta'] = format_duration(self.layer_eta(layer_name))
+            run_eta = self.run_eta()
+            stats['run_eta'] = format_duration(run_eta)
             self.update_stats(layer_name, stats)
+            if run_eta is not None and time.time() - self.last_eta_log >= 60:
+                self.last_eta_log = time.time()
+                self.log(f"Run ETA: {format_duration(run_eta)}")
             
-            evaluated_history.append((list(x), current_metrics))
+            evaluated_history.append((list(x), (port_zdiff, dbs21) if solution == "port_only" else current_metrics, solution))
+            if solution == "full":
+                solved_candidates.append((iteration, current_vals, aedb_path))
+            if self.port_only:
+                calibrate_port_only(x)
+            self.retention.add(layer_name, iteration, z_error_pct + loss_error_pct)
+            if os.path.exists(sweep_path(aedb_path)):
+                last_sweep = (list(x), load_curve(sweep_path(aedb_path)))
             return current_metrics
 
         # Custom optimization loop using binary search based on prompt rules
@@ -569,8 +1160,199 @@ class CharacterizationEngine:
                 return 0
             return abs((target_loss - current_metrics[1]) / abs(target_loss))
 
-        def run_phase(phase_name):
-            nonlocal current_phase, current_tuning_param, current_x
+        async def fit_loss_to_measured():
+            """Move the loss parameters to a least-squares fit of the whole measured S21 curve and solve there."""
+            nonlocal current_tuning_param, current_x
+
+            if iteration_count >= self.max_iter:
+                return
+            sweep_x, sim_curve = last_sweep
+            fitted, info = fit_loss_parameters(sim_curve, measured_curve, dict(zip(keys, sweep_x)), dict(zip(keys, bounds)),
+                                               f_ref_ghz=float(self.stackup.frequency),
+                                               conductivity=float(self.stackup.copper_conductivity))
+            if fitted is None:
+                self.log(f"[{layer_name}] Skipping fit to measured S21: {info}")
+                return
+
+            self.log(f"[{layer_name}] Fitted measured S21: {', '.join(f'{k}={v:.6f}' for k, v in fitted.items())} "
+                     f"(rms error {info['rms_db']:.3f} dB, Djordjevic-Sarkar eps_inf={info['eps_inf']:.3f}, delta_eps={info['delta_eps']:.3f})")
+            current_tuning_param = "fit"
+            test_x = list(current_x)
+            for k, v in fitted.items():
+                test_x[keys.index(k)] = v
+            await run_simulation_eval(test_x)
+            current_x = test_x
+
+        async def verify_full_wave():
+            """Solve current_x full-wave when the current metrics are a port-only estimate."""
+            nonlocal current_tuning_param
+            if not metrics_port_only:
+                return
+            current_tuning_param = "verify"
+            self.log(f"[{layer_name}] Verifying the port-only impedance result with a full-wave solve")
+            await run_simulation_eval(current_x, "full", verify=True)
+
+        def within_noise(metric_index, target):
+            """The remaining error of a metric cannot be told apart from the solver noise."""
+            return noise[metric_index] is not None and abs(current_metrics[metric_index] - target) <= NOISE_SIGMAS * noise[metric_index]
+
+        async def estimate_noise():
+            """Solve the starting point again with a slightly perturbed copper thickness (a fresh mesh each)
+            and take the spread of the results as the solver noise."""
+            nonlocal current_tuning_param, current_metrics, noise
+            if 'thickness' not in keys:
+                return
+            start_metrics = current_metrics
+            t = keys.index('thickness')
+            repeats = []
+            # Repeats beyond the iteration budget would come back unsolved, as copies of the start
+            for n in range(min(self.noise_repeats, self.max_iter - iteration_count)):
+                x = list(current_x)
+                x[t] *= 1 + NOISE_PERTURBATION * (n // 2 + 1) * (1 if n % 2 == 0 else -1)
+                repeats.append(x)
+            if not repeats:
+                self.log(f"[{layer_name}] No iteration budget left for the solver noise estimate")
+                return
+            current_tuning_param = "noise"
+            history_start = len(evaluated_history)
+            # A warm start would inherit the mesh whose noise is being measured
+            await asyncio.gather(*(run_simulation_eval(x, "full", warm=False) for x in repeats))
+            current_metrics = start_metrics
+            # Only the repeats that were actually solved, not cached or skipped ones
+            samples = np.array([start_metrics] + [list(m) for _, m, _ in evaluated_history[history_start:]])
+            if len(samples) < 2:
+                return
+            noise = tuple(float(v) for v in samples.std(axis=0, ddof=1))
+            self.log(f"[{layer_name}] Solver noise from {len(samples)} solves: Zdiff sigma {noise[0]:.3f} ohm, S21 sigma {noise[1]:.4f} dB")
+
+        async def preflight():
+            """Solve the far corner of the impedance and of the loss parameter box in one batch.
+
+            Returns False when a target lies beyond its corner and cannot be reached
+            (with preflight "widen" the bounds are widened first when the corners
+            show by how much).
+            """
+            nonlocal current_tuning_param, current_metrics, metrics_port_only
+            start_metrics, start_port_only = current_metrics, metrics_port_only
+            phases = {"impedance": (z_params, z_tol_percent, 0, target_z), "loss": (loss_params, loss_tol_percent, 1, target_loss)}
+            corners = {}
+            for phase_name, (phase_params, phase_tol, metric_index, target) in phases.items():
+                if target == 0 or abs(start_metrics[metric_index] - target) / abs(target) <= phase_tol:
+                    continue
+                need_metric_up = start_metrics[metric_index] < target
+                corner = list(current_x)
+                for p_name, p_keys in phase_params:
+                    p_indices = get_indices(p_keys)
+                    if not p_indices:
+                        continue
+                    p_dir = get_param_z_dir(p_name, current_x[p_indices[0]]) if phase_name == "impedance" else get_param_s21_dir(p_name)
+                    for i in p_indices:
+                        corner[i] = bounds[i][1] if (p_dir > 0) == need_metric_up else bounds[i][0]
+                corners[phase_name] = corner
+            if not corners:
+                return True
+
+            current_tuning_param = "preflight"
+            self.log(f"[{layer_name}] Pre-flight: solving the far corner of the {' and '.join(corners)} parameter bounds")
+            results = await asyncio.gather(*(run_simulation_eval(corner, None if phase_name == "impedance" else "full")
+                                             for phase_name, corner in corners.items()))
+            current_metrics, metrics_port_only = start_metrics, start_port_only
+
+            feasible = True
+            for (phase_name, corner), metrics in zip(corners.items(), results):
+                _, phase_tol, metric_index, target = phases[phase_name]
+                start, reached = start_metrics[metric_index], metrics[metric_index]
+                if (reached - target) * (target - start) >= 0 or abs(reached - target) / abs(target) <= phase_tol:
+                    self.log(f"[{layer_name}] Pre-flight: {phase_name} target {target:.2f} is reachable (corner gives {reached:.2f})")
+                    continue
+                self.log(f"[{layer_name}] Pre-flight: {phase_name} target {target:.2f} is out of reach, "
+                         f"the bounds get to {reached:.2f} ({abs(reached - target) / abs(target):.1%} short)")
+                # Assume the metric moves linearly from the start to the corner
+                factor = (target - start) / (reached - start) * 1.2 if reached != start else float('inf')
+                if self.preflight != "widen" or not 0 < factor <= MAX_BOUND_WIDENING:
+                    if self.preflight == "widen":
+                        self.log(f"[{layer_name}] Pre-flight: not widening the {phase_name} bounds, "
+                                 f"they would need more than {MAX_BOUND_WIDENING:g}x")
+                    feasible = False
+                    continue
+                changed = []
+                for i, (start_val, corner_val) in enumerate(zip(current_x, corner)):
+                    if corner_val == start_val:
+                        continue
+                    widened = start_val + (corner_val - start_val) * factor
+                    lower, upper = bounds[i]
+                    bounds[i] = physical_bounds(keys[i], min(lower, widened), max(upper, widened), initial_etch_sign)
+                    changed.append(f"{keys[i]} [{bounds[i][0]:.6f}, {bounds[i][1]:.6f}]")
+                self.log(f"[{layer_name}] Pre-flight: widened the {phase_name} bounds x{factor:.2f}: {', '.join(changed)}")
+            return feasible
+
+        async def space_mapping():
+            """Optimize all parameters together on the coarse model, solve its optimum, re-align the model, repeat.
+
+            Every step is a full-wave solve. A step that does not improve on the
+            best solve is only used to correct the model, and shrinks the next one.
+            """
+            nonlocal current_phase, current_tuning_param, current_x, current_metrics
+            current_phase = current_tuning_param = "space_mapping"
+            await verify_full_wave()
+
+            model_args = (loss_at[1] if loss_at else self.freq_stop, float(self.stackup.frequency),
+                          float(self.stackup.copper_conductivity))
+            start_values = dict(zip(keys, current_x))
+            coarse = CoarseModel(layer_info, *model_args)
+            sweep = last_sweep[1] if last_sweep is not None and same_candidate(last_sweep[0], current_x) else None
+            coarse.calibrate(start_values, current_metrics[1], sweep)
+            models = [coarse]
+            targets = [target_z, target_loss]
+            current_fine = list(current_metrics)
+            # Every coupon geometry adds its own (Zdiff, S21) pair to fit with the same parameters
+            start_coupons = coupons_at(current_x)
+            if coupons and start_coupons is None:
+                self.log(f"[{layer_name}] Space mapping: the solver returned no coupon results, fitting the layer's own pair only")
+            for coupon, (coupon_z, coupon_s21) in zip(coupons, start_coupons or []):
+                model = CoarseModel(layer_info, *model_args, width=coupon['width'], spacing=coupon['spacing'])
+                model.calibrate(start_values, coupon_s21)
+                models.append(model)
+                targets += [coupon['impedance_target'], coupon['loss_target']]
+                current_fine += [coupon_z, coupon_s21]
+            tolerances = [z_tol_percent, loss_tol_percent] * len(models)
+
+            def coarse_metrics(x):
+                values = dict(zip(keys, x))
+                return np.concatenate([model.metrics(values) for model in models])
+
+            def fine_metrics(x, metrics):
+                solved = coupons_at(x) if len(models) > 1 else []
+                return list(metrics) + [m for pair in solved for m in pair]
+
+            mapping = SpaceMapping(coarse_metrics, bounds, targets, tolerances)
+            mapping.update(current_x, current_fine)
+
+            while iteration_count < self.max_iter:
+                if all(not t or abs(current_fine[i] - t) / abs(t) <= tolerances[i] or (i < 2 and within_noise(i, t))
+                       for i, t in enumerate(targets)):
+                    self.log(f"[{layer_name}] Space mapping converged: targets met")
+                    break
+                if mapping.exhausted:
+                    self.log(f"[{layer_name}] Space mapping: the model finds no further improvement near the best solve, stopping.")
+                    break
+                x, predicted = mapping.next_candidate()
+                if all(abs(a - b) <= 1e-4 * max(abs(b), 1e-12) for a, b in zip(x, current_x)):
+                    self.log(f"[{layer_name}] Space mapping: the model optimum is the current candidate, stopping.")
+                    break
+                self.log(f"[{layer_name}] Space mapping: model predicts Zdiff={predicted[0]:.2f}, S21={predicted[1]:.2f}"
+                         + "".join(f", coupon {n} Zdiff={predicted[2 * n]:.2f} S21={predicted[2 * n + 1]:.2f}" for n in range(1, len(models)))
+                         + f" at {', '.join(f'{k}={v:.6f}' for k, v in zip(keys, x))}")
+                metrics = await run_simulation_eval(x, "full")
+                fine = fine_metrics(x, metrics)
+                if mapping.update(x, fine):
+                    current_x, current_fine = x, fine
+                else:
+                    self.log(f"[{layer_name}] Space mapping: no improvement, step range cut to {mapping.radius:.0%} of the bounds")
+                    current_metrics = tuple(float(v) for v in mapping.anchor[1][:2])
+
+        async def run_phase(phase_name):
+            nonlocal current_phase, current_tuning_param, current_x, current_metrics
 
             current_phase = phase_name
             phase_started_iterations = iteration_count
@@ -581,23 +1363,45 @@ class CharacterizationEngine:
                 phase_tol = z_tol_percent
                 get_error_pct = get_z_error_pct
                 metric_index = 0
+                target = target_z
             else:
                 phase_label = "Loss"
                 phase_params = loss_params
                 phase_tol = loss_tol_percent
                 get_error_pct = get_loss_error_pct
                 metric_index = 1
+                target = target_loss
 
                 if target_loss == 0:
                     self.log(f"[{layer_name}] Loss target is 0, skipping loss phase.")
                     return True, False
 
-            if get_error_pct() <= phase_tol:
+                # Loss is only known from a full-wave solve
+                await verify_full_wave()
+
+            def phase_met():
+                if get_error_pct() <= phase_tol:
+                    return True
+                if within_noise(metric_index, target):
+                    if phase_name not in noise_reported:
+                        noise_reported.add(phase_name)
+                        self.log(f"[{layer_name}] Remaining {phase_name} error {current_metrics[metric_index] - target:+.3f} is within "
+                                 f"solver noise ({NOISE_SIGMAS:g} sigma = {NOISE_SIGMAS * noise[metric_index]:.3f}), not chasing it further")
+                    return True
+                return False
+
+            if phase_met():
                 self.log(f"[{layer_name}] {phase_label} already within tolerance.")
                 return True, False
 
             self.log(f"[{layer_name}] {phase_label} Phase")
 
+            if phase_name == "loss" and measured_curve is not None and last_sweep is not None:
+                await fit_loss_to_measured()
+                if phase_met():
+                    self.log(f"[{layer_name}] Fitted loss parameters met loss tolerance")
+                    return True, True
+
             for p_name, p_keys in phase_params:
                 if iteration_count >= self.max_iter:
                     break
@@ -612,7 +1416,7 @@ class CharacterizationEngine:
                     self.log(f"[{layer_name}] Skipping {p_name}: variation=0%")
                     continue
 
-                if get_error_pct() <= phase_tol:
+                if phase_met():
                     break
 
                 current_tuning_param = p_name
@@ -632,9 +1436,9 @@ class CharacterizationEngine:
                 test_x = list(current_x)
                 for i in p_indices:
                     test_x[i] = boundary_val
-                run_simulation_eval(test_x)
+                await run_simulation_eval(test_x)
 
-                if get_error_pct() <= phase_tol:
+                if phase_met():
                     current_x = test_x
                     self.log(f"[{layer_name}] {p_name} at boundary met {phase_name} tolerance")
                     break
@@ -655,71 +1459,109 @@ class CharacterizationEngine:
                 val_need_up = current_val if need_param_up else boundary_val
                 val_need_down = boundary_val if need_param_up else current_val
 
+                def need_param_up_at(val, metrics):
+                    need_up = metrics[metric_index] < (target_z if phase_name == "impedance" else target_loss)
+                    val_dir = get_param_z_dir(p_name, val) if phase_name == "impedance" else p_dir
+                    return (need_up and val_dir > 0) or (not need_up and val_dir < 0)
+
                 for _ in range(10):
                     if iteration_count >= self.max_iter:
                         break
-                    mid = (val_need_up + val_need_down) / 2
-                    self.log(f"[{layer_name}] {p_name} bisection: midpoint={mid:.6f} (range [{val_need_up:.6f}, {val_need_down:.6f}])")
-                    test_bs = list(current_x)
-                    for i in p_indices:
-                        test_bs[i] = mid
-                    run_simulation_eval(test_bs)
-
-                    if get_error_pct() <= phase_tol:
-                        current_x = test_bs
+                    # Slots left free by finished layers split the range into k sections instead of two
+                    k = self.speculation_width(self.max_iter - iteration_count)
+                    points = [val_need_up + (val_need_down - val_need_up) * (j + 1) / (k + 1) for j in range(k)]
+                    if k == 1:
+                        self.log(f"[{layer_name}] {p_name} bisection: midpoint={points[0]:.6f} (range [{val_need_up:.6f}, {val_need_down:.6f}])")
+                    else:
+                        self.log(f"[{layer_name}] {p_name} {k + 1}-section: {', '.join(f'{v:.6f}' for v in points)} (range [{val_need_up:.6f}, {val_need_down:.6f}])")
+                    candidates = []
+                    for val in points:
+                        test_bs = list(current_x)
+                        for i in p_indices:
+                            test_bs[i] = val
+                        candidates.append(test_bs)
+                    results = await asyncio.gather(*(run_simulation_eval(c) for c in candidates))
+
+                    # Continue from the candidate closest to the target, inside the bracket of the first sign change
+                    best = min(range(k), key=lambda j: abs(results[j][metric_index] - (target_z if phase_name == "impedance" else target_loss)))
+                    current_x, current_metrics = candidates[best], results[best]
+                    if phase_met():
                         self.log(f"[{layer_name}] {p_name} bisection converged: {phase_name} tolerance met")
                         break
 
-                    curr_need_metric_up = current_metrics[metric_index] < (target_z if phase_name == "impedance" else target_loss)
-                    if phase_name == "impedance":
-                        curr_p_dir = get_param_z_dir(p_name, mid)
-                    else:
-                        curr_p_dir = p_dir
-                    curr_need_param_up = (curr_need_metric_up and curr_p_dir > 0) or (not curr_need_metric_up and curr_p_dir < 0)
+                    for val, metrics in zip(points, results):
+                        if need_param_up_at(val, metrics):
+                            val_need_up = val
+                        else:
+                            val_need_down = val
+                            break
 
-                    if curr_need_param_up:
-                        val_need_up = mid
-                    else:
-                        val_need_down = mid
-                    current_x = test_bs
-
-                if get_error_pct() <= phase_tol:
+                if phase_met():
                     break
 
-            return get_error_pct() <= phase_tol, iteration_count > phase_started_iterations
+            return phase_met(), iteration_count > phase_started_iterations
 
         # Initial Simulation
         current_tuning_param = "initial"
-        run_simulation_eval(current_x)
+        if self.port_only:
+            # The starting point is solved both ways to calibrate the port-only Zdiff
+            initial_metrics, _ = await asyncio.gather(run_simulation_eval(current_x, "full"),
+                                                      run_simulation_eval(current_x, "port_only"))
+            current_metrics = initial_metrics
+            metrics_port_only = False
+        else:
+            await run_simulation_eval(current_x)
         
         try:
-            phase_order = ["impedance", "loss"]
-            phase_index = 0
-            last_pass_phase = None
-            stalled_phase_count = 0
+            if self.noise_repeats and iteration_count < self.max_iter:
+                await estimate_noise()
+
+            feasible = True
+            if self.preflight and iteration_count < self.max_iter:
+                feasible = await preflight()
+                if not feasible:
+                    self.log(f"[{layer_name}] Targets out of reach within the variation bounds, skipping optimization.")
+
+            if self.optimizer == "space_mapping":
+                if feasible and iteration_count < self.max_iter:
+                    await space_mapping()
+            else:
+                phase_order = ["impedance", "loss"]
+                phase_index = 0
+                last_pass_phase = None
+                stalled_phase_count = 0
 
-            while iteration_count < self.max_iter:
-                phase_name = phase_order[phase_index % len(phase_order)]
-                phase_pass, phase_progress = run_phase(phase_name)
+                while feasible and iteration_count < self.max_iter:
+                    phase_name = phase_order[phase_index % len(phase_order)]
+                    phase_pass, phase_progress = await run_phase(phase_name)
 
-                if phase_pass and last_pass_phase and last_pass_phase != phase_name:
-                    self.log(f"[{layer_name}] Consecutive tolerance pass achieved: {last_pass_phase} -> {phase_name}")
-                    break
+                    if self.port_only and last_pass_phase == "impedance" and get_z_error_pct() > z_tol_percent and not within_noise(0, target_z):
+                        # The full-wave check of the port-only impedance result missed the tolerance
+                        last_pass_phase = None
 
-                if phase_pass:
-                    last_pass_phase = phase_name
-                else:
-                    last_pass_phase = None
-
-                if not phase_pass and not phase_progress:
-                    stalled_phase_count += 1
-                    if stalled_phase_count >= len(phase_order):
-                        self.log(f"[{layer_name}] No further phase progress available, stopping optimization.")
+                    if phase_pass and last_pass_phase and last_pass_phase != phase_name:
+                        self.log(f"[{layer_name}] Consecutive tolerance pass achieved: {last_pass_phase} -> {phase_name}")
                         break
-                else:
-                    stalled_phase_count = 0
 
-                phase_index += 1
+                    if phase_pass:
+                        last_pass_phase = phase_name
+                    else:
+                        last_pass_phase = None
+
+                    # A phase that passes without solving is no progress either, so a layer
+                    # whose other phase is stuck at its bounds stops instead of cycling
+                    if not phase_progress:
+                        stalled_phase_count += 1
+                        if stalled_phase_count >= len(phase_order):
+                            self.log(f"[{layer_name}] No further phase progress available, stopping optimization.")
+                            break
+                    else:
+                        stalled_phase_count = 0
+
+                    phase_index += 1
+
+            # Results are reported from a full-wave solve
+            await verify_full_wave()
 
             msg = "Optimization finished"
             success = True
@@ -736,19 +1578,230 @@ class CharacterizationEngine:
         if success:
             if z_converged and loss_converged:
                 stats['status'] = "Done"
+            elif not feasible:
+                stats['status'] = "Infeasible"
+            elif (z_converged or within_noise(0, target_z)) and (loss_converged or within_noise(1, target_loss)):
+                stats['status'] = "Done (noise)"
             elif iteration_count >= self.max_iter:
                 stats['status'] = "Max Iter"
             else:
                 stats['status'] = "Done (partial)"
             self.log(f"[{layer_name}] Finished. Z={final_z:.2f} (target={target_z:.2f}, {'PASS' if z_converged else 'FAIL'}), "
                      f"Loss={final_loss:.2f} (target={target_loss}, {'PASS' if loss_converged else 'FAIL'})")
+            self.log_coupons(layer_name, coupons, coupons_at(current_x))
         else:
             stats['status'] = "Failed"
             self.log(f"[{layer_name}] Failed: {msg}")
         
         stats['best_z'] = final_z
         stats['best_loss'] = final_loss
+        stats['eta'] = "-"
         self.update_stats(layer_name, stats)
         
         # Return the last converged parameter set (not a global-best weighted set)
         return dict(zip(keys, current_x))
+
+    def joint_ignored_options(self):
+        """Options set for this run that optimize_joint does not honour, as shown to the user."""
+        ignored = []
+        if self.port_only:
+            ignored.append("port-only impedance")
+        if self.preflight:
+            ignored.append(f"preflight ({self.preflight})")
+        if self.noise_repeats:
+            ignored.append(f"{self.noise_repeats} noise repeats")
+        if self.optimizer != "space_mapping":
+            ignored.append(f"the {self.optimizer} optimizer")
+        joint_layers = [idx for chain in layer_chains(self.stackup, self.stackup.signal_indices) if len(chain) > 1 for idx in chain]
+        measured = [self.stackup.layers[idx].name for idx in joint_layers if self.stackup.layers[idx].get('measured_s21')]
+        if measured:
+            ignored.append(f"the measured S21 fit of {', '.join(measured)}")
+        return ignored
+
+    async def optimize_joint(self, layer_indices, signal_halves):
+        """Characterize signal layers that share dielectrics as one problem.
+
+        A dielectric is a single unknown however many of the layers use it, so its
+        dk/df are fitted once against the targets of all of them. Each step solves
+        every layer at the same candidate (in parallel solver slots) and the next
+        candidate comes from space mapping on the layers' coarse models.
+        Every solve counts against max_iter, so a batch of n layers uses n.
+        Returns {layer index: optimized values}.
+        """
+        settings = self.stackup.settings
+        z_tol_percent, loss_tol_percent = target_tolerances(settings)
+        unknowns = []  # (stackup row, value key) of each entry of x; dk/df belong to the dielectric row
+        x0, bounds = [], []
+        layers = []
+        for idx in layer_indices:
+            info = extract_layer_params(self.stackup, idx)
+            values = layer_values(info)
+            columns = []
+            for key, val in values.items():
+                if key.startswith(('dk_', 'df_')):
+                    unknown = (info['diel_above_index'] if key.endswith('_up') else info['diel_below_index'], key[:2])
+                else:
+                    unknown = (idx, key)
+                if unknown not in unknowns:
+                    unknowns.append(unknown)
+                    x0.append(val)
+                    bounds.append(variation_bounds(key, val, settings))
+                columns.append(unknowns.index(unknown))
+            layer = info['layer']
+            layers.append({"index": idx, "info": info, "name": layer.name, "keys": list(values), "columns": columns,
+                           "target_z": value_or(layer.impedance_target, 0), "target_loss": value_or(layer.loss_target, 0),
+                           "loss_at": loss_query(layer, self.freq_stop), "coupons": coupon_geometries(layer), "last_coupons": [], "solved": [], "sweep": None,
+                           "stats": {"status": "Running", "iterations": 0, "target_z": value_or(layer.impedance_target, 0),
+                                     "target_loss": value_or(layer.loss_target, 0), "best_z": 0, "best_loss": 0,
+                                     "time_elapsed": "0s"}})
+        names = " + ".join(entry["name"] for entry in layers)
+        shared = sorted({row for row, key in unknowns if key == 'dk'
+                         and sum(1 for entry in layers if row in (entry["info"]['diel_above_index'], entry["info"]['diel_below_index'])) > 1})
+        self.log(f"[{names}] Joint characterization: {len(x0)} unknowns, shared dielectrics "
+                 f"{', '.join(self.stackup.layers[row].name for row in shared) or 'none'}")
+        for entry in layers:
+            self.update_stats(entry["name"], entry["stats"])
+        start_time = time.time()
+
+        targets, tolerances = [], []
+
+        def assign_targets():
+            """Lay out the metric vector: per layer its own (Zdiff, S21) followed by those of its coupon geometries."""
+            targets.clear()
+            tolerances.clear()
+            for entry in layers:
+                entry["offset"] = len(targets)
+                targets.extend([entry["target_z"], entry["target_loss"]])
+                for coupon in entry["coupons"]:
+                    targets.extend([coupon['impedance_target'], coupon['loss_target']])
+                tolerances.extend([z_tol_percent, loss_tol_percent] * (1 + len(entry["coupons"])))
+
+        assign_targets()
+        layout_fixed = False  # the metric vector, the coarse models and the mapping are sized once the first batch is in
+        iteration = 0  # batches; every layer of a batch shares its iteration number
+        solves = 0
+
+        def layer_candidate(entry, x):
+            return {k: float(x[c]) for k, c in zip(entry["keys"], entry["columns"])}
+
+        async def solve_layer(entry, x, tuning_param):
+            layer_name = entry["name"]
+            values = layer_candidate(entry, x)
+            zdiff, dbs21, aedb_path, coupon_metrics = await self.solve_candidate(entry["info"], signal_halves[entry["index"]], iteration,
+                                                                                 values, "full", entry["loss_at"], entry["solved"])
+            self.log(f"[{layer_name}] Iter {iteration}: Zdiff={zdiff:.2f}, S21={dbs21:.2f}")
+            for coupon, (coupon_z, coupon_s21) in zip(entry["coupons"], coupon_metrics):
+                self.log(f"[{layer_name}] Iter {iteration}: Coupon W={coupon['width']:g}/S={coupon['spacing']:g}: "
+                         f"Zdiff={coupon_z:.2f}, S21={coupon_s21:.2f}")
+            if entry["coupons"] and len(coupon_metrics) != len(entry["coupons"]):
+                if layout_fixed:
+                    # Dropping the coupons now would change the size of the metric vector the mapping was built on
+                    self.log(f"[{layer_name}] The solver returned no coupon results, keeping those of the last solve")
+                    coupon_metrics = entry["last_coupons"]
+                else:
+                    self.log(f"[{layer_name}] The solver returned no coupon results, fitting the layer's own pair only")
+                    entry["coupons"] = []
+            entry["last_coupons"] = coupon_metrics
+            z_error_pct = abs(zdiff - entry["target_z"]) / entry["target_z"] if entry["target_z"] else 0
+            loss_error_pct = abs(dbs21 - entry["target_loss"]) / abs(entry["target_loss"]) if entry["target_loss"] else 0
+            self.log_iteration(iteration, entry["info"]['layer'], "joint", tuning_param, values, zdiff, dbs21,
+                               z_error_pct <= z_tol_percent, loss_error_pct <= loss_tol_percent, "full")
+            entry["solved"].append((iteration, values, aedb_path))
+            self.retention.add(layer_name, iteration, z_error_pct + loss_error_pct)
+            if os.path.exists(sweep_path(aedb_path)):
+                entry["sweep"] = load_curve(sweep_path(aedb_path))
+            self.remaining[layer_name] = expected_solves([z_error_pct, loss_error_pct], [z_tol_percent, loss_tol_percent],
+                                                         (self.max_iter - solves) // len(layers))
+            stats = entry["stats"]
+            stats.update(iterations=iteration, best_z=zdiff, best_loss=dbs21, time_elapsed=f"{int(time.time() - start_time)}s",
+                         eta=format_duration(self.layer_eta(layer_name)), run_eta=format_duration(self.run_eta()))
+            self.update_stats(layer_name, stats)
+            return [zdiff, dbs21] + [m for pair in coupon_metrics[:len(entry["coupons"])] for m in pair]
+
+        async def solve_all(x, tuning_param):
+            """Solve every layer at candidate x as one batch; returns their (Zdiff, S21) pairs, coupons included, in one vector."""
+            nonlocal iteration, solves
+            await self.wait_if_paused()
+            iteration += 1
+            solves += len(layers)
+            results = await asyncio.gather(*(solve_layer(entry, x, tuning_param) for entry in layers))
+            return [m for pair in results for m in pair]
+
+        def met(metrics):
+            return all(not t or abs(m - t) / abs(t) <= tol for m, t, tol in zip(metrics, targets, tolerances))
+
+        current_x = list(x0)
+        current_metrics = [0.0] * len(targets)
+        success = True
+        try:
+            current_metrics = await solve_all(current_x, "initial")
+            assign_targets()
+            layout_fixed = True
+
+            models = []  # per layer: the coarse model of its own pair, then one per coupon geometry
+            for entry in layers:
+                model_args = (entry["loss_at"][1] if entry["loss_at"] else self.freq_stop, float(self.stackup.frequency),
+                              float(self.stackup.copper_conductivity))
+                values = layer_candidate(entry, current_x)
+                offset = entry["offset"]
+                coarse = CoarseModel(entry["info"], *model_args)
+                coarse.calibrate(values, current_metrics[offset + 1], entry["sweep"])
+                layer_models = [coarse]
+                for n, coupon in enumerate(entry["coupons"], 1):
+                    model = CoarseModel(entry["info"], *model_args, width=coupon['width'], spacing=coupon['spacing'])
+                    model.calibrate(values, current_metrics[offset + 2 * n + 1])
+                    layer_models.append(model)
+                models.append(layer_models)
+
+            def coarse_metrics(x):
+                return np.concatenate([model.metrics(layer_candidate(entry, x))
+                                       for layer_models, entry in zip(models, layers) for model in layer_models])
+
+            mapping = SpaceMapping(coarse_metrics, bounds, targets, tolerances)
+            mapping.update(current_x, current_metrics)
+            while solves + len(layers) <= self.max_iter:
+                if met(current_metrics):
+                    self.log(f"[{names}] Joint characterization converged: all targets met")
+                    break
+                if mapping.exhausted:
+                    self.log(f"[{names}] Joint characterization: the model finds no further improvement near the best solve, stopping.")
+                    break
+                x, predicted = mapping.next_candidate()
+                if all(abs(a - b) <= 1e-4 * max(abs(b), 1e-12) for a, b in zip(x, current_x)):
+                    self.log(f"[{names}] Joint characterization: the model optimum is the current candidate, stopping.")
+                    break
+                self.log(f"[{names}] Joint step: model predicts "
+                         + ", ".join(f"{entry['name']} Zdiff={predicted[entry['offset']]:.2f} S21={predicted[entry['offset'] + 1]:.2f}" for entry in layers))
+                metrics = await solve_all(x, "space_mapping")
+                if mapping.update(x, metrics):
+                    current_x, current_metrics = x, metrics
+                else:
+                    self.log(f"[{names}] Joint step: no improvement, step range cut to {mapping.radius:.0%} of the bounds")
+        except Exception as e:
+            success = False
+            self.log(f"[{names}] Failed: Optimization failed: {e}")
+
+        results = {}
+        for entry in layers:
+            stats = entry["stats"]
+            offset = entry["offset"]
+            final_z, final_loss = current_metrics[offset], current_metrics[offset + 1]
+            z_converged = abs(final_z - entry["target_z"]) / entry["target_z"] <= z_tol_percent if entry["target_z"] else True
+            loss_converged = abs(final_loss - entry["target_loss"]) / abs(entry["target_loss"]) <= loss_tol_percent if entry["target_loss"] else True
+            if not success:
+                stats['status'] = "Failed"
+            elif z_converged and loss_converged:
+                stats['status'] = "Done"
+            elif solves + len(layers) > self.max_iter:
+                stats['status'] = "Max Iter"
+            else:
+                stats['status'] = "Done (partial)"
+            if success:
+                self.log(f"[{entry['name']}] Finished. Z={final_z:.2f} (target={entry['target_z']:.2f}, {'PASS' if z_converged else 'FAIL'}), "
+                         f"Loss={final_loss:.2f} (target={entry['target_loss']}, {'PASS' if loss_converged else 'FAIL'})")
+                coupon_values = current_metrics[offset + 2:offset + 2 + 2 * len(entry["coupons"])]
+                self.log_coupons(entry["name"], entry["coupons"], list(zip(coupon_values[::2], coupon_values[1::2])))
+            stats.update(best_z=final_z, best_loss=final_loss, eta="-")
+            self.update_stats(entry["name"], stats)
+            results[entry["index"]] = layer_candidate(entry, current_x)
+        return results
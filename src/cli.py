@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from characterization_engine import CharacterizationEngine
+from broker import BrokerSolver
+from solvers import ReplaySolver
+from stackup_model import Stackup
+from tolerance_analysis import run_tolerance_analysis
+
+def main():
+    parser = argparse.ArgumentParser(description="Characterize a stackup without the GUI.")
+    parser.add_argument("json_path", help="Stackup JSON file")
+    parser.add_argument("--max-iter", type=int, default=10)
+    parser.add_argument("--max-delta-s", type=float, default=0.02)
+    parser.add_argument("--freq-stop", type=float, default=5)
+    parser.add_argument("--structure", choices=["full", "short", "two_line"], default="full",
+                        help="Solved geometry: the full 1000 mil line, or a compact short line (two lines) scaled to 1000 mil")
+    parser.add_argument("--symmetry", action="store_true")
+    parser.add_argument("--warm-start", action="store_true",
+                        help="Start each solve from the converged mesh of the nearest solved candidate with the same copper "
+                             "thickness and etch factor (local solves only)")
+    parser.add_argument("--port-only-impedance", action="store_true",
+                        help="Tune impedance with port-only (2D) solves; loss tuning and the final result stay full-wave")
+    parser.add_argument("--solver-slots", type=int, default=1, metavar="N",
+                        help="Solves run at the same time; layers without a shared dielectric are characterized in parallel, "
+                             "longest predicted first, and idle slots solve extra bisection candidates")
+    parser.add_argument("--cores", type=int, default=20,
+                        help="Cores shared by the running solves; each solve gets the fewest cores its predicted speedup still pays for")
+    parser.add_argument("--preflight", choices=["skip", "widen"], nargs="?", const="skip",
+                        help="First solve the far corners of the impedance and loss bounds; a layer whose target lies beyond them "
+                             "is skipped, or with 'widen' gets wider bounds when the corners show by how much")
+    parser.add_argument("--noise-repeats", type=int, default=0, metavar="N",
+                        help="Solve each layer's starting point N more times on a fresh mesh to measure the solver noise; "
+                             "errors within 2 sigma of it are not chased further")
+    parser.add_argument("--optimizer", choices=["bisection", "space_mapping"], default="bisection",
+                        help="bisection tunes one parameter at a time with HFSS; space_mapping optimizes all of them on an "
+                             "analytic model aligned to HFSS and verifies each optimum with one solve")
+    parser.add_argument("--joint-dielectrics", action="store_true",
+                        help="Fit layers that share a dielectric together, each shared dk/df as one unknown, "
+                             "instead of re-tuning it layer by layer")
+    parser.add_argument("--touchstone", action="store_true", help="Also write every solve's S-parameters as .s2p files")
+    parser.add_argument("--dedup", action="store_true", help="Characterize identical layers once")
+    parser.add_argument("--previous-run", help="Only re-characterize layers changed since this run folder")
+    parser.add_argument("--replay", nargs="+", metavar="RUN_DIR",
+                        help="Answer solves from the iteration history of these run folders instead of HFSS")
+    parser.add_argument("--broker", metavar="DIR", help="Send solves to worker agents through this shared folder")
+    parser.add_argument("--local-workers", type=int, default=0, help="Worker agents to start on this machine with --broker")
+    parser.add_argument("--retention", choices=["keep", "zip", "delete"], default="keep",
+                        help="What to do with the solved projects of iterations that are neither the best nor the latest of their layer")
+    parser.add_argument("--keep-last", type=int, default=2, help="Latest iterations per layer kept with --retention")
+    parser.add_argument("--keep-best", type=int, default=1, help="Best iterations per layer kept with --retention")
+    parser.add_argument("--max-disk-gb", type=float, help="Remove the oldest zipped iterations once the run folder grows beyond this")
+    parser.add_argument("--monte-carlo", type=int, default=0, metavar="N",
+                        help="After characterization, estimate the Zdiff/S21 spread from N manufacturing variation samples")
+    parser.add_argument("--output-dir", help="Parent folder of the run output (defaults to the JSON's folder)")
+    args = parser.parse_args()
+
+    with open(args.json_path, 'r', encoding='utf-8-sig') as f:
+        json_data = json.load(f)
+
+    if args.replay:
+        solver = ReplaySolver(args.replay)
+    elif args.broker:
+        solver = BrokerSolver(args.broker, local_workers=args.local_workers)
+    else:
+        solver = None
+    output_base_dir = args.output_dir or os.path.dirname(os.path.abspath(args.json_path))
+
+    engine = CharacterizationEngine(json_data, args.max_iter, output_base_dir=output_base_dir,
+                                    symmetry=args.symmetry, max_delta_s=args.max_delta_s, freq_stop=args.freq_stop,
+                                    dedup=args.dedup, previous_run_dir=args.previous_run, solver=solver,
+                                    structure=args.structure, touchstone=args.touchstone,
+                                    retention={"mode": args.retention, "keep_last": args.keep_last,
+                                               "keep_best": args.keep_best, "max_gb": args.max_disk_gb},
+                                    warm_start=args.warm_start, port_only=args.port_only_impedance,
+                                    solver_slots=args.solver_slots, cores=args.cores,
+                                    preflight=args.preflight, noise_repeats=args.noise_repeats,
+                                    optimizer=args.optimizer, joint=args.joint_dielectrics)
+    start_time = time.time()
+    try:
+        # Ctrl+C cancels the run, which also stops the solver processes it started
+        asyncio.run(engine.run_async())
+    except KeyboardInterrupt:
+        print("Cancelled.")
+        raise SystemExit(130)
+    finally:
+        if isinstance(solver, BrokerSolver):
+            solver.close()
+
+    print(f"\n{'Layer':<12}{'Status':<16}{'Iter':>6}{'Best Z':>10}{'Best Loss':>12}")
+    stackup = Stackup.from_json(json_data)
+    for idx in stackup.signal_indices:
+        layer_name = stackup.layers[idx].name
+        stats = engine.layer_stats.get(layer_name, {})
+        best_z = stats.get('best_z', '-')
+        best_loss = stats.get('best_loss', '-')
+        print(f"{layer_name:<12}{stats.get('status', 'Pending'):<16}{str(stats.get('iterations', '-')):>6}"
+              f"{best_z if isinstance(best_z, str) else f'{best_z:.2f}':>10}"
+              f"{best_loss if isinstance(best_loss, str) else f'{best_loss:.3f}':>12}")
+    print(f"Total time: {time.time() - start_time:.1f}s")
+
+    if args.monte_carlo:
+        run_tolerance_analysis(engine.output_dir, args.monte_carlo)
+
+if __name__ == "__main__":
+    main()
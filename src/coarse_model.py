@@ -0,0 +1,190 @@
+import numpy as np
+from scipy.optimize import least_squares, nnls
+
+from material_fit import loss_basis
+from stackup_model import value_or
+
+def differential_impedance(width, spacing, thickness, h_above, h_below, dk, microstrip):
+    """Closed-form (IPC-2141) edge-coupled Zdiff."""
+    if microstrip:
+        h = h_below if microstrip == "below" else h_above
+        z0 = 87 / np.sqrt(dk + 1.41) * np.log(5.98 * h / (0.8 * width + thickness))
+        return 2 * z0 * (1 - 0.48 * np.exp(-0.96 * spacing / h))
+    b = h_above + h_below + thickness
+    z0 = 60 / np.sqrt(dk) * np.log(4 * b / (0.67 * np.pi * (0.8 * width + thickness)))
+    return 2 * z0 * (1 - 0.347 * np.exp(-2.9 * spacing / b))
+
+def reference_side(layer):
+    """'below' or 'above' for a microstrip layer (only one reference plane), else None."""
+    top_name, bottom_name = layer.ref_names
+    if bottom_name and not top_name:
+        return "below"
+    if top_name and not bottom_name:
+        return "above"
+    return None
+
+class CoarseModel:
+    """Fast analytic Zdiff and S21 of one signal layer's coupled pair.
+
+    Zdiff is the IPC-2141 formula on the mean width of the etched trapezoid and
+    the height-weighted Dk of the two dielectrics. S21 is the conductor (Huray
+    roughened skin effect, scaled by 1/Zdiff) plus dielectric (Djordjevic-Sarkar)
+    loss shapes of material_fit at the loss target frequency, whose scales are
+    calibrated on a solve. width/spacing model another pair on the same layer
+    (a coupon geometry) instead of the layer's own.
+    """
+
+    def __init__(self, layer_info, freq_ghz, f_ref_ghz, conductivity, width=None, spacing=None):
+        layer = layer_info['layer']
+        self.width = layer.width if width is None else width
+        self.spacing = layer.spacing if spacing is None else spacing
+        self.h_above = value_or(layer_info['diel_above'].thickness, 0) if layer_info['diel_above'] else 0
+        self.h_below = value_or(layer_info['diel_below'].thickness, 0) if layer_info['diel_below'] else 0
+        self.microstrip = reference_side(layer)
+        self.freq = np.array([float(freq_ghz)])
+        self.f_ref = float(f_ref_ghz)
+        self.conductivity = float(conductivity)
+        self.scales = None
+        self.z_calibration = None
+
+    def dk(self, values):
+        up, down = values.get('dk_up'), values.get('dk_down')
+        if self.microstrip:
+            return (down if self.microstrip == "below" else up) or up or down or 1.0
+        if up is None or down is None:
+            return up or down or 1.0
+        return (up * self.h_above + down * self.h_below) / max(self.h_above + self.h_below, 1e-12)
+
+    def zdiff(self, values):
+        thickness = values['thickness']
+        etch = abs(values.get('etch_factor', 0))
+        width = self.width - thickness / etch if etch > 1e-9 else self.width
+        return float(differential_impedance(width, self.spacing, thickness, self.h_above, self.h_below,
+                                            self.dk(values), self.microstrip))
+
+    def loss_terms(self, values, freqs):
+        df = np.mean([values[k] for k in ('df_up', 'df_down') if k in values] or [0])
+        return loss_basis(np.asarray(freqs), self.dk(values), df, self.f_ref, values.get('hallhuray_surface_ratio', 0),
+                          values.get('nodule_radius', 1e-3), self.conductivity)
+
+    def calibrate(self, values, s21_db, sweep=None):
+        """Scale the loss shapes to the S21 solved at values.
+
+        The sweep of that solve, when there is one, splits the loss between
+        conductor and dielectric; otherwise they are taken as equal.
+        """
+        self.z_calibration = self.zdiff(values)
+        terms = self.loss_terms(values, self.freq)[0]
+        scales = np.ones(2) / np.maximum(terms, 1e-12)
+        if sweep is not None:
+            freqs, s21 = sweep
+            keep = freqs > 0
+            fitted, _ = nnls(self.loss_terms(values, freqs[keep]), -s21[keep])
+            if fitted.any():
+                scales = fitted
+        # The sweep may be of another line length than the loss target
+        self.scales = scales * -s21_db / max(float(terms @ scales), 1e-12)
+
+    def metrics(self, values):
+        z = self.zdiff(values)
+        conductor, dielectric = self.loss_terms(values, self.freq)[0] * self.scales
+        # Conductor loss goes as R/Z
+        conductor *= self.z_calibration / z
+        return np.array([z, -(conductor + dielectric)])
+
+class SpaceMapping:
+    """Trust-region optimization of the HFSS metrics on a surrogate built from coarse models.
+
+    coarse_metrics(x) gives the analytic counterpart of the solved metrics, one
+    (Zdiff, S21) pair per layer, each matched with a target and a tolerance.
+    s(x) = c(x) + (f(x_a) - c(x_a)) + E (x - x_a): the coarse model shifted onto
+    the best solve so far x_a, plus a linear correction E of its sensitivities,
+    updated (Broyden) from every solve. The surrogate matches HFSS at x_a and
+    along the directions already stepped, where the analytic formulas may even
+    have the wrong sign, and falls back on the coarse model elsewhere. Steps are
+    limited to a trust region (a fraction of each parameter's bound range) that
+    grows while the surrogate predicts well and shrinks when a step fails.
+    """
+
+    def __init__(self, coarse_metrics, bounds, targets, tolerances, radius=0.5):
+        self.coarse_metrics = coarse_metrics
+        self.lower = np.array([b[0] for b in bounds], dtype=float)
+        self.upper = np.array([b[1] for b in bounds], dtype=float)
+        self.targets = targets
+        self.tolerances = tolerances
+        self.radius = radius
+        self.anchor = None  # (x, fine metrics, coarse metrics) of the best solve
+        self.correction = np.zeros((len(targets), len(bounds)))
+        self.predicted_cost = None
+        self.stalls = 0  # accepted steps in a row that gained less than 1%
+
+    @property
+    def exhausted(self):
+        """The trust region collapsed or the last steps no longer improve."""
+        return self.radius < 1e-3 or self.stalls >= 2
+
+    def cost(self, metrics):
+        """Sum of the squared target errors in units of their tolerance; targets of 0 are not fitted."""
+        return float(sum(((m - t) / (abs(t) * tol)) ** 2 for m, t, tol in zip(metrics, self.targets, self.tolerances) if t))
+
+    def update(self, x, fine):
+        """Add a solve; returns True when it is the new best point."""
+        x = np.asarray(x, dtype=float)
+        fine = np.asarray(fine, dtype=float)
+        coarse = self.coarse_metrics(x)
+        if self.anchor is None:
+            self.anchor = (x, fine, coarse)
+            return True
+        anchor_x, anchor_fine, anchor_coarse = self.anchor
+        dx = x - anchor_x
+        if dx @ dx > 0:
+            mismatch = (fine - anchor_fine) - (coarse - anchor_coarse) - self.correction @ dx
+            self.correction += np.outer(mismatch, dx) / (dx @ dx)
+        old, new = self.cost(anchor_fine), self.cost(fine)
+        if new >= old:
+            self.radius *= 0.25
+            return False
+        self.stalls = self.stalls + 1 if old - new < 0.01 * old else 0
+        predicted_gain = old - self.predicted_cost if self.predicted_cost is not None else 0
+        if predicted_gain > 0 and (old - new) / predicted_gain > 0.75:
+            self.radius = min(1.0, self.radius * 2)
+        # The new point becomes the anchor; E stays the sensitivity correction around it
+        self.anchor = (x, fine, coarse)
+        return True
+
+    def surrogate(self, x):
+        anchor_x, anchor_fine, anchor_coarse = self.anchor
+        x = np.asarray(x, dtype=float)
+        return anchor_fine + self.coarse_metrics(x) - anchor_coarse + self.correction @ (x - anchor_x)
+
+    def next_candidate(self, regularization=0.05):
+        """Surrogate optimum within the trust region, with the smallest relative change among equally good ones.
+
+        Returns the candidate and its predicted metrics.
+        """
+        anchor_x = self.anchor[0]
+        span = self.radius * (self.upper - self.lower)
+        lower = np.maximum(self.lower, anchor_x - span)
+        upper = np.minimum(self.upper, anchor_x + span)
+        free = upper > lower
+        scale = np.maximum(np.abs(anchor_x), 1e-12)
+        active = [i for i, t in enumerate(self.targets) if t]
+        if not free.any():
+            return list(anchor_x), self.surrogate(anchor_x)
+
+        def full_x(u):
+            x = anchor_x.copy()
+            x[free] = u
+            return x
+
+        def residuals(u):
+            predicted = self.surrogate(full_x(u))
+            errors = [(predicted[i] - self.targets[i]) / (abs(self.targets[i]) * self.tolerances[i]) for i in active]
+            return np.concatenate([errors, regularization * (u - anchor_x[free]) / scale[free]])
+
+        fit = least_squares(residuals, np.clip(anchor_x[free], lower[free], upper[free]),
+                            bounds=(lower[free], upper[free]), x_scale=scale[free])
+        x = full_x(fit.x)
+        predicted = self.surrogate(x)
+        self.predicted_cost = self.cost(predicted)
+        return list(x), predicted
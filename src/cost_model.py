@@ -0,0 +1,164 @@
+import csv
+import glob
+import math
+import os
+
+import numpy as np
+
+COST_FILE = "solve_times.csv"
+COST_HEADER = ["layer", "iteration", "solution", "layers", "sweep_points", "max_delta_s", "lines", "cores", "passes",
+               "modeling_s", "analyze_s", "extract_s"]
+STAGES = ("modeling_s", "analyze_s", "extract_s")
+SWEEP_STEP_GHZ = 0.05  # modeling.py sweeps in 50 MHz steps
+SERIAL_FRACTIONS = np.linspace(0, 0.95, 20)
+
+def solve_features(params):
+    """Inputs of the cost model taken from the modeling parameters of one solve."""
+    return {
+        "solution": params.get("solution", "full"),
+        "layers": len(params["layers"]),
+        "sweep_points": round(float(params.get("freq_stop", 5)) / SWEEP_STEP_GHZ),
+        "max_delta_s": float(params.get("max_delta_s", 0.02)),
+        # Every coupon geometry repeats the lines of the structure
+        "lines": len(params.get("structure", {}).get("line_lengths_mil", [1000])) * (1 + len(params.get("coupons", []))),
+    }
+
+def feature_row(features, passes):
+    return [1.0, math.log(features["layers"]), math.log(max(features["sweep_points"], 1)),
+            math.log(1 / features["max_delta_s"]), math.log(features["lines"]), math.log(passes + 1),
+            1.0 if features["solution"] == "port_only" else 0.0]
+
+def speedup_factor(serial, cores):
+    """Amdahl's law: run time on cores relative to one core."""
+    return serial + (1 - serial) / np.asarray(cores, dtype=float)
+
+def ridge_fit(X, y, ridge=1e-2):
+    reg = ridge * np.eye(X.shape[1])
+    reg[0, 0] = 0
+    beta = np.linalg.solve(X.T @ X + reg, X.T @ y)
+    return beta, float(((X @ beta - y) ** 2).sum())
+
+def load_solve_times(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', newline='') as f:
+        return list(csv.DictReader(f))
+
+def append_solve_time(path, row):
+    new_file = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COST_HEADER)
+        if new_file:
+            writer.writeheader()
+        writer.writerow({k: row.get(k, '') for k in COST_HEADER})
+
+def recorded_solve_times(base_dir, limit=20):
+    """Solve time rows of the latest run folders under base_dir."""
+    run_dirs = sorted(glob.glob(os.path.join(base_dir, "stackup_characterization_*")))[-limit:]
+    rows = []
+    for run_dir in run_dirs:
+        rows.extend(load_solve_times(os.path.join(run_dir, COST_FILE)))
+    return rows
+
+def format_duration(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+class SolveCostModel:
+    """Predicts the modeling, analyze and extract seconds of a solve from recorded ones.
+
+    Each stage is a log-linear fit of stackup size, sweep points, max delta S,
+    line count, adaptive passes and solution type. The analyze stage also scales
+    with the cores through Amdahl's law, whose serial fraction is picked from a
+    grid by the fit residual, which needs solves recorded with different core
+    counts (see pick_cores).
+    """
+
+    def __init__(self, rows=()):
+        self.rows = []
+        self.fits = {}
+        for row in rows:
+            self.add(row, refit=False)
+        self.fit()
+
+    def add(self, row, refit=True):
+        try:
+            features = {"solution": row["solution"] or "full", "layers": int(row["layers"]),
+                        "sweep_points": int(row["sweep_points"]), "max_delta_s": float(row["max_delta_s"]),
+                        "lines": int(row["lines"])}
+            cores = int(row["cores"])
+            passes = int(row["passes"])
+            times = [float(row[stage]) for stage in STAGES]
+        except (KeyError, TypeError, ValueError):
+            return
+        self.rows.append((features, cores, passes, times))
+        if refit:
+            self.fit()
+
+    def fit(self):
+        self.fits = {}
+        if not self.rows:
+            return
+        X = np.array([feature_row(f, p) for f, _, p, _ in self.rows])
+        cores = np.array([c for _, c, _, _ in self.rows])
+        times = np.maximum(np.array([t for _, _, _, t in self.rows]), 1e-3)
+        for n, stage in enumerate(STAGES):
+            y = np.log(times[:, n])
+            if stage != "analyze_s":
+                self.fits[stage] = (ridge_fit(X, y)[0], 1.0)
+                continue
+            best = None
+            for serial in SERIAL_FRACTIONS:
+                beta, residual = ridge_fit(X, y - np.log(speedup_factor(serial, cores)))
+                if best is None or residual < best[1] - 1e-9:
+                    best = (beta, residual, serial)
+            self.fits[stage] = (best[0], best[2])
+
+    @property
+    def fitted(self):
+        return bool(self.fits)
+
+    def typical_passes(self, solution):
+        passes = [p for f, _, p, _ in self.rows if f["solution"] == solution]
+        return float(np.median(passes)) if passes else 0.0
+
+    def predict(self, features, cores, passes=None):
+        """Predicted seconds of one solve, or None before any solve was recorded."""
+        if not self.fitted:
+            return None
+        passes = self.typical_passes(features["solution"]) if passes is None else passes
+        x = np.array(feature_row(features, passes))
+        total = 0.0
+        for stage, (beta, serial) in self.fits.items():
+            total += float(np.exp(x @ beta) * speedup_factor(serial, cores))
+        return total
+
+    def knee_cores(self, features, available, lowest=1, tolerance=0.1):
+        """Fewest cores (at least lowest) whose predicted solve time is within tolerance of using all available cores."""
+        available = max(1, int(available))
+        if not self.fitted:
+            return available
+        full = self.predict(features, available)
+        for cores in range(min(max(1, lowest), available), available + 1):
+            if self.predict(features, cores) <= full * (1 + tolerance):
+                return cores
+        return available
+
+    def pick_cores(self, features, available):
+        """Cores for the next solve: the knee of the speedup curve once it can be measured.
+
+        While all recorded solves used about the same number of cores the serial
+        fraction is unknown, so one solve is run on half the cores to measure it.
+        The curve is not followed further than half the fewest cores measured.
+        """
+        available = max(1, int(available))
+        cores_seen = [c for _, c, _, _ in self.rows]
+        if not cores_seen or max(cores_seen) < 2 * min(cores_seen):
+            return max(1, available // 2) if len(cores_seen) >= 2 else available
+        return self.knee_cores(features, available, lowest=min(cores_seen) // 2)
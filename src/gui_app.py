@@ -1,3 +1,4 @@
+import asyncio
 import webview
 import threading
 import json
@@ -6,6 +7,8 @@ import sys
 import time
 import webbrowser
 from characterization_engine import CharacterizationEngine
+from broker import BrokerSolver
+from stackup_model import Stackup, value_or
 
 class StackupAPI:
     def __init__(self):
@@ -22,13 +25,20 @@ class StackupAPI:
         result = self.window.create_file_dialog(webview.OPEN_DIALOG, allow_multiple=False, file_types=file_types)
         return result[0] if result else None
 
-    def start_optimization(self, json_path, max_iter, symmetry=False, max_delta_s=0.02, freq_stop=5):
+    def select_folder(self):
+        result = self.window.create_file_dialog(webview.FOLDER_DIALOG)
+        return result[0] if result else None
+
+    def start_optimization(self, json_path, max_iter, symmetry=False, max_delta_s=0.02, freq_stop=5, dedup=False, previous_run_dir=None, structure="full"):
         if self.running:
             return {"status": "error", "message": "Optimization already running"}
         
         if not json_path or not os.path.exists(json_path):
             return {"status": "error", "message": "Invalid file path"}
 
+        if previous_run_dir and not os.path.isdir(previous_run_dir):
+            return {"status": "error", "message": "Invalid previous run folder"}
+
         try:
             max_iter = int(max_iter)
             max_delta_s = float(max_delta_s)
@@ -37,6 +47,7 @@ class StackupAPI:
             return {"status": "error", "message": "Invalid parameter values"}
 
         self.running = True
+        self.engine = None
         self.stats = {} # Reset stats
         
         # Load JSON
@@ -48,13 +59,13 @@ class StackupAPI:
             return {"status": "error", "message": f"Failed to load JSON: {str(e)}"}
 
         # Start thread
-        thread = threading.Thread(target=self._run_engine, args=(json_data, max_iter, json_path, symmetry, max_delta_s, freq_stop))
+        thread = threading.Thread(target=self._run_engine, args=(json_data, max_iter, json_path, symmetry, max_delta_s, freq_stop, dedup, previous_run_dir, structure))
         thread.daemon = True
         thread.start()
         
         return {"status": "success", "message": "Optimization started"}
 
-    def _run_engine(self, json_data, max_iter, original_path, symmetry, max_delta_s, freq_stop):
+    def _run_engine(self, json_data, max_iter, original_path, symmetry, max_delta_s, freq_stop, dedup, previous_run_dir, structure):
         def log_callback(msg):
             if self.window:
                 clean_msg = msg.replace('\n', '<br>')
@@ -65,28 +76,44 @@ class StackupAPI:
             if self.window:
                 self.window.evaluate_js(f"updateStats('{layer_name}', {json.dumps(layer_stats)})")
 
+        solver = None
         try:
             # Determine output directory based on original file
             output_base_dir = os.path.dirname(original_path)
+
+            # Send solves to worker agents when a broker folder is configured
+            config = self.get_config()
+            if config.get("broker_root"):
+                solver = BrokerSolver(config["broker_root"], local_workers=int(config.get("broker_local_workers", 0)))
+                log_callback(f"Solving through broker folder {config['broker_root']}")
             
             self.engine = CharacterizationEngine(json_data, max_iter, log_callback, stats_callback, 
                                                output_base_dir=output_base_dir, symmetry=symmetry,
-                                               max_delta_s=max_delta_s, freq_stop=freq_stop)
+                                               max_delta_s=max_delta_s, freq_stop=freq_stop, dedup=dedup,
+                                               previous_run_dir=previous_run_dir or None, solver=solver,
+                                               structure=structure or "full", retention=config.get("retention"),
+                                               warm_start=bool(config.get("warm_start")),
+                                               port_only=bool(config.get("port_only_impedance")),
+                                               solver_slots=int(config.get("solver_slots", 1)),
+                                               cores=int(config.get("cores", 20)),
+                                               preflight=config.get("preflight"),
+                                               noise_repeats=int(config.get("noise_repeats", 0)),
+                                               optimizer=config.get("optimizer", "bisection"),
+                                               joint=bool(config.get("joint_dielectrics")))
             self.engine.run()
             
             # Export self.stats to CSV with original layer order
             try:
                 csv_path = os.path.join(self.engine.output_dir, "gui_results_table.csv")
                 import csv
-                from characterization_engine import get_signal_layers
                 
                 with open(csv_path, 'w', newline='', encoding='utf-8-sig') as f:
                     writer = csv.writer(f)
                     writer.writerow(["Layer", "Status", "Iter", "Target Z", "Best Z", "Target Loss", "Best Loss", "Time"])
                     
-                    signal_indices = get_signal_layers(json_data)
-                    for idx in signal_indices:
-                        layer_name = json_data['rows'][idx]['layername']
+                    stackup = self.engine.stackup
+                    for idx in stackup.signal_indices:
+                        layer_name = stackup.layers[idx].name
                         layer_stats = self.stats.get(layer_name, {})
                         
                         writer.writerow([
@@ -107,11 +134,15 @@ class StackupAPI:
             if self.window:
                 self.window.evaluate_js("optimizationComplete()")
                 
+        except asyncio.CancelledError:
+            log_callback("Optimization cancelled.")
         except Exception as e:
             log_callback(f"Error during optimization: {str(e)}")
             import traceback
             traceback.print_exc()
         finally:
+            if solver:
+                solver.close()
             self.running = False
             if self.window:
                 try:
@@ -119,6 +150,24 @@ class StackupAPI:
                 except Exception:
                     pass
 
+    def pause_optimization(self):
+        if not self.running or not self.engine:
+            return {"status": "error", "message": "No optimization running"}
+        self.engine.pause()
+        return {"status": "success"}
+
+    def resume_optimization(self):
+        if not self.running or not self.engine:
+            return {"status": "error", "message": "No optimization running"}
+        self.engine.resume()
+        return {"status": "success"}
+
+    def cancel_optimization(self):
+        if not self.running or not self.engine:
+            return {"status": "error", "message": "No optimization running"}
+        self.engine.cancel()
+        return {"status": "success"}
+
     def get_statistics(self):
         return self.stats
 
@@ -129,17 +178,14 @@ class StackupAPI:
             with open(json_path, 'r', encoding='utf-8-sig') as f:
                 data = json.load(f)
             
-            # We need get_signal_layers from characterization_engine, but it's not imported as a function
-            # It's a helper in characterization_engine.py. Let's import it.
-            from characterization_engine import get_signal_layers
-            signal_indices = get_signal_layers(data)
+            stackup = Stackup.from_json(data)
             layers = []
-            for idx in signal_indices:
-                layer = data['rows'][idx]
+            for idx in stackup.signal_indices:
+                layer = stackup.layers[idx]
                 layers.append({
-                    "name": layer['layername'],
-                    "target_z": float(layer.get('impedance_target', 0)),
-                    "target_loss": float(layer.get('loss_target', 0))
+                    "name": layer.name,
+                    "target_z": value_or(layer.impedance_target, 0),
+                    "target_loss": value_or(layer.loss_target, 0)
                 })
             return {"status": "success", "layers": layers}
         except Exception as e:
@@ -157,8 +203,14 @@ class StackupAPI:
         script_dir = os.path.dirname(os.path.abspath(__file__))
         config_path = os.path.join(script_dir, "..", "config.json")
         try:
+            # Keep keys the settings dialog does not edit (e.g. aedt_install_dir)
+            config = {}
+            if os.path.exists(config_path):
+                with open(config_path, 'r') as f:
+                    config = json.load(f)
+            config.update(config_data)
             with open(config_path, 'w') as f:
-                json.dump(config_data, f, indent=2)
+                json.dump(config, f, indent=2)
             return {"status": "success", "message": "Configuration saved"}
         except Exception as e:
             return {"status": "error", "message": str(e)}
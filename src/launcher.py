@@ -0,0 +1,208 @@
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+IS_WINDOWS = sys.platform.startswith('win')
+
+def load_config():
+    config_path = os.path.join(SCRIPT_DIR, "..", "config.json")
+    if os.path.exists(config_path):
+        with open(config_path, 'r') as f:
+            return json.load(f)
+    return {}
+
+def get_python_exe(config=None):
+    """Interpreter used for modeling.py/simulation.py children.
+
+    config.json "python_exe" wins, then the STACKUP_PYTHON environment variable,
+    then the running interpreter. When the GUI is started with pythonw.exe,
+    sys.executable points to pythonw.exe which suppresses stdout/stderr, so the
+    console python.exe next to it is used instead.
+    """
+    config = load_config() if config is None else config
+    exe = config.get("python_exe") or os.environ.get("STACKUP_PYTHON") or sys.executable
+    if exe.lower().endswith('pythonw.exe'):
+        exe = exe[:-len('pythonw.exe')] + 'python.exe'
+    return exe
+
+def _aedt_root_var(version):
+    # "2026.1" -> "ANSYSEM_ROOT261"
+    major, minor = version.split('.')
+    return f"ANSYSEM_ROOT{major[-2:]}{minor}"
+
+def solver_env(config=None):
+    """Environment for solver children, with the AEDT install made visible.
+
+    The install directory comes from config.json "aedt_install_dir" or the
+    ANSYSEM_ROOT<ver> variable set by the AEDT installer. On Linux the install
+    directory is also put on PATH and LD_LIBRARY_PATH, which the batch hosts do
+    not have set up for non-interactive shells.
+    """
+    config = load_config() if config is None else config
+    env = dict(os.environ)
+    version = config.get("aedt_version")
+    root_var = _aedt_root_var(version) if version else None
+
+    install_dir = config.get("aedt_install_dir") or (env.get(root_var) if root_var else None)
+    if install_dir:
+        if root_var:
+            env[root_var] = install_dir
+        if not IS_WINDOWS:
+            for var in ("PATH", "LD_LIBRARY_PATH"):
+                env[var] = os.pathsep.join(p for p in (install_dir, env.get(var)) if p)
+    return env
+
+def popen_kwargs():
+    """Keyword arguments that start a child hidden and in its own process group."""
+    if IS_WINDOWS:
+        si = subprocess.STARTUPINFO()
+        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        si.wShowWindow = subprocess.SW_HIDE
+        return {
+            "creationflags": subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP,
+            "startupinfo": si,
+        }
+    return {"start_new_session": True}
+
+def script_command(script_name, *args, config=None):
+    return [get_python_exe(config), os.path.join(SCRIPT_DIR, script_name), *args]
+
+def kill_process_tree(process, timeout=10):
+    """Stop a child and everything it started (AEDT spawns its own solver processes)."""
+    if process.poll() is not None:
+        return
+    if IS_WINDOWS:
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                       capture_output=True, creationflags=subprocess.CREATE_NO_WINDOW)
+    else:
+        try:
+            pgid = os.getpgid(process.pid)
+            os.killpg(pgid, signal.SIGTERM)
+            try:
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    process.wait()
+
+async def kill_process_tree_async(process, timeout=10):
+    """kill_process_tree for an asyncio subprocess."""
+    if process.returncode is not None:
+        return
+    if IS_WINDOWS:
+        # Not subprocess.run: the other solve slots, pause and cancel must keep running meanwhile
+        taskkill = await asyncio.create_subprocess_exec("taskkill", "/F", "/T", "/PID", str(process.pid),
+                                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                                        creationflags=subprocess.CREATE_NO_WINDOW)
+        await taskkill.wait()
+    else:
+        try:
+            pgid = os.getpgid(process.pid)
+            os.killpg(pgid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    await process.wait()
+
+def run_script(script_name, *args):
+    """Run one of the helper scripts next to this file in a hidden child process.
+
+    Returns a CompletedProcess. If the caller is interrupted while waiting, the
+    whole child process tree is killed before the exception propagates.
+    """
+    config = load_config()
+    cmd = script_command(script_name, *args, config=config)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                               env=solver_env(config), **popen_kwargs())
+    try:
+        stdout, stderr = process.communicate()
+    except BaseException:
+        kill_process_tree(process)
+        raise
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+class ScriptResult:
+    """Outcome of run_script_async.
+
+    returncode is None when the call returned early on a line matching until;
+    finished is then a task that resolves to the final ScriptResult.
+    """
+
+    def __init__(self, args, returncode, stdout, stderr, finished=None):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.finished = finished
+
+async def _read_lines(stream, lines, on_line=None, until=None):
+    """Collect decoded lines until EOF, or until until(line) is true. Returns True if until stopped it."""
+    while True:
+        raw = await stream.readline()
+        if not raw:
+            return False
+        line = raw.decode(errors="replace").rstrip("\r\n")
+        lines.append(line)
+        if on_line:
+            on_line(line)
+        if until and until(line):
+            return True
+
+async def run_script_async(script_name, *args, on_line=None, until=None):
+    """Awaitable run_script that reads the child's stdout line by line while it runs.
+
+    on_line is called with every stdout line as it is printed. If until(line)
+    is true, the call returns right away and the child finishes in the
+    background (see ScriptResult). Cancelling the awaiting task, or the
+    finished task, kills the child process tree.
+    """
+    config = load_config()
+    cmd = script_command(script_name, *args, config=config)
+    process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, limit=1 << 20,
+                                                   env=solver_env(config), **popen_kwargs())
+    stdout_lines, stderr_lines = [], []
+    stderr_task = asyncio.ensure_future(_read_lines(process.stderr, stderr_lines))
+
+    async def abort():
+        stderr_task.cancel()
+        await asyncio.shield(kill_process_tree_async(process))
+
+    async def finish():
+        try:
+            await _read_lines(process.stdout, stdout_lines, on_line)
+            await stderr_task
+            await process.wait()
+        except BaseException:
+            await abort()
+            raise
+        return ScriptResult(cmd, process.returncode, "\n".join(stdout_lines), "\n".join(stderr_lines))
+
+    try:
+        stopped = await _read_lines(process.stdout, stdout_lines, on_line, until)
+    except BaseException:
+        await abort()
+        raise
+    if stopped:
+        return ScriptResult(cmd, None, "\n".join(stdout_lines), "", finished=asyncio.ensure_future(finish()))
+    return await finish()
+
+def start_script(script_name, *args):
+    """Start a helper script with piped stdin and stdout (stderr merged) for line-based communication."""
+    config = load_config()
+    return subprocess.Popen(
+        script_command(script_name, *args, config=config),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        env=solver_env(config),
+        **popen_kwargs(),
+    )
@@ -0,0 +1,56 @@
+import numpy as np
+
+# Length of the line the loss targets refer to
+REFERENCE_LENGTH_MIL = 1000
+
+# Line lengths solved per structure. "full" solves the reference line itself;
+# the compact structures solve short lines and scale the result to the reference length.
+STRUCTURE_LENGTHS_MIL = {
+    "full": [REFERENCE_LENGTH_MIL],
+    "short": [100],
+    "two_line": [100, 200],
+}
+
+def s_to_abcd(s11, s12, s21, s22, z0=100):
+    """ABCD parameters of a 2-port from its S-parameters (arrays over frequency)."""
+    s11, s12, s21, s22 = (np.asarray(s, dtype=complex) for s in (s11, s12, s21, s22))
+    a = ((1 + s11) * (1 - s22) + s12 * s21) / (2 * s21)
+    b = z0 * ((1 + s11) * (1 + s22) - s12 * s21) / (2 * s21)
+    c = ((1 - s11) * (1 - s22) - s12 * s21) / (2 * s21 * z0)
+    d = ((1 - s11) * (1 + s22) + s12 * s21) / (2 * s21)
+    return a, b, c, d
+
+def line_parameters(s11, s12, s21, s22, z0=100):
+    """Characteristic impedance and propagation exponent of a uniform line.
+
+    Returns (zc, gamma_l) where gamma_l = gamma * length for every frequency.
+    The wave ports sit on the line itself, so the 2-port is the bare line and
+    e^(gamma*l) = A + B/Zc holds exactly. The phase is unwrapped over the sweep,
+    which starts at a frequency where the line is electrically short.
+    """
+    a, b, c, d = s_to_abcd(s11, s12, s21, s22, z0)
+    zc = np.sqrt(b / c)
+    zc = np.where(zc.real < 0, -zc, zc)
+    e_gl = (a + d) / 2 + b / zc
+    gamma_l = np.log(np.abs(e_gl)) + 1j * np.unwrap(np.angle(e_gl))
+    return zc, gamma_l
+
+def line_s21(zc, gamma, length, z0=100):
+    """S21 of a uniform line of the given length between z0 terminations."""
+    gl = gamma * length
+    return 2 / (2 * np.cosh(gl) + (zc / z0 + z0 / zc) * np.sinh(gl))
+
+def extract_line(lines, z0=100):
+    """Per-length propagation constant and impedance from one or two solved lines.
+
+    lines is a list of (length, (s11, s12, s21, s22)). With two lengths the
+    propagation constant comes from their difference, so anything the two
+    launches have in common cancels out.
+    """
+    extracted = [(length, *line_parameters(*s, z0=z0)) for length, s in lines]
+    zc = np.mean([e[1] for e in extracted], axis=0)
+    if len(extracted) == 1:
+        length, _, gamma_l = extracted[0]
+        return zc, gamma_l / length
+    (short_len, _, short_gl), (long_len, _, long_gl) = sorted(extracted, key=lambda e: e[0])[:2]
+    return zc, (long_gl - short_gl) / (long_len - short_len)
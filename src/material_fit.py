@@ -0,0 +1,160 @@
+import csv
+import math
+import os
+
+import numpy as np
+from scipy.optimize import least_squares, nnls
+
+MU0 = 4e-7 * math.pi
+
+# Corner frequencies (rad/s) of the Djordjevic-Sarkar model, as used by HFSS
+DS_OMEGA_LOW = 1e4
+DS_OMEGA_HIGH = 1e12
+
+def sweep_path(aedb_path):
+    """Where simulation.py saves the S21 sweep of a solved project."""
+    return os.path.splitext(aedb_path.rstrip('/\\'))[0] + "_s21.csv"
+
+def load_curve(path):
+    """Read an S21 curve from a CSV of (frequency in GHz, S21 in dB) rows. A header row is optional."""
+    freqs, s21 = [], []
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        for row in csv.reader(f):
+            try:
+                freqs.append(float(row[0]))
+                s21.append(float(row[1]))
+            except (ValueError, IndexError):
+                continue
+    order = np.argsort(freqs)
+    return np.array(freqs)[order], np.array(s21)[order]
+
+def save_curve(path, freqs_ghz, s21_db):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["frequency_ghz", "s21_db"])
+        writer.writerows(zip(freqs_ghz, s21_db))
+
+def djordjevic_sarkar(dk, df, f_ref_ghz, freqs_ghz):
+    """Complex permittivity over freqs_ghz of the wideband Debye model through dk/df at f_ref_ghz.
+
+    Returns (eps, eps_inf, delta_eps) with eps = eps' - j*eps''.
+    """
+    def log_term(f_ghz):
+        w = 2 * np.pi * np.asarray(f_ghz) * 1e9
+        return np.log((DS_OMEGA_HIGH + 1j * w) / (DS_OMEGA_LOW + 1j * w))
+
+    span = math.log(DS_OMEGA_HIGH / DS_OMEGA_LOW)
+    ref = log_term(f_ref_ghz)
+    slope = -dk * df / ref.imag
+    eps_inf = dk - slope * ref.real
+    eps = eps_inf + slope * log_term(freqs_ghz)
+    return eps, eps_inf, slope * span
+
+def huray_factor(freqs_ghz, surface_ratio, nodule_radius_um, conductivity):
+    """Conductor loss increase of the Huray snowball model over smooth copper."""
+    delta = 1 / np.sqrt(np.pi * np.asarray(freqs_ghz) * 1e9 * MU0 * conductivity)
+    a = nodule_radius_um * 1e-6
+    return 1 + 1.5 * surface_ratio / (1 + delta / a + delta ** 2 / (2 * a ** 2))
+
+def loss_basis(freqs_ghz, dk, df, f_ref_ghz, surface_ratio, nodule_radius_um, conductivity):
+    """Conductor and dielectric insertion loss shapes (per unit scale) over frequency."""
+    eps = djordjevic_sarkar(dk, df, f_ref_ghz, freqs_ghz)[0]
+    conductor = np.sqrt(freqs_ghz) * huray_factor(freqs_ghz, surface_ratio, nodule_radius_um, conductivity)
+    dielectric = freqs_ghz * np.sqrt(eps.real) * (-eps.imag / eps.real)
+    return np.column_stack([conductor, dielectric])
+
+def _mean_of(values, keys):
+    found = [values[k] for k in keys if k in values]
+    return sum(found) / len(found)
+
+def loss_split(sim_curve, values, f_ref_ghz, conductivity):
+    """Conductor and dielectric insertion loss (dB, positive) at the last frequency of a simulated sweep.
+
+    Returns None if the layer has no loss parameters or the sweep no loss.
+    """
+    sim_f, sim_s21 = sim_curve
+    keep = (sim_f > 0)
+    sim_f, sim_s21 = sim_f[keep], sim_s21[keep]
+    df_keys = [k for k in ('df_up', 'df_down') if k in values]
+    dk_keys = [k for k in ('dk_up', 'dk_down') if k in values]
+    if not df_keys or 'hallhuray_surface_ratio' not in values or 'nodule_radius' not in values or len(sim_f) < 3:
+        return None
+    dk = _mean_of(values, dk_keys) if dk_keys else 1.0
+    basis = loss_basis(sim_f, dk, _mean_of(values, df_keys), f_ref_ghz,
+                       values['hallhuray_surface_ratio'], values['nodule_radius'], conductivity)
+    scales, _ = nnls(basis, -sim_s21)
+    if not scales.any():
+        return None
+    conductor, dielectric = basis[-1] * scales
+    return float(conductor), float(dielectric)
+
+def fit_loss_parameters(sim_curve, measured_curve, values, bounds, f_ref_ghz, conductivity, regularization=0.05):
+    """Fit df and the Huray roughness of one layer to a measured S21 curve.
+
+    The simulated sweep of the candidate `values` calibrates how much conductor
+    and dielectric loss this cross-section produces per unit of the analytic
+    shapes (Huray roughness on sqrt(f) skin loss, Djordjevic-Sarkar df). The
+    measured curve is then fitted over df (both dielectrics scaled together),
+    surface ratio and nodule radius within `bounds`, with a small pull towards
+    the current values to keep the strongly correlated roughness terms apart.
+
+    Returns (fitted values, info) where info holds the rms error in dB and the
+    fitted Djordjevic-Sarkar parameters, or (None, reason) if the curves do
+    not allow a fit.
+    """
+    sim_f, sim_s21 = sim_curve
+    meas_f, meas_s21 = measured_curve
+    keep = (sim_f > 0)
+    sim_f, sim_s21 = sim_f[keep], sim_s21[keep]
+    in_range = (meas_f >= sim_f.min()) & (meas_f <= sim_f.max())
+    meas_f, meas_s21 = meas_f[in_range], meas_s21[in_range]
+    if len(meas_f) < 3:
+        return None, "measured curve does not overlap the simulated sweep"
+
+    df_keys = [k for k in ('df_up', 'df_down') if k in values]
+    dk_keys = [k for k in ('dk_up', 'dk_down') if k in values]
+    if not df_keys or 'hallhuray_surface_ratio' not in values or 'nodule_radius' not in values:
+        return None, "layer has no loss parameters to fit"
+    dk = _mean_of(values, dk_keys) if dk_keys else 1.0
+    df0 = _mean_of(values, df_keys)
+    sr0 = values['hallhuray_surface_ratio']
+    nr0 = values['nodule_radius']
+
+    # Calibrate the loss scales on the simulated (insertion loss = -S21) curve
+    scales, _ = nnls(loss_basis(sim_f, dk, df0, f_ref_ghz, sr0, nr0, conductivity), -sim_s21)
+    if not scales.any():
+        return None, "simulated curve has no loss to calibrate against"
+
+    x0 = np.array([1.0, sr0, nr0])
+    lower = np.array([
+        max(bounds[k][0] / values[k] for k in df_keys),
+        bounds['hallhuray_surface_ratio'][0],
+        bounds['nodule_radius'][0],
+    ])
+    upper = np.array([
+        min(bounds[k][1] / values[k] for k in df_keys),
+        bounds['hallhuray_surface_ratio'][1],
+        bounds['nodule_radius'][1],
+    ])
+    x_start = np.clip(x0, lower, upper)
+    # A 100% change of one parameter costs regularization^2 of the measured curve's energy
+    prior_weight = regularization * np.sqrt(np.sum(meas_s21 ** 2))
+
+    def residuals(x):
+        model = loss_basis(meas_f, dk, df0 * x[0], f_ref_ghz, x[1], x[2], conductivity) @ scales
+        return np.concatenate([model + meas_s21, prior_weight * (x - x0) / x0])
+
+    fit = least_squares(residuals, x_start, bounds=(lower, upper), x_scale=np.abs(x0))
+    df_scale, sr, nr = fit.x
+    fitted = {k: float(values[k] * df_scale) for k in df_keys}
+    fitted['hallhuray_surface_ratio'] = float(sr)
+    fitted['nodule_radius'] = float(nr)
+
+    model = loss_basis(meas_f, dk, df0 * df_scale, f_ref_ghz, sr, nr, conductivity) @ scales
+    _, eps_inf, delta_eps = djordjevic_sarkar(dk, df0 * df_scale, f_ref_ghz, meas_f)
+    info = {
+        "rms_db": float(np.sqrt(np.mean((model + meas_s21) ** 2))),
+        "eps_inf": float(eps_inf),
+        "delta_eps": float(delta_eps),
+    }
+    return fitted, info
@@ -2,9 +2,18 @@ import sys
 import json
 import os
 from datetime import datetime
-import xml.etree.ElementTree as ET
+import xml.sax
+import xml.sax.saxutils
 from pyedb import Edb
 
+# Reference planes reach this many dielectric heights beyond the outer edge of the pair,
+# where the fields of a coupled stripline or microstrip have died out
+PLANE_EXTENT_HEIGHTS = 5
+# Air box beyond the planes (sideways) and above/below the stackup, in dielectric heights
+AIR_SIDE_HEIGHTS = 1
+AIR_VERTICAL_HEIGHTS = 5
+METERS_PER_MIL = 2.54e-5
+
 def format_float(val):
     return "{:.9f}".format(float(val)).rstrip('0').rstrip('.')
 
@@ -16,24 +25,86 @@ def load_config():
             return json.load(f)
     return {}
 
+class _HurayFixHandler(xml.sax.saxutils.XMLGenerator):
+    """Copies SAX events to the output, swapping HallHuraySurfaceRatio and NoduleRadius."""
+
+    def __init__(self, out):
+        super().__init__(out, encoding='utf-8')
+        self.modified = False
+
+    def startElement(self, name, attrs):
+        ratio = attrs.get('HallHuraySurfaceRatio')
+        radius = attrs.get('NoduleRadius')
+        if ratio is not None and radius is not None:
+            attrs = dict(attrs)
+            attrs['HallHuraySurfaceRatio'] = radius
+            attrs['NoduleRadius'] = ratio
+            self.modified = True
+        super().startElement(name, attrs)
+
 def post_process_xml(xml_path):
+    """Fix the swapped Huray attributes of an exported stackup XML in one streaming pass."""
     if not os.path.exists(xml_path):
         return
+    tmp_path = xml_path + '.tmp'
     try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        modified = False
-        for elem in root.iter():
-            ratio = elem.get('HallHuraySurfaceRatio')
-            radius = elem.get('NoduleRadius')
-            if ratio is not None and radius is not None:
-                elem.set('HallHuraySurfaceRatio', radius)
-                elem.set('NoduleRadius', ratio)
-                modified = True
-        if modified:
-            tree.write(xml_path, encoding='utf-8', xml_declaration=True)
+        with open(tmp_path, 'w', encoding='utf-8') as out:
+            handler = _HurayFixHandler(out)
+            xml.sax.parse(xml_path, handler)
+        if handler.modified:
+            os.replace(tmp_path, xml_path)
+        else:
+            os.remove(tmp_path)
     except Exception as e:
         print(f"Error post-processing XML: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def fill_material_name(layers, i, signal_half):
+    """Material that fills signal layer i of the model layers: the characterized neighbouring dielectric."""
+    fill_material = 'air'
+    # The characterized dielectric is the one that fills the signal layer
+    if signal_half == 'top' and i > 0:
+        # Top half uses dielectric above for characterization
+        prev_layer = layers[i - 1]
+        if prev_layer["type"] == "dielectric":
+            fill_material = f"m_{format_float(prev_layer.get('dk', 1))}_{format_float(prev_layer.get('df', 0))}"
+    elif signal_half == 'bottom' and i < len(layers) - 1:
+        # Bottom half uses dielectric below for characterization
+        next_layer = layers[i + 1]
+        if next_layer["type"] == "dielectric":
+            fill_material = f"m_{format_float(next_layer.get('dk', 1))}_{format_float(next_layer.get('df', 0))}"
+    elif signal_half == 'mid' or True:
+        # Fallback: search for nearest
+        if i > 0 and layers[i-1]['type'] == 'dielectric':
+             l_data = layers[i-1]
+             fill_material = f"m_{format_float(l_data.get('dk', 1))}_{format_float(l_data.get('df', 0))}"
+        elif i < len(layers) - 1 and layers[i+1]['type'] == 'dielectric':
+             l_data = layers[i+1]
+             fill_material = f"m_{format_float(l_data.get('dk', 1))}_{format_float(l_data.get('df', 0))}"
+    return fill_material
+
+def mil_value(val):
+    """Number of mils in a layer thickness such as "1.3mil"."""
+    return float(str(val).replace('mil', '') or 0)
+
+def dielectric_height_mil(params):
+    """Distance from the target layer to its farthest reference plane, through the dielectrics between them."""
+    layers = params["layers"]
+    t = next(i for i, layer in enumerate(layers) if layer["layername"] == params["target_layer"])
+    heights = []
+    for side in (layers[:t], layers[t + 1:]):
+        if any(layer["type"] == "signal" for layer in side):
+            heights.append(sum(mil_value(layer["thickness"]) for layer in side if layer["type"] == "dielectric"))
+    return max(heights, default=sum(mil_value(layer["thickness"]) for layer in layers if layer["type"] == "dielectric"))
+
+def reference_half_width_mil(params, heights=PLANE_EXTENT_HEIGHTS, trace=None):
+    """Half width of the reference planes: half the pair width plus `heights` dielectric heights.
+
+    trace is the pair to size them for (width_mil, spacing_mil), the layer's own pair by default.
+    """
+    trace = trace or params["trace_params"]
+    return trace["spacing_mil"] / 2 + trace["width_mil"] + heights * dielectric_height_mil(params)
 
 def create_stackup_model(params):
     config = load_config()
@@ -62,26 +133,7 @@ def create_stackup_model(params):
             nodule_radius = layer.get("nodule_radius", "2um")
             surface_ratio = layer.get("hallhuray_surface_ratio", 0.2)
             
-            fill_material = 'air'
-            # The characterized dielectric is the one that fills the signal layer
-            if signal_half == 'top' and i > 0:
-                # Top half uses dielectric above for characterization
-                prev_layer = params["layers"][i - 1]
-                if prev_layer["type"] == "dielectric":
-                    fill_material = f"m_{format_float(prev_layer.get('dk', 1))}_{format_float(prev_layer.get('df', 0))}"
-            elif signal_half == 'bottom' and i < len(params["layers"]) - 1:
-                # Bottom half uses dielectric below for characterization
-                next_layer = params["layers"][i + 1]
-                if next_layer["type"] == "dielectric":
-                    fill_material = f"m_{format_float(next_layer.get('dk', 1))}_{format_float(next_layer.get('df', 0))}"
-            elif signal_half == 'mid' or True:
-                # Fallback: search for nearest
-                if i > 0 and params["layers"][i-1]['type'] == 'dielectric':
-                     l_data = params["layers"][i-1]
-                     fill_material = f"m_{format_float(l_data.get('dk', 1))}_{format_float(l_data.get('df', 0))}"
-                elif i < len(params["layers"]) - 1 and params["layers"][i+1]['type'] == 'dielectric':
-                     l_data = params["layers"][i+1]
-                     fill_material = f"m_{format_float(l_data.get('dk', 1))}_{format_float(l_data.get('df', 0))}"
+            fill_material = fill_material_name(params["layers"], i, signal_half)
 
             edb.stackup.add_layer(layer_name=layer["layername"],
                                   method="add_on_bottom",
@@ -111,44 +163,67 @@ def create_stackup_model(params):
                                   thickness=layer["thickness"],
                                   material=mat_name)
             
-    spacing_mil = params["trace_params"]['spacing_mil']
-    width_mil = params["trace_params"]['width_mil']
-
-    line_p = edb.modeler.create_trace([('0mil', f'{(spacing_mil+width_mil)/2}mil'), ('1000mil', f'{(spacing_mil+width_mil)/2}mil')], 
-                                        width=f'{width_mil}mil',
-                                        net_name='pos',
-                                        layer_name=params["target_layer"],
-                                        start_cap_style='Flat',
-                                        end_cap_style='Flat')
-    line_n = edb.modeler.create_trace([('0mil', f'{-(spacing_mil+width_mil)/2}mil'), ('1000mil', f'{-(spacing_mil+width_mil)/2}mil')],
-                                        width=f'{width_mil}mil',
-                                        net_name='neg',
-                                        layer_name=params["target_layer"],
-                                        start_cap_style='Flat',
-                                        end_cap_style='Flat')
-
-    for layername in params["ref_layers"]:
-        edb.modeler.create_rectangle(layer_name=layername, 
-                                net_name='GND',
-                                lower_left_point=('0mil', '-50mil'),
-                                upper_right_point=('1000mil', '50mil')
-                                )
-                                                   
-
-    edb.excitation_manager.create_differential_wave_port(
-        line_p,
-        line_p.center_line[0],
-        line_n,
-        line_n.center_line[0],
-        port_name='port1',
-    )
-    edb.excitation_manager.create_differential_wave_port(
-        line_p,
-        line_p.center_line[-1],
-        line_n,
-        line_n.center_line[-1],
-        port_name='port2',
-    )
+    line_lengths = params.get("structure", {}).get("line_lengths_mil", [1000])
+    # Planes and air sized to the field extent of the cross-section, so the mesh covers no idle volume
+    height = dielectric_height_mil(params)
+    plane_heights = config.get("plane_extent_heights", PLANE_EXTENT_HEIGHTS)
+
+    # One differential line per length and pair geometry (the layer's own, then its coupons),
+    # each on its own ground strip sized to that pair, stacked along y. The strips abut,
+    # so neighbouring lines are two field extents apart.
+    # Line n = geometry * len(line_lengths) + k is excited by port{2n+1} (start) and port{2n+2} (end).
+    geometries = [params["trace_params"]] + params.get("coupons", [])
+    top = -reference_half_width_mil(params, plane_heights)  # lower edge of the strips; the first line sits on y=0
+    for g, trace in enumerate(geometries):
+        spacing_mil = trace['spacing_mil']
+        width_mil = trace['width_mil']
+        half_width = reference_half_width_mil(params, plane_heights, trace)
+        for k, length in enumerate(line_lengths):
+            n = g * len(line_lengths) + k
+            y0 = top + half_width
+            top += 2 * half_width
+            line_p = edb.modeler.create_trace([('0mil', f'{y0 + (spacing_mil+width_mil)/2}mil'), (f'{length}mil', f'{y0 + (spacing_mil+width_mil)/2}mil')], 
+                                                width=f'{width_mil}mil',
+                                                net_name='pos',
+                                                layer_name=params["target_layer"],
+                                                start_cap_style='Flat',
+                                                end_cap_style='Flat')
+            line_n = edb.modeler.create_trace([('0mil', f'{y0 - (spacing_mil+width_mil)/2}mil'), (f'{length}mil', f'{y0 - (spacing_mil+width_mil)/2}mil')],
+                                                width=f'{width_mil}mil',
+                                                net_name='neg',
+                                                layer_name=params["target_layer"],
+                                                start_cap_style='Flat',
+                                                end_cap_style='Flat')
+
+            for layername in params["ref_layers"]:
+                edb.modeler.create_rectangle(layer_name=layername, 
+                                        net_name='GND',
+                                        lower_left_point=('0mil', f'{y0 - half_width}mil'),
+                                        upper_right_point=(f'{length}mil', f'{y0 + half_width}mil')
+                                        )
+                                                       
+
+            edb.excitation_manager.create_differential_wave_port(
+                line_p,
+                line_p.center_line[0],
+                line_n,
+                line_n.center_line[0],
+                port_name=f'port{2*n+1}',
+            )
+            edb.excitation_manager.create_differential_wave_port(
+                line_p,
+                line_p.center_line[-1],
+                line_n,
+                line_n.center_line[-1],
+                port_name=f'port{2*n+2}',
+            )
+    # Absolute extents; the default multiples of the layout size grow with the line length
+    extent = edb.hfss.hfss_extent_info
+    extent.set_dielectric_extent(0, is_multiple=False)
+    extent.set_air_box_horizontal_extent(AIR_SIDE_HEIGHTS * height * METERS_PER_MIL, is_multiple=False)
+    extent.set_air_box_positive_vertical_extent(AIR_VERTICAL_HEIGHTS * height * METERS_PER_MIL, is_multiple=False)
+    extent.set_air_box_negative_vertical_extent(AIR_VERTICAL_HEIGHTS * height * METERS_PER_MIL, is_multiple=False)
+
     #edb.excitations['port1'].deembed = True
     #edb.excitations['port1'].deembed_length = '-990mil'
 
@@ -166,102 +241,143 @@ def create_stackup_model(params):
     edb.save()
     edb.close_edb()
 
+def _safe_float(val, default=0):
+    if val is None or val == '':
+        return default
+    return float(val)
+
+def _dielectric_material_name(layer):
+    return f"m_{format_float(layer.get('dk', 1) or 1)}_{format_float(layer.get('df', 0) or 0)}"
+
+def _add_dielectric_materials(edb, rows):
+    for layer in rows:
+        if layer['type'] == 'dielectric':
+            mat_name = _dielectric_material_name(layer)
+            if mat_name not in edb.materials.materials:
+                edb.materials.add_dielectric_material(name=mat_name,
+                                                      permittivity=format_float(layer.get('dk', 1) or 1),
+                                                      dielectric_loss_tangent=format_float(layer.get('df', 0) or 0))
+
+def full_stackup_layer_settings(rows):
+    """Resolve the EDB settings of every row of the full stackup.
+
+    Conductors in the top half are filled with the nearest dielectric above them
+    and those in the bottom half with the nearest dielectric below, matching the
+    dielectric each half was characterized with.
+    """
+    signal_indices = [idx for idx, l in enumerate(rows) if l['type'] == 'conductor']
+    midpoint = len(signal_indices) // 2
+
+    settings = []
+    current_signal_count = 0
+    for i, layer in enumerate(rows):
+        thickness = f"{_safe_float(layer['thickness'])}mil"
+        if layer['type'] == 'conductor':
+            half = "top" if current_signal_count < midpoint else "bottom"
+            current_signal_count += 1
+
+            fill_material = 'air'
+            search = range(i - 1, -1, -1) if half == 'top' else range(i + 1, len(rows))
+            for j in search:
+                if rows[j]['type'] == 'dielectric':
+                    fill_material = _dielectric_material_name(rows[j])
+                    break
+
+            settings.append({
+                "layer_type": "signal",
+                "thickness": thickness,
+                "material": "my_copper",
+                "fill_material": fill_material,
+                "etch_factor": _safe_float(layer.get('etchfactor', 0)),
+                "surface_ratio": _safe_float(layer.get('hallhuray_surface_ratio', 0)),
+                "nodule_radius": f"{_safe_float(layer.get('nodule_radius', 0))}um",
+            })
+        elif layer['type'] == 'dielectric':
+            settings.append({
+                "layer_type": "dielectric",
+                "thickness": thickness,
+                "material": _dielectric_material_name(layer),
+            })
+        else:
+            settings.append(None)
+    return settings
+
+def _apply_roughness(signal_layer, nodule_radius, surface_ratio):
+    signal_layer.top_hallhuray_nodule_radius = nodule_radius
+    signal_layer.top_hallhuray_surface_ratio = surface_ratio
+    signal_layer.bottom_hallhuray_nodule_radius = nodule_radius
+    signal_layer.bottom_hallhuray_surface_ratio = surface_ratio
+    signal_layer.side_hallhuray_nodule_radius = nodule_radius
+    signal_layer.side_hallhuray_surface_ratio = surface_ratio
+
+def add_full_stackup_layers(edb, stackup_data, copper_cond=5.8e7):
+    """Create all materials and layers of the full stackup. Returns the applied settings."""
+    rows = stackup_data['rows']
+    edb.materials.add_conductor_material("my_copper", copper_cond)
+    _add_dielectric_materials(edb, rows)
+
+    settings = full_stackup_layer_settings(rows)
+    for layer, layer_settings in zip(rows, settings):
+        if layer_settings is None:
+            continue
+        if layer_settings['layer_type'] == 'signal':
+            edb.stackup.add_layer(layer_name=layer['layername'],
+                                  method="add_on_bottom",
+                                  layer_type='signal',
+                                  thickness=layer_settings['thickness'],
+                                  material=layer_settings['material'],
+                                  filling_material=layer_settings['fill_material'],
+                                  etch_factor=layer_settings['etch_factor'],
+                                  enable_roughness=True)
+            _apply_roughness(edb.stackup.layers[layer['layername']],
+                             layer_settings['nodule_radius'], layer_settings['surface_ratio'])
+        else:
+            edb.stackup.add_layer(layer_name=layer['layername'],
+                                  method="add_on_bottom",
+                                  layer_type='dielectric',
+                                  thickness=layer_settings['thickness'],
+                                  material=layer_settings['material'])
+    return settings
+
+def update_full_stackup_layers(edb, stackup_data, previous_settings):
+    """Bring an existing full stackup in line with stackup_data, touching only changed layers.
+
+    Returns the new settings and the number of layers that were updated.
+    """
+    rows = stackup_data['rows']
+    _add_dielectric_materials(edb, rows)
+
+    settings = full_stackup_layer_settings(rows)
+    updated = 0
+    for layer, layer_settings, old_settings in zip(rows, settings, previous_settings):
+        if layer_settings is None or layer_settings == old_settings:
+            continue
+        stackup_layer = edb.stackup.layers[layer['layername']]
+        stackup_layer.thickness = layer_settings['thickness']
+        stackup_layer.material = layer_settings['material']
+        if layer_settings['layer_type'] == 'signal':
+            stackup_layer.fill_material = layer_settings['fill_material']
+            stackup_layer.etch_factor = layer_settings['etch_factor']
+            _apply_roughness(stackup_layer, layer_settings['nodule_radius'], layer_settings['surface_ratio'])
+        updated += 1
+    return settings, updated
+
+def export_full_stackup(edb, output_path):
+    edb.save()
+    xml_output = f'{output_path}/full_stackup.xml'
+    edb.stackup.export(xml_output, include_material_with_layer=True)
+    post_process_xml(xml_output)
+
 def create_full_stackup(params):
     try:
         output_path = params["output_aedb_path"]
-        stackup_data = params["stackup_data"]
         
         config = load_config()
         edb_version = config.get("edb_version", "2024.1")
         
         edb = Edb(output_path, version=edb_version, grpc=False)
-        
-        copper_cond = params.get("copper_conductivity", 5.8e7)
-        edb.materials.add_conductor_material("my_copper", copper_cond)
-        
-        def _safe_float(val, default=0):
-            if val is None or val == '':
-                return default
-            return float(val)
-        
-        # Pre-add all dielectric materials
-        for layer in stackup_data['rows']:
-            if layer['type'] == 'dielectric':
-                dk = format_float(layer.get('dk', 1) or 1)
-                df = format_float(layer.get('df', 0) or 0)
-                mat_name = f'm_{dk}_{df}'
-                if mat_name not in edb.materials.materials:
-                    edb.materials.add_dielectric_material(name=mat_name, permittivity=dk, dielectric_loss_tangent=df)
-
-        signal_indices = [idx for idx, l in enumerate(stackup_data['rows']) if l['type'] == 'conductor']
-        midpoint = len(signal_indices) // 2
-        
-        current_signal_count = 0
-        for i, layer in enumerate(stackup_data['rows']):
-            layer_name = layer['layername']
-            layer_type = layer['type']
-            thickness = f"{_safe_float(layer['thickness'])}mil"
-            
-            if layer_type == 'conductor':
-                material = "my_copper"
-                etch_factor = _safe_float(layer.get('etchfactor', 0))
-                surface_ratio = _safe_float(layer.get('hallhuray_surface_ratio', 0))
-                nodule_radius_val = _safe_float(layer.get('nodule_radius', 0))
-                nodule_radius = f"{nodule_radius_val}um"
-                
-                half = "top" if current_signal_count < midpoint else "bottom"
-                current_signal_count += 1
-                
-                fill_material = 'air'
-                if half == 'top':
-                     # During characterization of top layers, the dielectric above is the one varied/used.
-                     # Search upwards for nearest dielectric to use as fill.
-                    for j in range(i - 1, -1, -1):
-                        if stackup_data['rows'][j]['type'] == 'dielectric':
-                            l_data = stackup_data['rows'][j]
-                            fill_material = f"m_{format_float(l_data.get('dk', 1) or 1)}_{format_float(l_data.get('df', 0) or 0)}"
-                            break
-                else:
-                    # During characterization of bottom layers, the dielectric below is the one varied/used.
-                    # Search downwards for nearest dielectric to use as fill.
-                    for j in range(i + 1, len(stackup_data['rows'])):
-                        if stackup_data['rows'][j]['type'] == 'dielectric':
-                            l_data = stackup_data['rows'][j]
-                            fill_material = f"m_{format_float(l_data.get('dk', 1) or 1)}_{format_float(l_data.get('df', 0) or 0)}"
-                            break
-
-                edb.stackup.add_layer(layer_name=layer_name,
-                                      method="add_on_bottom",
-                                      layer_type='signal',
-                                      thickness=thickness,
-                                      material=material,
-                                      filling_material=fill_material,
-                                      etch_factor=etch_factor,
-                                      enable_roughness=True)
-                signal_layer = edb.stackup.layers[layer_name]
-                
-                signal_layer.top_hallhuray_nodule_radius = nodule_radius
-                signal_layer.top_hallhuray_surface_ratio = surface_ratio
-                signal_layer.bottom_hallhuray_nodule_radius = nodule_radius
-                signal_layer.bottom_hallhuray_surface_ratio = surface_ratio
-                signal_layer.side_hallhuray_nodule_radius = nodule_radius
-                signal_layer.side_hallhuray_surface_ratio = surface_ratio
-                
-            elif layer_type == 'dielectric':
-                dk = format_float(layer.get('dk', 1) or 1)
-                df = format_float(layer.get('df', 0) or 0)
-                mat_name = f'm_{dk}_{df}'
-                
-                edb.stackup.add_layer(layer_name=layer_name,
-                                      method="add_on_bottom",
-                                      layer_type='dielectric',
-                                      thickness=thickness,
-                                      material=mat_name)
-
-        edb.save()
-        xml_output = f'{params["output_aedb_path"]}/full_stackup.xml'
-        edb.stackup.export(xml_output, include_material_with_layer=True)
-        post_process_xml(xml_output)
+        add_full_stackup_layers(edb, params["stackup_data"], params.get("copper_conductivity", 5.8e7))
+        export_full_stackup(edb, output_path)
 
         edb.close_edb()
     except Exception as e:
@@ -269,6 +385,33 @@ def create_full_stackup(params):
         traceback.print_exc()
         raise
 
+def serve_full_stackup(params):
+    """Build the full stackup once, then keep it open and apply updates read from stdin.
+
+    Each stdin line is a JSON command: {"cmd": "update", "stackup_data": ...} or
+    {"cmd": "finish"}. Every command is acknowledged on stdout so the caller can
+    tell when the model is up to date.
+    """
+    output_path = params["output_aedb_path"]
+    config = load_config()
+    edb = Edb(output_path, version=config.get("edb_version", "2024.1"), grpc=False)
+    settings = add_full_stackup_layers(edb, params["stackup_data"], params.get("copper_conductivity", 5.8e7))
+    print("READY", flush=True)
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        command = json.loads(line)
+        if command["cmd"] == "update":
+            settings, updated = update_full_stackup_layers(edb, command["stackup_data"], settings)
+            print(f"UPDATED {updated}", flush=True)
+        elif command["cmd"] == "finish":
+            break
+
+    export_full_stackup(edb, output_path)
+    edb.close_edb()
+    print("DONE", flush=True)
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         json_path = sys.argv[1]
@@ -277,6 +420,8 @@ if __name__ == "__main__":
             
         if params.get("mode") == "full_stackup":
             create_full_stackup(params)
+        elif params.get("mode") == "full_stackup_server":
+            serve_full_stackup(params)
         else:
             create_stackup_model(params)
     else:
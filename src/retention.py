@@ -0,0 +1,167 @@
+import os
+import queue
+import shutil
+import threading
+import zipfile
+
+RETENTION_MODES = ("keep", "zip", "delete")
+ARCHIVE_DIR = "archived_iterations"
+
+def iteration_files(output_dir, layer_name, iteration):
+    """The bulky per-iteration entries: the params JSON and the solved project (aedb, aedt, results, lock files,
+    the copy a warm-started solve runs in and the HFSS project of a port-only solve).
+
+    The S21 sweep and S-parameter files next to the project are small and stay in place.
+    """
+    stem = f"sim_{layer_name}_{iteration}"
+    names = [f"params_{layer_name}_{iteration}.json"]
+    for name in os.listdir(output_dir):
+        if name.startswith((stem + ".", stem + "_warm.", stem + "_ports.")):
+            names.append(name)
+    return [os.path.join(output_dir, name) for name in names if os.path.exists(os.path.join(output_dir, name))]
+
+def path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def zip_entries(zip_path, paths, base_dir):
+    with zipfile.ZipFile(zip_path + ".tmp", 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    for name in files:
+                        full = os.path.join(root, name)
+                        zf.write(full, os.path.relpath(full, base_dir))
+            else:
+                zf.write(path, os.path.relpath(path, base_dir))
+    os.replace(zip_path + ".tmp", zip_path)
+
+def remove_entry(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+class RetentionManager:
+    """Keeps the best and the latest iterations of each layer and zips or deletes the rest.
+
+    add() is called after every solve and only does bookkeeping; retired
+    iterations are handed to a background thread in batches, so the optimizer
+    never waits on file system work. With max_gb set, the oldest zip archives
+    are removed once the output folder grows beyond it.
+    """
+
+    def __init__(self, output_dir, mode="keep", keep_last=2, keep_best=1, max_gb=None, batch_size=4, log=print):
+        if mode not in RETENTION_MODES:
+            raise ValueError(f"Unknown retention mode {mode}, expected one of {', '.join(RETENTION_MODES)}")
+        self.output_dir = output_dir
+        self.mode = mode
+        self.keep_last = max(1, keep_last)
+        self.keep_best = max(1, keep_best)
+        self.max_bytes = max_gb * 1024 ** 3 if max_gb else None
+        self.batch_size = batch_size
+        self.log = log
+        self.records = {}  # layer -> list of (iteration, score)
+        self.retired = set()
+        self.pending = []
+        self.freed = 0
+        self.cap_warned = False
+        self.queue = queue.Queue()
+        self.thread = None
+        if mode != "keep":
+            self.thread = threading.Thread(target=self._worker, daemon=True)
+            self.thread.start()
+
+    def add(self, layer_name, iteration, score):
+        """Record a solved iteration; score is its distance from the targets (lower is better)."""
+        if self.mode == "keep":
+            return
+        records = self.records.setdefault(layer_name, [])
+        records.append((iteration, score))
+        latest = {it for it, _ in sorted(records)[-self.keep_last:]}
+        best = {it for it, _ in sorted(records, key=lambda r: r[1])[:self.keep_best]}
+        for it, _ in records:
+            if it not in latest and it not in best and (layer_name, it) not in self.retired:
+                self.retired.add((layer_name, it))
+                self.pending.append((layer_name, it))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.queue.put(self.pending)
+            self.pending = []
+
+    def close(self):
+        """Process everything still queued. Blocks until the background thread is done."""
+        if self.thread is None:
+            return
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.freed:
+            self.log(f"Retention: freed {self.freed / 1024 ** 2:.0f} MB of iteration files ({self.mode})")
+
+    def _worker(self):
+        deferred = []
+        while True:
+            batch = self.queue.get()
+            closing = batch is None
+            batch, deferred = deferred + (batch or []), []
+            for layer_name, iteration in batch:
+                try:
+                    if not self._retire(layer_name, iteration, force=closing):
+                        deferred.append((layer_name, iteration))
+                except OSError as e:
+                    self.log(f"Retention: could not {self.mode} {layer_name} iteration {iteration}: {e}")
+            if self.max_bytes:
+                self._enforce_cap()
+            if closing:
+                return
+
+    def _retire(self, layer_name, iteration, force=False):
+        """Zip or delete one iteration. Returns False (try again later) while AEDT still has it open."""
+        paths = iteration_files(self.output_dir, layer_name, iteration)
+        if not force and any(path.endswith(".lock") for path in paths):
+            return False
+        if not paths:
+            return True
+        size = sum(path_size(p) for p in paths)
+        if self.mode == "zip":
+            archive_dir = os.path.join(self.output_dir, ARCHIVE_DIR)
+            os.makedirs(archive_dir, exist_ok=True)
+            zip_path = os.path.join(archive_dir, f"{layer_name}_{iteration}.zip")
+            zip_entries(zip_path, paths, self.output_dir)
+            size -= os.path.getsize(zip_path)
+        for path in paths:
+            remove_entry(path)
+        self.freed += size
+        return True
+
+    def _enforce_cap(self):
+        archive_dir = os.path.join(self.output_dir, ARCHIVE_DIR)
+        usage = path_size(self.output_dir)
+        if usage <= self.max_bytes:
+            return
+        archives = []
+        if os.path.isdir(archive_dir):
+            archives = sorted((os.path.join(archive_dir, n) for n in os.listdir(archive_dir)), key=os.path.getmtime)
+        for path in archives:
+            if usage <= self.max_bytes:
+                break
+            size = os.path.getsize(path)
+            os.remove(path)
+            usage -= size
+            self.freed += size
+        if usage > self.max_bytes and not self.cap_warned:
+            self.cap_warned = True
+            self.log(f"Retention: output folder uses {usage / 1024 ** 3:.2f} GB, above the {self.max_bytes / 1024 ** 3:g} GB cap")
@@ -0,0 +1,123 @@
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+
+from line_extraction import REFERENCE_LENGTH_MIL, extract_line, line_s21
+
+RLGC_FILE = "rlgc.csv"
+RLGC_HEADER = ["layer", "iteration", "frequency_ghz", "r_ohm_per_m", "l_h_per_m", "g_s_per_m", "c_f_per_m"]
+METER_PER_MIL = 2.54e-5
+
+def rlgc_from_line(zc, gamma_per_mil, freqs_ghz):
+    """Per-unit-length R, L, G, C (per meter) of a line from its impedance and propagation constant."""
+    w = 2 * np.pi * np.asarray(freqs_ghz) * 1e9
+    gamma = np.asarray(gamma_per_mil) / METER_PER_MIL
+    series = gamma * zc   # R + jwL
+    shunt = gamma / zc    # G + jwC
+    return series.real, series.imag / w, shunt.real, shunt.imag / w
+
+def extract_rlgc(freqs_ghz, lengths_mil, sdd, z0=100):
+    """R, L, G, C over frequency from the differential S-parameters of a solve, shape (lines, freqs, 2, 2)."""
+    lines = [(length, (s[:, 0, 0], s[:, 0, 1], s[:, 1, 0], s[:, 1, 1])) for length, s in zip(lengths_mil, sdd)]
+    zc, gamma = extract_line(lines, z0=z0)
+    return rlgc_from_line(zc, gamma, freqs_ghz)
+
+def append_rlgc(path, layer, iteration, freqs_ghz, rlgc):
+    new_file = not os.path.exists(path)
+    with open(path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(RLGC_HEADER)
+        for row in zip(freqs_ghz, *rlgc):
+            writer.writerow([layer, iteration] + [f"{v:.9g}" for v in row])
+
+def load_rlgc(path, layer, iteration=None):
+    """(frequencies, (R, L, G, C)) of one solve of a layer; its last solve when iteration is None."""
+    rows = {}
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            if row["layer"] == layer:
+                rows.setdefault(int(row["iteration"]), []).append(row)
+    if not rows:
+        raise KeyError(f"No RLGC data for {layer}")
+    iteration = max(rows) if iteration is None else iteration
+    if iteration not in rows:
+        raise KeyError(f"No RLGC data for {layer} iteration {iteration}")
+    data = np.array([[float(r[k]) for k in RLGC_HEADER[2:]] for r in rows[iteration]])
+    return data[:, 0], tuple(data[:, 1:].T)
+
+def interpolate_rlgc(freqs_ghz, rlgc, query_ghz):
+    """R, L, G, C at query frequencies.
+
+    Inside the solved sweep the values are interpolated. Above it R grows with
+    sqrt(f) (skin effect) and G with f (constant loss tangent) from the last
+    solved point, L and C are held; below it the first point is held.
+    """
+    query = np.atleast_1d(np.asarray(query_ghz, dtype=float))
+    r, l, g, c = (np.interp(query, freqs_ghz, v) for v in rlgc)
+    above = query > freqs_ghz[-1]
+    ratio = query[above] / freqs_ghz[-1]
+    r[above] = rlgc[0][-1] * np.sqrt(ratio)
+    g[above] = rlgc[2][-1] * ratio
+    return r, l, g, c
+
+def insertion_s21_db(freqs_ghz, rlgc, length_mil, query_ghz, z0=100):
+    """S21 in dB of a line of any length at any frequencies, between z0 terminations."""
+    query = np.atleast_1d(np.asarray(query_ghz, dtype=float))
+    r, l, g, c = interpolate_rlgc(freqs_ghz, rlgc, query)
+    w = 2 * np.pi * query * 1e9
+    series = r + 1j * w * l
+    shunt = g + 1j * w * c
+    gamma = np.sqrt(series * shunt)
+    zc = np.sqrt(series / shunt)
+    s21 = line_s21(zc, gamma, length_mil * METER_PER_MIL, z0=z0)
+    return 20 * np.log10(np.abs(s21))
+
+def loss_query(layer, default_freq_ghz):
+    """(length in mil, frequency in GHz) the loss target of a layer refers to, or None for the solved line.
+
+    A signal row may set loss_length (mil) and/or loss_frequency (GHz); the
+    other one defaults to the 1000 mil reference line or the sweep end.
+    """
+    length = layer.get('loss_length')
+    freq = layer.get('loss_frequency')
+    if length in (None, '') and freq in (None, ''):
+        return None
+    return (float(length) if length not in (None, '') else REFERENCE_LENGTH_MIL,
+            float(freq) if freq not in (None, '') else float(default_freq_ghz))
+
+def main():
+    parser = argparse.ArgumentParser(description="S21 of any line length and frequency from the RLGC of a characterization run.")
+    parser.add_argument("run_dir", help="stackup_characterization_<timestamp> folder")
+    parser.add_argument("--length", type=float, nargs="+", default=[REFERENCE_LENGTH_MIL], help="Line lengths in mil")
+    parser.add_argument("--freq", type=float, nargs="+", help="Frequencies in GHz (defaults to the solved sweep end)")
+    parser.add_argument("--layer", help="Only this layer")
+    parser.add_argument("--iteration", type=int, help="Use this iteration instead of each layer's last solve")
+    args = parser.parse_args()
+
+    path = os.path.join(args.run_dir, RLGC_FILE)
+    if not os.path.exists(path):
+        parser.error(f"{path} not found: the run recorded no RLGC (it predates RLGC extraction or solved no full-wave candidate)")
+    info_path = os.path.join(args.run_dir, "run_info.json")
+    freq_stop = 5
+    if os.path.exists(info_path):
+        with open(info_path, 'r') as f:
+            freq_stop = json.load(f).get("freq_stop", 5)
+    with open(path, 'r', newline='') as f:
+        layers = list(dict.fromkeys(row["layer"] for row in csv.DictReader(f)))
+    freqs = args.freq or [freq_stop]
+
+    print(f"{'Layer':<12}{'Length':>10}" + "".join(f"{f'{q:g} GHz':>12}" for q in freqs))
+    for layer in layers:
+        if args.layer and layer != args.layer:
+            continue
+        solved_freqs, rlgc = load_rlgc(path, layer, args.iteration)
+        for length in args.length:
+            s21 = insertion_s21_db(solved_freqs, rlgc, length, freqs)
+            print(f"{layer:<12}{f'{length:g} mil':>10}" + "".join(f"{v:>12.3f}" for v in s21))
+
+if __name__ == "__main__":
+    main()
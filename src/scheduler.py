@@ -0,0 +1,97 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import math
+
+class SolveSlots:
+    """A fixed number of concurrent solves, granted to the waiting request with the highest priority.
+
+    Layers pass their predicted remaining work as priority, so when solves
+    queue up the layer on the critical path is served first (longest
+    processing time first). free tells how many slots nobody is using or
+    waiting for, which is what layers may fill with speculative candidates.
+    """
+
+    def __init__(self, slots):
+        self.slots = max(1, int(slots))
+        self.busy = 0
+        self.waiting = []  # heap of (-priority, order, future)
+        self.order = itertools.count()
+
+    @property
+    def free(self):
+        return max(0, self.slots - self.busy - len(self.waiting))
+
+    async def acquire(self, priority=0):
+        if self.busy < self.slots and not self.waiting:
+            self.busy += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (-priority, next(self.order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # granted just as we were cancelled
+            else:
+                self.waiting = [w for w in self.waiting if w[2] is not future]
+                heapq.heapify(self.waiting)
+            raise
+
+    def release(self):
+        while self.waiting:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                future.set_result(None)  # the slot passes on, busy stays the same
+                return
+        self.busy -= 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=0):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+def layer_chains(stackup, indices):
+    """Group the signal rows at indices into chains of layers that share a dielectric.
+
+    A shared dielectric is tuned by the first layer that uses it and is the
+    starting point of the next, so a chain is characterized in stackup order
+    while separate chains can run at the same time.
+    """
+    parent = {idx: idx for idx in indices}
+
+    def find(idx):
+        while parent[idx] != idx:
+            idx = parent[idx]
+        return idx
+
+    users = {}
+    for idx in indices:
+        for diel_idx in (stackup.layers[idx].diel_above, stackup.layers[idx].diel_below):
+            if diel_idx is None:
+                continue
+            if diel_idx in users:
+                parent[find(idx)] = find(users[diel_idx])
+            else:
+                users[diel_idx] = idx
+    chains = {}
+    for idx in indices:
+        chains.setdefault(find(idx), []).append(idx)
+    return [sorted(chain) for chain in chains.values()]
+
+def expected_solves(errors, tolerances, budget):
+    """Solves a layer still needs, from its current relative errors and tolerances.
+
+    Each phase outside its tolerance costs a boundary probe plus the bisection
+    halvings that take its error down to the tolerance; the result is capped by
+    the remaining iteration budget.
+    """
+    solves = 0
+    for error, tolerance in zip(errors, tolerances):
+        if error > tolerance:
+            solves += 1 + math.ceil(math.log2(error / max(tolerance, 1e-9)))
+    return max(0, min(solves, budget))
@@ -1,7 +1,15 @@
 import sys
 import json
 import os
-from ansys.aedt.core import Hfss3dLayout 
+import shutil
+import time
+import numpy as np
+from ansys.aedt.core import Hfss, Hfss3dLayout 
+from ansys.aedt.core.generic.numbers_utils import Quantity
+from line_extraction import extract_line, line_s21
+from material_fit import save_curve, sweep_path
+from modeling import fill_material_name, format_float
+from sparam_archive import save_sdd, sdd_path
 
 def load_config():
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -11,35 +19,256 @@ def load_config():
             return json.load(f)
     return {}
 
-def run_simulation(edb_path):
+def progress(msg):
+    """Report progress to the engine, which streams these lines into its log."""
+    print(f"PROGRESS: {msg}", flush=True)
+
+def solver_messages(hfss):
+    """AEDT message manager entries of this design (empty if they cannot be read)."""
+    try:
+        return list(hfss.odesktop.GetMessages(hfss.project_name, hfss.design_name, 0))
+    except Exception:
+        return []
+
+def analyze_with_progress(hfss, cores=20, poll_interval=5, heartbeat=60):
+    """Solve without blocking and report adaptive pass/convergence messages while the solver runs.
+
+    Returns (seconds, adaptive passes reported).
+    """
+    start = time.time()
+    passes = 0
+    seen = len(solver_messages(hfss))
+    hfss.analyze(cores=cores, blocking=False)
+    last_report = start
+    while hfss.are_there_simulations_running:
+        time.sleep(poll_interval)
+        messages = solver_messages(hfss)
+        for message in messages[seen:]:
+            text = " ".join(str(message).split())
+            if any(word in text.lower() for word in ("pass", "converge", "delta")):
+                progress(text)
+                passes += "adaptive pass" in text.lower()
+                last_report = time.time()
+        seen = len(messages)
+        if time.time() - last_report >= heartbeat:
+            progress(f"Solving ({time.time() - start:.0f}s)")
+            last_report = time.time()
+    progress(f"Solved in {time.time() - start:.0f}s")
+    return time.time() - start, passes
+
+def warm_project_path(edb_path):
+    """Where a warm-started solve keeps its project, next to the freshly built one."""
+    return os.path.splitext(edb_path.rstrip('/\\'))[0] + "_warm.aedt"
+
+def copy_project(source_project, target_project):
+    """Copy a solved 3D Layout project with its layout and results (which hold the adapted mesh)."""
+    source, target = os.path.splitext(source_project)[0], os.path.splitext(target_project)[0]
+    shutil.copy2(source + ".aedt", target + ".aedt")
+    for ext in (".aedb", ".aedtresults"):
+        if os.path.isdir(source + ext):
+            shutil.copytree(source + ext, target + ext, dirs_exist_ok=True)
+
+def apply_layer_values(hfss, params):
+    """Set the materials, copper thickness, etching and roughness of params on an open project's stackup.
+
+    Thickness and etching are only touched when they differ, since any geometry
+    change makes AEDT discard the mesh; warm starts therefore only come from
+    candidates with the same geometry, and only set materials and roughness.
+    """
+    layers = params["layers"]
+    stackup = hfss.modeler.layers
+    for i, layer in enumerate(layers):
+        if layer["type"] == "dielectric":
+            stackup_layer = stackup.dielectrics[layer["layername"]]
+            mat_name = f"m_{format_float(layer['dk'])}_{format_float(layer['df'])}"
+            if not hfss.materials.exists_material(mat_name):
+                material = hfss.materials.add_material(mat_name)
+                material.permittivity = float(layer["dk"])
+                material.dielectric_loss_tangent = float(layer["df"])
+            if stackup_layer.material != mat_name:
+                stackup_layer.material = mat_name
+        else:
+            stackup_layer = stackup.signals[layer["layername"]]
+            fill_material = fill_material_name(layers, i, params.get("signal_half", "top"))
+            if stackup_layer.fill_material != fill_material:
+                stackup_layer.fill_material = fill_material
+            etch = float(layer.get("etch_factor", 1.0))
+            if abs(float(stackup_layer.etch) - etch) > 1e-9:
+                stackup_layer.etch = etch
+            radius = float(str(layer.get("nodule_radius", "2um")).replace("um", ""))
+            ratio = float(layer.get("hallhuray_surface_ratio", 0.2))
+            for side in ("top", "bottom", "side"):
+                setattr(stackup_layer, f"{side}_nodule_radius", radius)
+                setattr(stackup_layer, f"{side}_huray_ratio", ratio)
+        thickness = float(Quantity(layer["thickness"]).to(stackup_layer.thickness_units))
+        if abs(float(stackup_layer.thickness) - thickness) > 1e-9:
+            stackup_layer.thickness = thickness
+
+def open_design(edb_path, params, aedt_version):
+    """Open the project to solve. Returns (hfss, warm).
+
+    With params["warm_start"] the solved project of an earlier candidate is copied
+    and given this candidate's values, so the adaptive passes start from its
+    converged mesh. If that fails the freshly built EDB is solved instead.
+    """
+    warm_start = (params or {}).get("warm_start")
+    if warm_start:
+        hfss = None
+        try:
+            project = warm_project_path(edb_path)
+            copy_project(warm_start["source_project"], project)
+            hfss = Hfss3dLayout(project, version=aedt_version, non_graphical=True, remove_lock=True)
+            apply_layer_values(hfss, params)
+            progress(f"Warm start from the mesh of iteration {warm_start['source_iteration']}")
+            return hfss, True
+        except Exception as e:
+            progress(f"Warm start failed ({e}), meshing from scratch")
+            if hfss is not None:
+                hfss.close_project(save=False)
+    return Hfss3dLayout(edb_path, version=aedt_version, non_graphical=True, remove_lock=True), False
+
+def port_only_zdiff(hfss, edb_path, params, aedt_version, cores=20):
+    """Zdiff of the first differential wave port from a port-only (2D eigenmode) solve.
+
+    HFSS 3D Layout setups cannot solve ports only, so the design is exported to an
+    HFSS project (<project>_ports.aedt) whose modal setup solves just the port
+    cross-section. Of the two modes of a coupled pair the odd mode has the lower
+    impedance, and Zdiff is twice the odd-mode impedance.
+    """
+    project = os.path.splitext(edb_path.rstrip('/\\'))[0] + "_ports.aedt"
+    if not hfss.setups[0].export_to_hfss(project):
+        raise RuntimeError(f"Could not export the layout to {project}")
+    ports = Hfss(project=project, version=aedt_version, non_graphical=True, remove_lock=True)
+    ports.solution_type = "Modal"
+    for boundary in ports.boundaries:
+        if boundary.name == "port1":
+            boundary.props["NumModes"] = 2
+            boundary.update()
+    setup = ports.create_setup("PortsOnly", Frequency=f"{params['frequency']}GHz", PortsOnly=True)
+    start = time.time()
+    ports.analyze_setup(setup.name, cores=cores)
+    analyze_time = time.time() - start
+    progress(f"Port solve finished in {analyze_time:.0f}s")
+    expressions = ["re(Zo(port1:1))", "re(Zo(port1:2))"]
+    data = ports.post.get_solution_data(expressions=expressions, setup_sweep_name=f"{setup.name} : LastAdaptive")
+    zdiff = 2 * min(float(data.data_real(e)[0]) for e in expressions)
+    ports.save_project()
+    ports.close_project(save=False)
+    return zdiff, analyze_time
+
+def get_sdd(hfss, solution_name, line_index):
+    """Complex differential 2-port S-parameters (s11, s12, s21, s22) of one line over the sweep."""
+    p1, p2 = f"diff{2*line_index+1}", f"diff{2*line_index+2}"
+    expressions = [f"S({a},{b})" for a, b in ((p1, p1), (p1, p2), (p2, p1), (p2, p2))]
+    data = hfss.post.get_solution_data(
+        expressions=expressions,
+        setup_sweep_name=solution_name,
+        context="Differential Pairs")
+    freqs = np.array(data.primary_sweep_values)
+    return freqs, tuple(np.array(data.data_real(e)) + 1j * np.array(data.data_imag(e)) for e in expressions)
+
+def compact_result(lines, structure):
+    """Zdiff and the reference-length S21 sweep (dB) of a compact structure.
+
+    The short line(s) are de-embedded into a characteristic impedance and a
+    propagation constant, from which the S21 of the reference-length line
+    between 100 ohm terminations is computed.
+    """
+    zc, gamma = extract_line(lines, z0=100)
+    s21 = line_s21(zc, gamma, structure["reference_length_mil"], z0=100)
+    zdiff = float(np.mean(zc.real))
+    return zdiff, 20 * np.log10(np.abs(s21))
+
+def coupon_result(lines, freqs, structure, loss_at=None):
+    """Zdiff and S21 (dB) of a coupon geometry from its solved line(s).
+
+    As in a compact structure the lines are de-embedded into an impedance and a
+    propagation constant. S21 is that of a loss_at (length in mil, frequency in
+    GHz) line, by default the reference-length line at the sweep end.
+    """
+    zc, gamma = extract_line(lines, z0=100)
+    length, freq = loss_at or (structure["reference_length_mil"], freqs[-1])
+    s21_db = 20 * np.log10(np.abs(line_s21(zc, gamma, length, z0=100)))
+    return float(np.mean(zc.real)), float(np.interp(freq, freqs, s21_db))
+
+def report_timing(**timing):
+    """Stage times of this solve, read by the engine's solve time model. Printed before RESULT."""
+    print(f"TIMING: {json.dumps(timing)}", flush=True)
+
+def run_simulation(edb_path, params=None):
     config = load_config()
     aedt_version = config.get("aedt_version", "2025.2")
+    structure = (params or {}).get("structure", {"mode": "full", "line_lengths_mil": [1000]})
+    coupons = (params or {}).get("coupons", [])
+    line_count = len(structure["line_lengths_mil"]) * (1 + len(coupons))
+    cores = int((params or {}).get("cores") or config.get("cores", 20))
     
-    hfss = Hfss3dLayout(edb_path, version=aedt_version, non_graphical=True, remove_lock=True)
+    if (params or {}).get("solution") == "port_only":
+        hfss = Hfss3dLayout(edb_path, version=aedt_version, non_graphical=True, remove_lock=True)
+        start = time.time()
+        zdiff, analyze_time = port_only_zdiff(hfss, edb_path, params, aedt_version, cores=cores)
+        report_timing(analyze=analyze_time, extract=time.time() - start - analyze_time, passes=0, cores=cores)
+        # Only the port was solved; there is no S21
+        print(f"RESULT: {zdiff}, nan", flush=True)
+        hfss.release_desktop()
+        return
+
+    hfss, warm = open_design(edb_path, params, aedt_version)
 
-    hfss.set_differential_pair('port1:T1', 'port1:T2', 'comm1', 'diff1')
-    hfss.set_differential_pair('port2:T1', 'port2:T2', 'comm2', 'diff2')
+    # A warm-started copy already has the differential pairs of its source
+    if not warm:
+        for n in range(1, 2 * line_count + 1):
+            hfss.set_differential_pair(f'port{n}:T1', f'port{n}:T2', f'comm{n}', f'diff{n}')
 
-    hfss.analyze(cores=20)
+    analyze_time, passes = analyze_with_progress(hfss, cores=cores)
+    extract_start = time.time()
     solution_name = [s for s in hfss.post.available_report_solutions() if 'Last' in s][0]
 
-    data = hfss.post.get_solution_data(
-        expressions='mean(re(St(Diff1,Diff1)))', 
-        setup_sweep_name = solution_name,
-        context="Differential Pairs")
+    lines = []
+    for k, length in enumerate(structure["line_lengths_mil"]):
+        freqs, sdd = get_sdd(hfss, solution_name, k)
+        lines.append((length, sdd))
+    # Keep the whole differential network of every line, so later analysis needs no re-solve
+    sdd_matrices = [np.stack([np.stack([s11, s12], -1), np.stack([s21, s22], -1)], -2) for _, (s11, s12, s21, s22) in lines]
+    save_sdd(sdd_path(edb_path), freqs, structure["line_lengths_mil"], sdd_matrices)
 
-    s11 = data.data_real()[0]
-    zdiff = 100 * (1 + s11) / (1 - s11)
+    if structure["mode"] == "full":
+        data = hfss.post.get_solution_data(
+            expressions='mean(re(St(Diff1,Diff1)))', 
+            setup_sweep_name = solution_name,
+            context="Differential Pairs")
 
-    data = hfss.post.get_solution_data(
-        expressions='dB(S(diff2,diff1))', 
-        setup_sweep_name=solution_name,
-        context="Differential Pairs")
-        
-    dbs21 = data.data_real()[-1] 
-    hfss.save_project()
-    print(f"RESULT: {zdiff}, {dbs21}")
+        s11 = data.data_real()[0]
+        zdiff = 100 * (1 + s11) / (1 - s11)
+
+        data = hfss.post.get_solution_data(
+            expressions='dB(S(diff2,diff1))', 
+            setup_sweep_name=solution_name,
+            context="Differential Pairs")
+            
+        s21_db = np.array(data.data_real())
+    else:
+        zdiff, s21_db = compact_result(lines, structure)
+    dbs21 = s21_db[-1]
 
+    # The whole sweep, for fitting frequency-dependent material models
+    save_curve(sweep_path(edb_path), freqs, s21_db)
+
+    # Coupon geometry g has the lines after those of the geometries before it
+    coupon_results = []
+    for g in range(1, len(coupons) + 1):
+        coupon_lines = []
+        for k, length in enumerate(structure["line_lengths_mil"]):
+            _, sdd = get_sdd(hfss, solution_name, g * len(structure["line_lengths_mil"]) + k)
+            coupon_lines.append((length, sdd))
+        coupon_results.append(coupon_result(coupon_lines, freqs, structure, params.get("loss_at")))
+
+    report_timing(analyze=analyze_time, extract=time.time() - extract_start, passes=passes, cores=cores)
+    if coupon_results:
+        print(f"COUPONS: {json.dumps(coupon_results)}", flush=True)
+    # The engine continues as soon as it reads the result; saving and closing AEDT happen meanwhile
+    print(f"RESULT: {zdiff}, {dbs21}", flush=True)
+    hfss.save_project()
     hfss.release_desktop()
 
 if __name__ == "__main__":
@@ -48,5 +277,11 @@ if __name__ == "__main__":
     else:
         # Default for testing/fallback
         edb_path = r"D:\OneDrive - ANSYS, Inc\a-client-repositories\quanta-stackup-characterization-202510\stackup characterization\tmp\20251127_121842.aedb"
+
+    # Optional modeling parameters, which describe the solved structure
+    params = None
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'r') as f:
+            params = json.load(f)
     
-    run_simulation(edb_path)
+    run_simulation(edb_path, params)
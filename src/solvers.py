@@ -0,0 +1,290 @@
+import asyncio
+import csv
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from launcher import kill_process_tree, run_script_async, start_script
+
+# Parameter columns of characterization_log.csv that describe a candidate
+VALUE_KEYS = ["thickness", "etch_factor", "hallhuray_surface_ratio", "nodule_radius", "dk_up", "dk_down", "df_up", "df_down"]
+
+def parse_result(stdout):
+    """Return (zdiff, dbs21) from the RESULT line printed by simulation.py."""
+    for line in stdout.splitlines():
+        if line.startswith("RESULT:"):
+            parts = line.split(":")[1].split(",")
+            return float(parts[0]), float(parts[1])
+    return 0, 0
+
+def parse_timing(stdout):
+    """Stage times from the TIMING line printed by simulation.py, or {} for older scripts."""
+    for line in stdout.splitlines():
+        if line.startswith("TIMING:"):
+            try:
+                return json.loads(line[len("TIMING:"):])
+            except ValueError:
+                return {}
+    return {}
+
+
+def parse_coupons(stdout):
+    """(zdiff, dbs21) of every coupon geometry from the COUPONS line printed by simulation.py, or []."""
+    for line in stdout.splitlines():
+        if line.startswith("COUPONS:"):
+            try:
+                return [tuple(c) for c in json.loads(line[len("COUPONS:"):])]
+            except ValueError:
+                return []
+    return []
+
+
+class LocalSolver:
+    """Builds the model with modeling.py and solves it with simulation.py on this machine."""
+
+    def __init__(self):
+        self.finishing = set()  # simulation.py children still saving after reporting their result
+
+    def evaluate(self, job, log):
+        """Run modeling + simulation for one candidate. Returns {'zdiff', 'dbs21', 'coupons', 'timing'}.
+
+        job holds 'layer', 'iteration', 'values' (the candidate parameters),
+        'params_path' (modeling parameters already written to disk) and 'aedb_path'.
+        """
+        return asyncio.run(self.evaluate_async(job, log))
+
+    async def evaluate_async(self, job, log):
+        """Awaitable evaluate. Cancelling it kills the modeling/simulation process tree."""
+        layer_name = job['layer']
+        iteration = job['iteration']
+
+        log(f"[{layer_name}] Iter {iteration}: Modeling...")
+        start = time.time()
+        result = await run_script_async("modeling.py", job['params_path'])
+        modeling_time = time.time() - start
+        if result.returncode != 0:
+            err_msg = result.stderr.strip() if result.stderr else "No stderr"
+            out_msg = result.stdout.strip() if result.stdout else "No stdout"
+            log(f"[{layer_name}] modeling.py STDERR:\n{err_msg}")
+            log(f"[{layer_name}] modeling.py STDOUT:\n{out_msg}")
+            raise RuntimeError(f"modeling.py failed (exit code {result.returncode})\n{err_msg}")
+
+        log(f"[{layer_name}] Iter {iteration}: Simulating...")
+
+        def on_line(line):
+            if line.startswith("PROGRESS:"):
+                log(f"[{layer_name}] Iter {iteration}: {line[len('PROGRESS:'):].strip()}")
+
+        # Hand the result over as soon as it is printed; saving the project and
+        # closing AEDT go on in the background.
+        result = await run_script_async("simulation.py", job['aedb_path'], job['params_path'],
+                                        on_line=on_line, until=lambda line: line.startswith("RESULT:"))
+        if result.finished is not None:
+            self.track_finishing(result.finished, f"[{layer_name}] Iter {iteration}", log)
+        elif result.returncode != 0:
+            err_msg = result.stderr.strip() if result.stderr else "No stderr"
+            out_msg = result.stdout.strip() if result.stdout else "No stdout"
+            log(f"[{layer_name}] simulation.py STDERR:\n{err_msg}")
+            log(f"[{layer_name}] simulation.py STDOUT:\n{out_msg}")
+            raise RuntimeError(f"simulation.py failed (exit code {result.returncode})")
+
+        zdiff, dbs21 = parse_result(result.stdout)
+        timing = parse_timing(result.stdout)
+        if timing:
+            timing["modeling"] = modeling_time
+        return {"zdiff": zdiff, "dbs21": dbs21, "coupons": parse_coupons(result.stdout), "timing": timing}
+
+    def track_finishing(self, task, label, log):
+        self.finishing.add(task)
+
+        def done(task):
+            self.finishing.discard(task)
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                log(f"{label}: simulation.py failed after reporting its result: {task.exception()}")
+            elif task.result().returncode != 0:
+                log(f"{label}: simulation.py failed after reporting its result (exit code {task.result().returncode})\n"
+                    f"{task.result().stderr.strip() or 'No stderr'}")
+
+        task.add_done_callback(done)
+
+    async def finish_pending(self):
+        """Wait until every simulation.py child has saved its project and closed AEDT."""
+        while self.finishing:
+            await asyncio.gather(*list(self.finishing), return_exceptions=True)
+
+    def create_full_stackup(self, params_path, log):
+        """Build the full characterized stackup EDB. Returns True on success."""
+        return asyncio.run(self.create_full_stackup_async(params_path, log))
+
+    async def create_full_stackup_async(self, params_path, log):
+        result = await run_script_async("modeling.py", params_path)
+        if result.returncode != 0:
+            err_msg = result.stderr.strip() if result.stderr else "No stderr"
+            out_msg = result.stdout.strip() if result.stdout else "No stdout"
+            log(f"Full stackup modeling.py STDERR:\n{err_msg}")
+            log(f"Full stackup modeling.py STDOUT:\n{out_msg}")
+            log(f"Failed to create full stackup (exit code {result.returncode})")
+            return False
+        return True
+
+    def full_stackup_builder(self, params_path, log):
+        return FullStackupBuilder(params_path, log)
+
+
+class FullStackupBuilder:
+    """Keeps the full stackup EDB open in a modeling.py child and updates it in the background.
+
+    update() only queues a snapshot of the stackup, so the optimizer never waits on
+    EDB work. finish() flushes the queue, exports the XML and waits for the child.
+    """
+
+    def __init__(self, params_path, log):
+        self.log = log
+        self.failed = False
+        self.output_tail = []
+        self.queue = queue.Queue()
+        self.process = start_script("modeling.py", params_path)
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def _send(self, command, expected):
+        if self.failed:
+            return
+        try:
+            self.process.stdin.write(json.dumps(command) + "\n")
+            self.process.stdin.flush()
+            self._wait_for(expected)
+        except OSError as e:
+            self._fail(f"lost connection to modeling.py ({e})")
+
+    def _wait_for(self, expected):
+        for line in self.process.stdout:
+            if line.startswith(expected):
+                return
+            self.output_tail = (self.output_tail + [line.rstrip()])[-40:]
+        self._fail(f"modeling.py exited before {expected}")
+
+    def _fail(self, reason):
+        if self.failed:
+            return
+        self.failed = True
+        out_msg = "\n".join(self.output_tail) or "No output"
+        self.log(f"Full stackup builder failed: {reason}\n{out_msg}")
+
+    def _worker(self):
+        self._wait_for("READY")
+        while True:
+            command = self.queue.get()
+            if command["cmd"] == "finish":
+                self._send(command, "DONE")
+                return
+            self._send(command, "UPDATED")
+
+    def update(self, stackup_data):
+        self.queue.put({"cmd": "update", "stackup_data": json.loads(json.dumps(stackup_data))})
+
+    def finish(self):
+        """Export the model once all queued updates are applied. Returns True on success."""
+        self.queue.put({"cmd": "finish"})
+        self.thread.join()
+        if self.failed:
+            kill_process_tree(self.process)
+        self.process.wait()
+        return not self.failed and self.process.returncode == 0
+
+    def cancel(self):
+        """Stop the builder without exporting (the run was cancelled)."""
+        self.failed = True
+        kill_process_tree(self.process)
+
+
+class ReplaySolver:
+    """Answers solves from the iteration history of earlier runs instead of HFSS.
+
+    Recorded candidates are returned exactly. Unseen candidates are predicted by a
+    locally weighted linear fit over the recorded candidates of the same layer, so
+    the optimizer can walk anywhere inside (and slightly beyond) the recorded
+    region. Results are deterministic, which makes runs comparable across
+    algorithm variants.
+    """
+
+    def __init__(self, run_dirs, neighbours=8, ridge=1e-3):
+        if isinstance(run_dirs, str):
+            run_dirs = [run_dirs]
+        self.neighbours = neighbours
+        self.ridge = ridge
+        self.records = {}  # layer -> (keys, X, Y)
+
+        samples = {}
+        for run_dir in run_dirs:
+            log_path = os.path.join(run_dir, "characterization_log.csv")
+            if not os.path.exists(log_path):
+                raise FileNotFoundError(f"No iteration history found in {run_dir}")
+            with open(log_path, 'r', newline='') as f:
+                for row in csv.DictReader(f):
+                    if row['S21'] == '':
+                        continue  # port-only solve, no S21
+                    values = {k: float(row[k]) for k in VALUE_KEYS if row.get(k, '') != ''}
+                    samples.setdefault(row['layer'], []).append((values, float(row['Zdiff']), float(row['S21'])))
+
+        for layer_name, layer_samples in samples.items():
+            # Rows of other runs may lack a value (e.g. no dk_down on a microstrip row); fit on those all rows have
+            keys = sorted(set.intersection(*(set(v) for v, _, _ in layer_samples)))
+            X = np.array([[v[k] for k in keys] for v, _, _ in layer_samples])
+            Y = np.array([[z, s21] for _, z, s21 in layer_samples])
+            self.records[layer_name] = (keys, X, Y)
+
+    def evaluate(self, job, log):
+        layer_name = job['layer']
+        if layer_name not in self.records:
+            raise RuntimeError(f"No recorded results for layer {layer_name}")
+        keys, X, Y = self.records[layer_name]
+        missing = [k for k in keys if k not in job['values']]
+        if missing:
+            raise ValueError(f"Cannot replay {layer_name}: the candidate has no {', '.join(missing)}, "
+                             "which its recorded solves have")
+        q = np.array([float(job['values'][k]) for k in keys])
+
+        log(f"[{layer_name}] Iter {job['iteration']}: Replaying...")
+        scale = np.maximum(np.abs(X).max(axis=0), 1e-12)
+        dist = np.sqrt((((X - q) / scale) ** 2).sum(axis=1))
+        exact = np.flatnonzero(dist < 1e-9)
+        if exact.size:
+            zdiff, dbs21 = Y[exact[-1]]
+            return {"zdiff": float(zdiff), "dbs21": float(dbs21)}
+
+        # Locally weighted linear regression centred on the query point; the
+        # intercept is the prediction. Only dimensions that were actually varied
+        # carry information, the ridge term keeps the rest from blowing up.
+        order = np.argsort(dist)[:self.neighbours]
+        varied = X.max(axis=0) - X.min(axis=0) > 1e-12
+        A = np.hstack([np.ones((order.size, 1)), ((X[order] - q) / scale)[:, varied]])
+        w = 1.0 / (dist[order] ** 2 + 1e-6)
+        reg = self.ridge * np.eye(A.shape[1])
+        reg[0, 0] = 0
+        AtW = A.T * w
+        beta = np.linalg.solve(AtW @ A + reg, AtW @ Y[order])
+        zdiff, dbs21 = beta[0]
+        return {"zdiff": float(zdiff), "dbs21": float(dbs21)}
+
+    async def evaluate_async(self, job, log):
+        return self.evaluate(job, log)
+
+    async def finish_pending(self):
+        pass
+
+    def create_full_stackup(self, params_path, log):
+        log("Replay mode: skipping full stackup model creation.")
+        return False
+
+    async def create_full_stackup_async(self, params_path, log):
+        return self.create_full_stackup(params_path, log)
+
+    def full_stackup_builder(self, params_path, log):
+        return None
@@ -0,0 +1,122 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+
+DATA_FILE = "sparams.bin"
+INDEX_FILE = "sparams_index.csv"
+INDEX_HEADER = ["layer", "iteration", "offset", "n_freqs", "n_lines"]
+
+def sdd_path(aedb_path):
+    """Where simulation.py saves the differential S-parameters of a solved project."""
+    return os.path.splitext(aedb_path.rstrip('/\\'))[0] + "_sdd.npz"
+
+def save_sdd(path, freqs_ghz, lengths_mil, sdd):
+    """sdd holds one complex 2x2 differential S-matrix per line and frequency, shape (lines, freqs, 2, 2)."""
+    np.savez(path, freqs_ghz=np.asarray(freqs_ghz, dtype=float), lengths_mil=np.asarray(lengths_mil, dtype=float),
+             sdd=np.asarray(sdd, dtype=complex))
+
+def load_sdd(path):
+    with np.load(path) as data:
+        return data["freqs_ghz"], data["lengths_mil"], data["sdd"]
+
+class SParamArchive:
+    """Differential S-parameters of every solve of a run, indexed by layer and iteration.
+
+    Records are appended to one binary file (frequencies, line lengths, then the
+    complex S-matrices) and listed in a small CSV index, so a single sweep can
+    be memory-mapped without reading the rest of the run.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.data_path = os.path.join(folder, DATA_FILE)
+        self.index_path = os.path.join(folder, INDEX_FILE)
+
+    def entries(self):
+        if not os.path.exists(self.index_path):
+            return []
+        with open(self.index_path, 'r', newline='') as f:
+            return [{"layer": row["layer"], "iteration": int(row["iteration"]), "offset": int(row["offset"]),
+                     "n_freqs": int(row["n_freqs"]), "n_lines": int(row["n_lines"])}
+                    for row in csv.DictReader(f)]
+
+    def add(self, layer, iteration, freqs_ghz, lengths_mil, sdd):
+        freqs_ghz = np.asarray(freqs_ghz, dtype=np.float64)
+        lengths_mil = np.asarray(lengths_mil, dtype=np.float64)
+        sdd = np.asarray(sdd, dtype=np.complex128).reshape(len(lengths_mil), len(freqs_ghz), 2, 2)
+        with open(self.data_path, 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            for block in (freqs_ghz, lengths_mil, sdd):
+                f.write(block.tobytes())
+
+        new_index = not os.path.exists(self.index_path)
+        with open(self.index_path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_index:
+                writer.writerow(INDEX_HEADER)
+            writer.writerow([layer, iteration, offset, len(freqs_ghz), len(lengths_mil)])
+
+    def find(self, layer, iteration):
+        for entry in self.entries():
+            if entry["layer"] == layer and entry["iteration"] == iteration:
+                return entry
+        return None
+
+    def load(self, layer, iteration):
+        """(frequencies in GHz, line lengths in mil, S-matrices) of one solve, memory-mapped."""
+        entry = self.find(layer, iteration)
+        if entry is None:
+            raise KeyError(f"No S-parameters for {layer} iteration {iteration}")
+        n_freqs, n_lines = entry["n_freqs"], entry["n_lines"]
+        offset = entry["offset"]
+        freqs = np.memmap(self.data_path, dtype=np.float64, mode='r', offset=offset, shape=(n_freqs,))
+        offset += freqs.nbytes
+        lengths = np.memmap(self.data_path, dtype=np.float64, mode='r', offset=offset, shape=(n_lines,))
+        offset += lengths.nbytes
+        sdd = np.memmap(self.data_path, dtype=np.complex128, mode='r', offset=offset, shape=(n_lines, n_freqs, 2, 2))
+        return freqs, lengths, sdd
+
+    def export_touchstone(self, layer, iteration, folder, z0=100):
+        """Write one .s2p file per solved line. Returns the written paths."""
+        freqs, lengths, sdd = self.load(layer, iteration)
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for length, s in zip(lengths, sdd):
+            path = os.path.join(folder, f"{layer}_{iteration}_{length:g}mil.s2p")
+            write_touchstone(path, freqs, s, z0)
+            paths.append(path)
+        return paths
+
+def write_touchstone(path, freqs_ghz, s, z0=100):
+    """Write a 2-port Touchstone file (real/imaginary) of S-matrices with shape (freqs, 2, 2)."""
+    with open(path, 'w') as f:
+        f.write("! Differential S-parameters (mixed mode Sdd)\n")
+        f.write(f"# GHz S RI R {z0:g}\n")
+        for freq, m in zip(freqs_ghz, s):
+            # Touchstone 2-port order is S11 S21 S12 S22
+            values = (m[0, 0], m[1, 0], m[0, 1], m[1, 1])
+            f.write(f"{freq:.9g} " + " ".join(f"{v.real:.9g} {v.imag:.9g}" for v in values) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export archived S-parameters of a characterization run as Touchstone files.")
+    parser.add_argument("run_dir", help="stackup_characterization_<timestamp> folder")
+    parser.add_argument("--layer", help="Only this layer")
+    parser.add_argument("--iteration", type=int, help="Only this iteration")
+    parser.add_argument("--out", help="Output folder (defaults to <run_dir>/touchstone)")
+    args = parser.parse_args()
+
+    archive = SParamArchive(args.run_dir)
+    out_dir = args.out or os.path.join(args.run_dir, "touchstone")
+    count = 0
+    for entry in archive.entries():
+        if args.layer and entry["layer"] != args.layer:
+            continue
+        if args.iteration is not None and entry["iteration"] != args.iteration:
+            continue
+        count += len(archive.export_touchstone(entry["layer"], entry["iteration"], out_dir))
+    print(f"Wrote {count} Touchstone files to {out_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import copy
+
+# Numeric row fields: JSON key -> attribute name (the iteration log's value keys)
+NUMERIC_FIELDS = {
+    "thickness": "thickness",
+    "width": "width",
+    "spacing": "spacing",
+    "etchfactor": "etch_factor",
+    "dk": "dk",
+    "df": "df",
+    "hallhuray_surface_ratio": "hallhuray_surface_ratio",
+    "nodule_radius": "nodule_radius",
+    "impedance_target": "impedance_target",
+    "loss_target": "loss_target",
+}
+
+def parse_number(val):
+    """A JSON cell as float, or None when it is empty or not a number."""
+    if val is None or val == '':
+        return None
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+def value_or(val, default):
+    return default if val is None else val
+
+def coupon_geometries(layer):
+    """Extra trace geometries measured on a signal layer, solved in the same model as its own pair.
+
+    A signal row may list them under "coupons", each with width, spacing and
+    optionally impedance_target/loss_target (a missing target is 0, not fitted).
+    """
+    coupons = []
+    for coupon in layer.get('coupons') or []:
+        width, spacing = parse_number(coupon.get('width')), parse_number(coupon.get('spacing'))
+        if not width or spacing is None:
+            continue
+        coupons.append({"width": width, "spacing": spacing,
+                        "impedance_target": value_or(parse_number(coupon.get('impedance_target')), 0),
+                        "loss_target": value_or(parse_number(coupon.get('loss_target')), 0)})
+    return coupons
+
+class Layer:
+    """One stackup row with its numeric fields parsed and its neighbours resolved to row indices.
+
+    row keeps the original JSON cells, so fields this class does not know about
+    (e.g. measured_s21) survive, and unchanged values are written back verbatim.
+    """
+
+    __slots__ = ("index", "name", "type", "row", "thickness", "width", "spacing", "etch_factor", "dk", "df",
+                 "hallhuray_surface_ratio", "nodule_radius", "impedance_target", "loss_target",
+                 "ref_names", "ref_above", "ref_below", "diel_above", "diel_below")
+
+    def __init__(self, index, row):
+        self.index = index
+        self.row = row
+        self.name = row['layername']
+        self.type = row['type']
+        for key, attr in NUMERIC_FIELDS.items():
+            setattr(self, attr, parse_number(row.get(key)))
+        refs = [r.strip() for r in str(row.get('reference_layers') or '').split('/')]
+        self.ref_names = (
+            refs[0] if len(refs) > 0 and refs[0] not in ('', 'None') else None,
+            refs[1] if len(refs) > 1 and refs[1] not in ('', 'None') else None,
+        )
+        self.ref_above = None
+        self.ref_below = None
+        self.diel_above = None
+        self.diel_below = None
+
+    @property
+    def is_signal(self):
+        return self.type == 'conductor' and self.width is not None and self.spacing is not None
+
+    def get(self, key, default=None):
+        """Any original JSON cell of the row."""
+        return self.row.get(key, default)
+
+    def to_row(self):
+        row = dict(self.row)
+        for key, attr in NUMERIC_FIELDS.items():
+            val = getattr(self, attr)
+            if val != parse_number(row.get(key)):
+                row[key] = '' if val is None else str(val)
+        return row
+
+class Stackup:
+    """Indexed stackup built once from the stackup JSON.
+
+    Name lookups, signal layers, the nearest dielectric on either side of each
+    row and the reference layers of each signal row are resolved up front, so
+    building a candidate model never scans the rows. to_json() gives back the
+    JSON structure with the current values.
+    """
+
+    __slots__ = ("layers", "meta", "index_by_name", "signal_indices")
+
+    def __init__(self, layers, meta):
+        self.layers = layers
+        self.meta = meta
+        self.index_by_name = {}
+        for layer in layers:
+            self.index_by_name.setdefault(layer.name, layer.index)
+
+        last_diel = None
+        for layer in layers:
+            layer.diel_above = last_diel
+            if layer.type == 'dielectric':
+                last_diel = layer.index
+        last_diel = None
+        for layer in reversed(layers):
+            layer.diel_below = last_diel
+            if layer.type == 'dielectric':
+                last_diel = layer.index
+
+        for layer in layers:
+            top_name, bottom_name = layer.ref_names
+            layer.ref_above = self.index_by_name.get(top_name) if top_name else None
+            layer.ref_below = self.index_by_name.get(bottom_name) if bottom_name else None
+
+        self.signal_indices = [layer.index for layer in layers if layer.is_signal]
+
+    @classmethod
+    def from_json(cls, data):
+        # 'rows' stays as a placeholder so to_json() keeps the key order of the file
+        meta = copy.deepcopy({k: (None if k == 'rows' else v) for k, v in data.items()})
+        return cls([Layer(i, copy.deepcopy(row)) for i, row in enumerate(data['rows'])], meta)
+
+    def to_json(self):
+        data = copy.deepcopy(self.meta)
+        data['rows'] = [layer.to_row() for layer in self.layers]
+        return data
+
+    def copy(self):
+        return Stackup.from_json(self.to_json())
+
+    def layer(self, name):
+        index = self.index_by_name.get(name)
+        return None if index is None else self.layers[index]
+
+    @property
+    def frequency(self):
+        return self.meta['frequency']
+
+    @property
+    def settings(self):
+        return self.meta['settings']
+
+    @property
+    def copper_conductivity(self):
+        return self.meta.get('copper_conductivity', 5.8e7)
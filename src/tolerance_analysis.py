@@ -0,0 +1,202 @@
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+
+from characterization_engine import LAYER_SOURCES_FILE, extract_layer_params, layer_values, load_history
+from coarse_model import differential_impedance, reference_side
+from material_fit import load_curve, loss_split, sweep_path
+from solvers import VALUE_KEYS
+from stackup_model import Stackup, value_or
+
+# One standard deviation of the manufacturing variation, relative to the nominal value
+DEFAULT_SIGMAS = {"width": 0.05, "spacing": 0.05, "thickness": 0.05, "dk": 0.02}
+PERCENTILES = [1, 5, 50, 95, 99]
+CHUNK_SIZE = 100000
+
+def local_quadratic_model(X, Y, x0, neighbours=12, ridge=1e-3):
+    """Locally weighted fit of Y around x0 from recorded solves.
+
+    Returns (y0, gradient, curvature) with y(x) ~ y0 + (x-x0) @ gradient + (x-x0)**2 @ curvature.
+    As in the replay solver only dimensions that were varied carry a slope; a
+    diagonal curvature is added when there are enough samples to support it.
+    """
+    scale = np.maximum(np.abs(X).max(axis=0), 1e-12)
+    dist = np.sqrt((((X - x0) / scale) ** 2).sum(axis=1))
+    order = np.argsort(dist)[:neighbours]
+    U = (X[order] - x0) / scale
+    varied = U.max(axis=0) - U.min(axis=0) > 1e-9
+    n = int(varied.sum())
+    columns = [np.ones((order.size, 1)), U[:, varied]]
+    quadratic = order.size >= 2 * n + 2
+    if quadratic:
+        columns.append(U[:, varied] ** 2)
+    A = np.hstack(columns)
+    w = 1.0 / (dist[order] ** 2 + 1e-6)
+    reg = ridge * np.eye(A.shape[1])
+    reg[0, 0] = 0
+    AtW = A.T * w
+    beta = np.linalg.solve(AtW @ A + reg, AtW @ Y[order])
+
+    gradient = np.zeros((X.shape[1], Y.shape[1]))
+    curvature = np.zeros((X.shape[1], Y.shape[1]))
+    gradient[varied] = beta[1:1 + n] / scale[varied][:, None]
+    if quadratic:
+        curvature[varied] = beta[1 + n:] / scale[varied][:, None] ** 2
+    return beta[0], gradient, curvature
+
+def mirrored_key(key):
+    """Value key of a symmetry mirror that holds key's value (up and down swap)."""
+    if key.endswith('_up'):
+        return key[:-len('_up')] + '_down'
+    if key.endswith('_down'):
+        return key[:-len('_down')] + '_up'
+    return key
+
+def history_source(layer_name, sources):
+    """(layer whose iteration history models layer_name, whether its up/down values are swapped).
+
+    sources maps layers that were copied from another (shared problems and
+    symmetry mirrors) to {"source", "mirror"}; copies of copies are followed.
+    """
+    mirror = False
+    seen = set()
+    while layer_name in sources and layer_name not in seen:
+        seen.add(layer_name)
+        mirror ^= bool(sources[layer_name].get("mirror"))
+        layer_name = sources[layer_name]["source"]
+    return layer_name, mirror
+
+def analyze_layer(stackup, layer_index, rows, run_dir, samples, sigmas, rng, source=None):
+    """Zdiff and S21 samples of one layer under manufacturing variation, or None without history.
+
+    source is (history layer, mirror) for a layer whose values were copied from
+    another one; the surrogate is then fitted on that layer's solves.
+    """
+    layer_info = extract_layer_params(stackup, layer_index)
+    layer = layer_info['layer']
+    layer_name = layer.name
+    history_name, mirror = source or (layer_name, False)
+    rows = [r for r in rows if r['layer'] == history_name and r['S21'] != '']
+    if not rows:
+        return None, "no iteration history"
+
+    values = layer_values(layer_info)
+    keys = [k for k in VALUE_KEYS if k in values]
+    column = mirrored_key if mirror else (lambda k: k)
+    X = np.array([[float(r[column(k)]) for k in keys] for r in rows])
+    Y = np.array([[float(r['Zdiff']), float(r['S21'])] for r in rows])
+    x0 = np.array([values[k] for k in keys])
+    y0, gradient, curvature = local_quadratic_model(X, Y, x0)
+
+    # Width changes the conductor loss; split the loss with the sweep of the closest solve
+    nearest = int(np.argmin(np.abs((X - x0) / np.maximum(np.abs(X).max(axis=0), 1e-12)).sum(axis=1)))
+    curve_path = sweep_path(os.path.join(run_dir, f"sim_{history_name}_{rows[nearest]['iteration']}.aedb"))
+    split = None
+    if os.path.exists(curve_path):
+        split = loss_split(load_curve(curve_path), dict(zip(keys, X[nearest])),
+                           float(stackup.frequency), float(stackup.copper_conductivity))
+    conductor_db = split[0] if split else 0.0
+
+    sigma = np.array([sigmas.get("dk", 0) if k.startswith("dk") else sigmas.get(k, 0) for k in keys])
+    width0 = layer.width
+    spacing0 = layer.spacing
+    h_above = value_or(layer_info['diel_above'].thickness, 0) if layer_info['diel_above'] else 0
+    h_below = value_or(layer_info['diel_below'].thickness, 0) if layer_info['diel_below'] else 0
+    dk = np.mean([values[k] for k in keys if k.startswith("dk")] or [1])
+    geometry = (values['thickness'], h_above, h_below, dk, reference_side(layer))
+    # Width and spacing are never solved for; the ratio of the closed-form Zdiff carries their variation
+    z_cf0 = differential_impedance(width0, spacing0, *geometry)
+
+    zdiff = np.empty(samples)
+    s21 = np.empty(samples)
+    for start in range(0, samples, CHUNK_SIZE):
+        n = min(CHUNK_SIZE, samples - start)
+        dx = x0 * sigma * rng.standard_normal((n, len(keys)))
+        width = width0 * (1 + sigmas.get("width", 0) * rng.standard_normal(n))
+        spacing = spacing0 * (1 + sigmas.get("spacing", 0) * rng.standard_normal(n))
+        y = y0 + dx @ gradient + dx ** 2 @ curvature
+        ratio = differential_impedance(width, spacing, *geometry) / z_cf0
+        zdiff[start:start + n] = y[:, 0] * ratio
+        # Conductor loss ~ R/Z with R ~ 1/width
+        s21[start:start + n] = y[:, 1] - conductor_db * ((width0 / width) / ratio - 1)
+
+    note = "" if split else "loss spread excludes width (no sweep to split conductor loss)"
+    return {"layer": layer_name, "nominal_zdiff": float(y0[0]), "nominal_s21": float(y0[1]),
+            "zdiff": zdiff, "s21": s21}, note
+
+def run_tolerance_analysis(run_dir, samples=100000, sigmas=None, seed=0, log=print):
+    """Monte Carlo spread of Zdiff and S21 per layer around a finished run's characterized stackup.
+
+    Writes tolerance_analysis.csv into run_dir and returns its rows.
+    """
+    sigmas = dict(DEFAULT_SIGMAS, **(sigmas or {}))
+    with open(os.path.join(run_dir, "characterized_stackup.json"), 'r', encoding='utf-8-sig') as f:
+        stackup = Stackup.from_json(json.load(f))
+    history = load_history(os.path.join(run_dir, "characterization_log.csv"))
+    sources = {}
+    sources_path = os.path.join(run_dir, LAYER_SOURCES_FILE)
+    if os.path.exists(sources_path):
+        with open(sources_path, 'r') as f:
+            sources = json.load(f)
+    rng = np.random.default_rng(seed)
+
+    log(f"Tolerance analysis: {samples} samples, sigma {', '.join(f'{k}={v:g}' for k, v in sigmas.items())}")
+    report = []
+    skipped = []
+    for layer_index in stackup.signal_indices:
+        layer_name = stackup.layers[layer_index].name
+        source = history_source(layer_name, sources)
+        if source[0] != layer_name:
+            log(f"[{layer_name}] Sensitivities from {source[0]}{' (mirrored)' if source[1] else ''}, whose results it shares")
+        result, note = analyze_layer(stackup, layer_index, history, run_dir, samples, sigmas, rng, source)
+        if result is None:
+            log(f"[{layer_name}] Skipping tolerance analysis: {note}")
+            skipped.append(layer_name)
+            # Listed in the report, so a missing layer is never mistaken for one without spread
+            report.append({"layer": layer_name, "note": f"not analysed: {note}"})
+            continue
+        if source[0] != layer_name:
+            note = "; ".join(n for n in (f"sensitivities from {source[0]}{' (mirrored)' if source[1] else ''}", note) if n)
+        for metric in ("zdiff", "s21"):
+            samples_of = result[metric]
+            row = {"layer": layer_name, "metric": metric, "nominal": result[f"nominal_{metric}"],
+                   "std": float(np.std(samples_of)), "note": note}
+            row.update({f"p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(samples_of, PERCENTILES))})
+            report.append(row)
+            log(f"[{layer_name}] {metric}: nominal {row['nominal']:.3f}, std {row['std']:.3f}, "
+                + ", ".join(f"P{p}={row[f'p{p}']:.3f}" for p in PERCENTILES))
+        if note:
+            log(f"[{layer_name}] Note: {note}")
+    if skipped:
+        log(f"Tolerance analysis: not analysed {', '.join(skipped)}")
+
+    with open(os.path.join(run_dir, "tolerance_analysis.csv"), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["layer", "metric", "nominal", "std"] + [f"p{p}" for p in PERCENTILES] + ["note"])
+        writer.writeheader()
+        writer.writerows(report)
+    return report
+
+def parse_sigmas(items):
+    sigmas = {}
+    for item in items or []:
+        name, _, value = item.partition("=")
+        if name not in DEFAULT_SIGMAS:
+            raise argparse.ArgumentTypeError(f"Unknown variation source {name}, expected one of {', '.join(DEFAULT_SIGMAS)}")
+        sigmas[name] = float(value)
+    return sigmas
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo tolerance analysis of a finished characterization run.")
+    parser.add_argument("run_dir", help="stackup_characterization_<timestamp> folder")
+    parser.add_argument("--samples", type=int, default=100000)
+    parser.add_argument("--sigma", action="append", metavar="NAME=VALUE",
+                        help=f"Relative 1-sigma variation of {', '.join(DEFAULT_SIGMAS)} (repeatable)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run_tolerance_analysis(args.run_dir, args.samples, parse_sigmas(args.sigma), args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+
+from broker import CANCEL_FILE, DONE_DIR, LEASED_DIR, QUEUE_DIR, ensure_broker_dirs, move_job, read_json, write_json
+from solvers import LocalSolver
+
+class Worker:
+    """Pulls jobs from a broker folder, solves them locally and hands the results back."""
+
+    def __init__(self, root, scratch_dir=None, heartbeat_interval=30, poll_interval=2):
+        self.root = os.path.abspath(root)
+        self.scratch_dir = scratch_dir or tempfile.gettempdir()
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.solver = LocalSolver()
+        ensure_broker_dirs(self.root)
+
+    def log(self, msg):
+        print(f"[{self.name}] {msg}", flush=True)
+
+    def claim(self):
+        """Lease the oldest queued job. Returns (job_id, lease_name) or None."""
+        for job_id in sorted(os.listdir(os.path.join(self.root, QUEUE_DIR))):
+            lease_name = f"{job_id}__{uuid.uuid4().hex[:8]}"
+            if move_job(self.root, job_id, QUEUE_DIR, LEASED_DIR, new_name=lease_name):
+                return job_id, lease_name
+        return None
+
+    def _heartbeat(self, lease_path, stop, cancel_hooks):
+        beat = 0
+        next_beat = 0
+        while not stop.is_set():
+            if time.time() >= next_beat:
+                try:
+                    write_json(os.path.join(lease_path, "heartbeat.json"), {"worker": self.name, "beat": beat})
+                except OSError:
+                    # The lease was taken away (expired); the result will be discarded
+                    return
+                beat += 1
+                next_beat = time.time() + self.heartbeat_interval
+            if os.path.exists(os.path.join(lease_path, CANCEL_FILE)):
+                for hook in cancel_hooks:
+                    hook()
+                return
+            stop.wait(min(self.poll_interval, self.heartbeat_interval))
+
+    async def _solve(self, job, log, cancel_hooks):
+        # Lets the heartbeat thread cancel the solve, which kills the solver processes
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        cancel_hooks.append(lambda: loop.call_soon_threadsafe(task.cancel))
+        metrics = await self.solver.evaluate_async(job, log)
+        # The project is staged back only once it is saved
+        await self.solver.finish_pending()
+        return metrics
+
+    def run_job(self, job_id, lease_name):
+        lease_path = os.path.join(self.root, LEASED_DIR, lease_name)
+        write_json(os.path.join(lease_path, "lease.json"), {"worker": self.name, "leased_at": time.time()})
+        stop = threading.Event()
+        cancel_hooks = []
+        heartbeat = threading.Thread(target=self._heartbeat, args=(lease_path, stop, cancel_hooks), daemon=True)
+        heartbeat.start()
+
+        job_info = read_json(os.path.join(lease_path, "job.json"))
+        work_dir = os.path.join(self.scratch_dir, f"stackup_worker_{lease_name}")
+        os.makedirs(work_dir, exist_ok=True)
+        output = []
+        start_time = time.time()
+        try:
+            # Build and solve in local scratch space, then stage the project back
+            aedb_path = os.path.join(work_dir, job_info["aedb_name"])
+            params = dict(job_info["modeling_params"], output_aedb_path=aedb_path)
+            params_path = os.path.join(work_dir, "params.json")
+            with open(params_path, 'w') as f:
+                json.dump(params, f, indent=2)
+
+            metrics = asyncio.run(self._solve({
+                "layer": job_info["layer"],
+                "iteration": job_info["iteration"],
+                "params_path": params_path,
+                "aedb_path": aedb_path,
+            }, output.append, cancel_hooks))
+
+            # An expired lease has been renamed back into the queue; creating the staging folder
+            # fails then instead of recreating the lease, so the late result is discarded below
+            staged_dir = os.path.join(lease_path, "output")
+            shutil.rmtree(staged_dir, ignore_errors=True)
+            os.mkdir(staged_dir)
+            stem = os.path.splitext(job_info["aedb_name"])[0]
+            for name in os.listdir(work_dir):
+                if name.startswith(stem):
+                    shutil.move(os.path.join(work_dir, name), os.path.join(staged_dir, name))
+            result = dict(metrics, worker=self.name, elapsed=time.time() - start_time)
+        except asyncio.CancelledError:
+            result = None
+        except Exception as e:
+            result = {"error": str(e), "worker": self.name, "output": "\n".join(output) + "\n" + traceback.format_exc()}
+        finally:
+            stop.set()
+            heartbeat.join()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if result is None:
+            self.log(f"Cancelled {job_id}")
+            shutil.rmtree(lease_path, ignore_errors=True)
+            return
+
+        try:
+            write_json(os.path.join(lease_path, "result.json"), result)
+        except OSError:
+            pass
+        if move_job(self.root, lease_name, LEASED_DIR, DONE_DIR, new_name=job_id):
+            self.log(f"Finished {job_id} in {time.time() - start_time:.0f}s")
+        else:
+            self.log(f"Lease on {job_id} expired before it finished, result discarded")
+
+    def serve(self, max_jobs=None):
+        self.log(f"Serving jobs from {self.root}")
+        done = 0
+        while max_jobs is None or done < max_jobs:
+            claimed = self.claim()
+            if not claimed:
+                time.sleep(self.poll_interval)
+                continue
+            self.log(f"Running {claimed[0]}")
+            self.run_job(*claimed)
+            done += 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve stackup characterization jobs from a broker folder.")
+    parser.add_argument("broker_root", help="Shared broker folder")
+    parser.add_argument("--scratch", help="Local folder for building and solving (defaults to the temp folder)")
+    parser.add_argument("--heartbeat", type=float, default=30, help="Seconds between heartbeats")
+    parser.add_argument("--poll", type=float, default=2, help="Seconds between queue polls")
+    parser.add_argument("--max-jobs", type=int, help="Exit after this many jobs")
+    args = parser.parse_args()
+
+    Worker(args.broker_root, args.scratch, args.heartbeat, args.poll).serve(args.max_jobs)
+
+if __name__ == "__main__":
+    main()
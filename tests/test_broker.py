@@ -0,0 +1,100 @@
+import asyncio
+import json
+import os
+import threading
+
+from broker import DONE_DIR, LEASED_DIR, QUEUE_DIR, BrokerSolver
+from worker import Worker
+
+
+class FakeSolver:
+    """Stands in for LocalSolver in a worker: writes a project file instead of running AEDT."""
+
+    def __init__(self, during_solve=None):
+        self.during_solve = during_solve
+
+    async def evaluate_async(self, job, log):
+        if self.during_solve:
+            self.during_solve()
+        with open(job["aedb_path"], "w") as f:
+            f.write("solved")
+        return {"zdiff": 100.0, "dbs21": -1.0}
+
+    async def finish_pending(self):
+        pass
+
+
+def make_job(tmp_path, iteration=1):
+    out_dir = tmp_path / "run"
+    out_dir.mkdir(exist_ok=True)
+    params_path = out_dir / f"params_{iteration}.json"
+    params_path.write_text(json.dumps({"layers": []}))
+    return {"layer": "L1", "iteration": iteration, "values": {}, "params_path": str(params_path),
+            "aedb_path": str(out_dir / f"sim_L1_{iteration}.aedb")}
+
+
+def job_locations(root, job_id):
+    """Broker folders that hold job_id, leased or not."""
+    return sorted(state for state in (QUEUE_DIR, LEASED_DIR, DONE_DIR)
+                  for name in os.listdir(os.path.join(root, state)) if name.split("__")[0] == job_id)
+
+
+def test_job_round_trip(tmp_path):
+    root = str(tmp_path / "broker")
+    broker = BrokerSolver(root, poll_interval=0.01)
+    worker = Worker(root, scratch_dir=str(tmp_path / "scratch"), poll_interval=0.01)
+    worker.solver = FakeSolver()
+    thread = threading.Thread(target=worker.serve, kwargs={"max_jobs": 1}, daemon=True)
+    thread.start()
+
+    job = make_job(tmp_path)
+    result = asyncio.run(asyncio.wait_for(broker.evaluate_async(job, lambda msg: None), 10))
+    thread.join(10)
+
+    assert result == {"zdiff": 100.0, "dbs21": -1.0}
+    with open(job["aedb_path"]) as f:
+        assert f.read() == "solved"
+    for state in (QUEUE_DIR, LEASED_DIR, DONE_DIR):
+        assert os.listdir(os.path.join(root, state)) == []
+
+
+def test_lease_expiring_mid_job_leaves_the_job_queued_only(tmp_path):
+    root = str(tmp_path / "broker")
+    broker = BrokerSolver(root, lease_timeout=0)
+    job_id = broker.submit(make_job(tmp_path))
+    worker = Worker(root, scratch_dir=str(tmp_path / "scratch"), heartbeat_interval=3600)
+    job_id_claimed, lease_name = worker.claim()
+    assert job_id_claimed == job_id
+
+    def expire_lease():
+        # The first look records the beat, the second finds it unchanged for lease_timeout
+        assert broker.reap_expired_lease(job_id, lease_name) is None
+        assert broker.reap_expired_lease(job_id, lease_name) is None
+        assert job_locations(root, job_id) == [QUEUE_DIR]
+
+    worker.solver = FakeSolver(during_solve=expire_lease)
+    worker.run_job(job_id, lease_name)
+
+    assert job_locations(root, job_id) == [QUEUE_DIR]
+    assert not os.path.exists(os.path.join(root, LEASED_DIR, lease_name))
+    assert not os.path.exists(os.path.join(root, QUEUE_DIR, job_id, "result.json"))
+
+
+def test_job_lost_too_often_fails(tmp_path):
+    root = str(tmp_path / "broker")
+    broker = BrokerSolver(root, lease_timeout=0, max_attempts=1)
+    job_id = broker.submit(make_job(tmp_path))
+    _, lease_name = Worker(root).claim()
+
+    assert broker.reap_expired_lease(job_id, lease_name) is None
+    error = broker.reap_expired_lease(job_id, lease_name)
+    assert error and "lost 1 times" in error
+    assert job_locations(root, job_id) == []
+
+
+def test_withdraw_removes_a_queued_job(tmp_path):
+    root = str(tmp_path / "broker")
+    broker = BrokerSolver(root)
+    job_id = broker.submit(make_job(tmp_path))
+    broker.withdraw(job_id)
+    assert job_locations(root, job_id) == []
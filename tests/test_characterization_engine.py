@@ -0,0 +1,94 @@
+import asyncio
+import copy
+import json
+import os
+
+import pytest
+
+from characterization_engine import (CharacterizationEngine, canonical_problem_key, extract_layer_params,
+                                     find_changed_layers)
+from stackup_model import Stackup
+
+STACKUP = os.path.join(os.path.dirname(__file__), "..", "stackup_layers_1007.json")
+
+
+def load():
+    with open(STACKUP, "r", encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+def edited(data, **changes):
+    """A copy of the stackup JSON with cells of named rows replaced: edited(data, in1={"width": "3.5"})."""
+    data = copy.deepcopy(data)
+    for row in data["rows"]:
+        row.update(changes.get(row["layername"], {}))
+    return data
+
+
+def key(data, name, signal_half="top", structure="full"):
+    stackup = Stackup.from_json(data)
+    return canonical_problem_key(stackup, extract_layer_params(stackup, stackup.index_by_name[name]), signal_half,
+                                 structure=structure)
+
+
+def dual_stripline():
+    """The reference stackup with in2 routed and gnd2 removed, so in1 and in2 share dielectric3."""
+    data = load()
+    data["rows"] = [row for row in data["rows"] if row["layername"] not in ("gnd2", "dielectric_01")]
+    return edited(data, in2={"width": "3.11", "spacing": "8.9", "reference_layers": "gnd1 / in3"})
+
+
+def changed_names(new, prev, symmetry=False):
+    new, prev = Stackup.from_json(new), Stackup.from_json(prev)
+    return sorted(new.layers[idx].name for idx in find_changed_layers(new, prev, symmetry=symmetry))
+
+
+def test_renamed_identical_layers_share_a_key():
+    data = load()
+    renamed = edited(data, in1={"layername": "sig1", "reference_layers": "plane1 / gnd2"}, gnd1={"layername": "plane1"},
+                     dielectric2={"layername": "core2"})
+    assert key(renamed, "sig1") == key(data, "in1")
+
+
+def test_the_key_tells_different_problems_apart():
+    data = load()
+    base = key(data, "in1")
+    assert key(edited(data, in1={"width": "3.5"}), "in1") != base
+    assert key(edited(data, in1={"spacing": "9.5"}), "in1") != base
+    assert key(edited(data, dielectric2={"dk": "4.1"}), "in1") != base
+    # The fill between the traces is the dielectric on the signal_half side: dielectric2 above, dielectric3 below
+    assert key(data, "in1", signal_half="bottom") != base
+    assert key(data, "in1", structure="short") != base
+    assert key(edited(data, in4={"width": "3.5"}), "in1") == base
+
+
+def test_unchanged_stackup_needs_nothing():
+    data = dual_stripline()
+    assert changed_names(copy.deepcopy(data), data) == []
+
+
+def test_change_spreads_across_a_shared_dielectric():
+    data = dual_stripline()
+    assert changed_names(edited(data, in1={"width": "3.5"}), data) == ["in1", "in2"]
+    assert changed_names(edited(data, top={"width": "5.5"}), data) == ["top"]
+
+
+def test_change_spreads_to_the_symmetry_partner():
+    data = dual_stripline()
+    assert changed_names(edited(data, top={"width": "5.5"}), data, symmetry=True) == ["bot", "top"]
+    # in1 pulls in in2 through dielectric3 and in4 as its mirror image
+    assert changed_names(edited(data, in1={"width": "3.5"}), data, symmetry=True) == ["in1", "in2", "in4"]
+
+
+def test_a_different_layer_structure_redoes_every_layer():
+    data = dual_stripline()
+    assert changed_names(load(), data) == ["bot", "in1", "in4", "top"]
+    assert changed_names(data, load()) == ["bot", "in1", "in2", "in4", "top"]
+
+
+def test_cancel_before_the_run_starts_stops_it(tmp_path):
+    engine = CharacterizationEngine(load(), 5, output_base_dir=str(tmp_path))
+    engine.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        engine.run()
+    assert not engine.layer_stats
@@ -0,0 +1,69 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from characterization_engine import extract_layer_params, layer_values
+from coarse_model import CoarseModel, SpaceMapping, differential_impedance, reference_side
+from stackup_model import Stackup
+
+STACKUP = os.path.join(os.path.dirname(__file__), "..", "stackup_layers_1007.json")
+
+
+def layer_info(name):
+    with open(STACKUP, "r", encoding="utf-8-sig") as f:
+        stackup = Stackup.from_json(json.load(f))
+    return extract_layer_params(stackup, stackup.index_by_name[name])
+
+
+def test_microstrip_and_stripline_references():
+    assert reference_side(layer_info("top")["layer"]) == "below"
+    assert reference_side(layer_info("bot")["layer"]) == "above"
+    assert reference_side(layer_info("in1")["layer"]) is None
+
+
+def test_zdiff_trends():
+    assert differential_impedance(4, 8, 1.3, 4, 4, 3.8, None) > differential_impedance(5, 8, 1.3, 4, 4, 3.8, None)
+    assert differential_impedance(4, 8, 1.3, 4, 4, 3.8, None) > differential_impedance(4, 8, 1.3, 4, 4, 4.2, None)
+    assert differential_impedance(4, 12, 1.3, 4, 4, 3.8, None) > differential_impedance(4, 8, 1.3, 4, 4, 3.8, None)
+
+
+def test_coarse_model_reproduces_its_calibration_solve():
+    info = layer_info("in1")
+    values = layer_values(info)
+    model = CoarseModel(info, 5, 5, 5.8e7)
+    model.calibrate(values, -1.5)
+    zdiff, s21 = model.metrics(values)
+    assert zdiff == pytest.approx(model.zdiff(values))
+    assert s21 == pytest.approx(-1.5)
+    lossier = dict(values, df_up=values["df_up"] * 2, df_down=values["df_down"] * 2)
+    assert model.metrics(lossier)[1] < -1.5
+
+
+def test_space_mapping_converges_on_a_fine_model_the_coarse_one_gets_wrong():
+    """The coarse model is off by an offset and a wrong slope, the fine one is what the solver would return."""
+    def fine(x):
+        return np.array([100 - 20 * (x[0] - 3.5) + 3, -1.0 - 60 * (x[1] - 0.015)])
+
+    def coarse(x):
+        return np.array([100 - 12 * (x[0] - 3.5), -1.0 - 40 * (x[1] - 0.015)])
+
+    mapping = SpaceMapping(coarse, [(3.0, 4.5), (0.005, 0.03)], targets=[95.0, -1.3], tolerances=[0.005, 0.01])
+    x = np.array([3.5, 0.015])
+    mapping.update(x, fine(x))
+    for _ in range(10):
+        x, _ = mapping.next_candidate()
+        mapping.update(x, fine(x))
+        if mapping.cost(mapping.anchor[1]) < 1 or mapping.exhausted:
+            break
+    assert mapping.cost(mapping.anchor[1]) < 1
+    np.testing.assert_allclose(mapping.anchor[0], [3.9, 0.02], rtol=0.01)
+
+
+def test_a_failed_step_shrinks_the_trust_region():
+    mapping = SpaceMapping(lambda x: np.array([x[0]]), [(0.0, 10.0)], targets=[5.0], tolerances=[0.01])
+    mapping.update([4.0], [4.0])
+    assert not mapping.update([3.0], [3.0])
+    assert mapping.radius == pytest.approx(0.125)
+    assert mapping.anchor[0][0] == 4.0
@@ -0,0 +1,70 @@
+import math
+import os
+
+import pytest
+
+from cost_model import (COST_FILE, SolveCostModel, append_solve_time, format_duration, load_solve_times,
+                        recorded_solve_times, solve_features)
+
+FEATURES = {"solution": "full", "layers": 9, "sweep_points": 100, "max_delta_s": 0.02, "lines": 1}
+SERIAL = 0.3
+
+
+def solve_row(cores, layers=9, passes=8):
+    """A recorded solve whose analyze time follows Amdahl's law with SERIAL and grows with the layer count."""
+    analyze = 600 * (layers / 9) * (SERIAL + (1 - SERIAL) / cores)
+    return {"layer": "top", "iteration": 1, "solution": "full", "layers": layers, "sweep_points": 100,
+            "max_delta_s": 0.02, "lines": 1, "cores": cores, "passes": passes,
+            "modeling_s": 30, "analyze_s": analyze, "extract_s": 10}
+
+
+def test_solve_features_count_coupon_lines():
+    params = {"layers": [{}] * 9, "freq_stop": 5, "structure": {"line_lengths_mil": [500, 250]},
+              "coupons": [{}, {}]}
+    assert solve_features(params) == {"solution": "full", "layers": 9, "sweep_points": 100, "max_delta_s": 0.02,
+                                      "lines": 6}
+
+
+def test_unfitted_model_uses_all_cores():
+    model = SolveCostModel()
+    assert model.predict(FEATURES, 16) is None
+    assert model.knee_cores(FEATURES, 16) == 16
+    assert model.pick_cores(FEATURES, 16) == 16
+
+
+def test_fit_recovers_the_serial_fraction_and_the_knee():
+    model = SolveCostModel([solve_row(cores, layers) for cores in (2, 4, 8, 16) for layers in (5, 9, 13)])
+    assert model.fits["analyze_s"][1] == pytest.approx(SERIAL, abs=0.05)
+    assert model.predict(FEATURES, 8) == pytest.approx(30 + 600 * (SERIAL + (1 - SERIAL) / 8) + 10, rel=0.05)
+    # Within 10% of 16 cores: 0.3 + 0.7/n <= 1.1 * (0.3 + 0.7/16)
+    knee = math.ceil(0.7 / (1.1 * (SERIAL + 0.7 / 16) - SERIAL))
+    assert abs(model.knee_cores(FEATURES, 16) - knee) <= 1
+    assert model.pick_cores(FEATURES, 16) == model.knee_cores(FEATURES, 16, lowest=1)
+
+
+def test_one_solve_on_half_the_cores_before_the_curve_is_known():
+    model = SolveCostModel([solve_row(16), solve_row(16)])
+    assert model.pick_cores(FEATURES, 16) == 8
+
+
+def test_rows_with_missing_cells_are_skipped():
+    model = SolveCostModel([dict(solve_row(8), passes=""), solve_row(8)])
+    assert len(model.rows) == 1
+
+
+def test_solve_times_round_trip(tmp_path):
+    run_dir = tmp_path / "stackup_characterization_20260101_000000"
+    run_dir.mkdir()
+    path = os.path.join(str(run_dir), COST_FILE)
+    append_solve_time(path, solve_row(8))
+    append_solve_time(path, solve_row(4))
+    assert [int(r["cores"]) for r in load_solve_times(path)] == [8, 4]
+    assert len(recorded_solve_times(str(tmp_path))) == 2
+    assert len(SolveCostModel(recorded_solve_times(str(tmp_path))).rows) == 2
+
+
+def test_format_duration():
+    assert format_duration(None) == "-"
+    assert format_duration(42.4) == "42s"
+    assert format_duration(125) == "2m 05s"
+    assert format_duration(3 * 3600 + 7 * 60) == "3h 07m"
@@ -0,0 +1,44 @@
+import numpy as np
+
+from line_extraction import extract_line, line_parameters, line_s21
+
+FREQS = np.linspace(0.05e9, 5e9, 100)
+
+
+def synthetic_line(zc, gamma, length, z0=100):
+    """S-parameters of a uniform line of impedance zc and propagation constant gamma between z0 ports."""
+    gl = gamma * length
+    denom = 2 * zc * z0 * np.cosh(gl) + (zc ** 2 + z0 ** 2) * np.sinh(gl)
+    s11 = (zc ** 2 - z0 ** 2) * np.sinh(gl) / denom
+    s21 = 2 * zc * z0 / denom
+    return s11, s21, s21, s11
+
+
+def lossy_line():
+    w = 2 * np.pi * FREQS
+    zc = 92 - 1j * 2e-10 * w / (1 + 1e-10 * w)
+    # per mil: attenuation growing with frequency, phase of a dk of about 3.8
+    gamma = 1e-4 * np.sqrt(FREQS / 1e9) + 1j * w * np.sqrt(3.8) / 3e8 * 2.54e-5
+    return zc, gamma
+
+
+def test_line_parameters_recover_impedance_and_propagation():
+    zc, gamma = lossy_line()
+    found_zc, found_gl = line_parameters(*synthetic_line(zc, gamma, 1000))
+    np.testing.assert_allclose(found_zc, zc, rtol=1e-9)
+    np.testing.assert_allclose(found_gl, gamma * 1000, rtol=1e-9)
+
+
+def test_two_lines_give_the_propagation_constant_per_mil():
+    zc, gamma = lossy_line()
+    lines = [(200, synthetic_line(zc, gamma, 200)), (100, synthetic_line(zc, gamma, 100))]
+    found_zc, found_gamma = extract_line(lines)
+    np.testing.assert_allclose(found_zc, zc, rtol=1e-9)
+    np.testing.assert_allclose(found_gamma, gamma, rtol=1e-9)
+
+
+def test_short_line_scales_to_the_reference_length():
+    zc, gamma = lossy_line()
+    found_zc, found_gamma = extract_line([(100, synthetic_line(zc, gamma, 100))])
+    expected = synthetic_line(zc, gamma, 1000)[2]
+    np.testing.assert_allclose(line_s21(found_zc, found_gamma, 1000), expected, rtol=1e-9)
@@ -0,0 +1,45 @@
+import numpy as np
+
+from material_fit import djordjevic_sarkar, fit_loss_parameters, load_curve, loss_basis, save_curve
+
+FREQS = np.linspace(0.05, 20, 200)
+VALUES = {"df_up": 0.02, "df_down": 0.02, "dk_up": 3.8, "dk_down": 3.8, "hallhuray_surface_ratio": 2.0, "nodule_radius": 0.5}
+BOUNDS = {"df_up": (0.005, 0.05), "df_down": (0.005, 0.05), "hallhuray_surface_ratio": (0.5, 5.0), "nodule_radius": (0.1, 2.0)}
+# Conductor and dielectric loss of similar size at the top of the sweep
+SCALES = np.array([0.05, 1.0])
+
+
+def s21_curve(df, surface_ratio, nodule_radius):
+    return -loss_basis(FREQS, 3.8, df, 10.0, surface_ratio, nodule_radius, 5.8e7) @ SCALES
+
+
+def test_djordjevic_sarkar_matches_dk_and_df_at_the_reference_frequency():
+    eps, eps_inf, delta_eps = djordjevic_sarkar(3.8, 0.02, 10.0, [10.0])
+    assert abs(eps[0].real - 3.8) < 1e-9
+    assert abs(-eps[0].imag / eps[0].real - 0.02) < 1e-9
+    assert eps_inf < 3.8 and delta_eps > 0
+
+
+def test_curve_round_trip_sorts_and_skips_the_header(tmp_path):
+    path = str(tmp_path / "s21.csv")
+    save_curve(path, [5.0, 1.0, 3.0], [-3.0, -1.0, -2.0])
+    freqs, s21 = load_curve(path)
+    np.testing.assert_allclose(freqs, [1.0, 3.0, 5.0])
+    np.testing.assert_allclose(s21, [-1.0, -2.0, -3.0])
+
+
+def test_fit_recovers_df_of_a_measured_curve():
+    sim = (FREQS, s21_curve(0.02, 2.0, 0.5))
+    measured = (FREQS, s21_curve(0.026, 2.0, 0.5))
+    fitted, info = fit_loss_parameters(sim, measured, VALUES, BOUNDS, f_ref_ghz=10.0, conductivity=5.8e7)
+    # The pull towards the current values and the correlated roughness keep it a little short
+    assert abs(fitted["df_up"] - 0.026) / 0.026 < 0.1
+    assert fitted["df_up"] == fitted["df_down"]
+    assert info["rms_db"] < 0.05
+
+
+def test_fit_needs_overlapping_curves():
+    sim = (FREQS, s21_curve(0.02, 2.0, 0.5))
+    measured = (FREQS + 100, s21_curve(0.02, 2.0, 0.5))
+    fitted, reason = fit_loss_parameters(sim, measured, VALUES, BOUNDS, f_ref_ghz=10.0, conductivity=5.8e7)
+    assert fitted is None and "overlap" in reason
@@ -0,0 +1,93 @@
+import os
+import zipfile
+
+import pytest
+
+from retention import ARCHIVE_DIR, RetentionManager, iteration_files
+
+
+def make_iteration(output_dir, layer_name, iteration, size=1000, locked=False):
+    """The files a solve leaves behind: params JSON, the project folder and the small S21 sweep."""
+    with open(os.path.join(output_dir, f"params_{layer_name}_{iteration}.json"), "w") as f:
+        f.write("{}")
+    aedb = os.path.join(output_dir, f"sim_{layer_name}_{iteration}.aedb")
+    os.makedirs(aedb)
+    with open(os.path.join(aedb, "edb.def"), "wb") as f:
+        f.write(os.urandom(size))
+    with open(os.path.join(output_dir, f"sim_{layer_name}_{iteration}_s21.csv"), "w") as f:
+        f.write("1,-1\n")
+    if locked:
+        open(os.path.join(output_dir, f"sim_{layer_name}_{iteration}.aedt.lock"), "w").close()
+
+
+def test_iteration_files_leave_the_sweep_and_other_iterations_alone(tmp_path):
+    make_iteration(str(tmp_path), "top", 1)
+    make_iteration(str(tmp_path), "top", 11)
+    names = sorted(os.path.basename(p) for p in iteration_files(str(tmp_path), "top", 1))
+    assert names == ["params_top_1.json", "sim_top_1.aedb"]
+
+
+@pytest.mark.parametrize("mode", ["zip", "delete"])
+def test_keeps_the_best_and_latest_and_retires_the_rest(tmp_path, mode):
+    output_dir = str(tmp_path)
+    scores = {1: 5.0, 2: 0.1, 3: 3.0, 4: 2.0, 5: 4.0}
+    manager = RetentionManager(output_dir, mode=mode, keep_last=2, keep_best=1, batch_size=1, log=lambda m: None)
+    for iteration, score in scores.items():
+        make_iteration(output_dir, "top", iteration)
+        manager.add("top", iteration, score)
+    manager.close()
+
+    kept = {it for it in scores if os.path.exists(os.path.join(output_dir, f"sim_top_{it}.aedb"))}
+    assert kept == {2, 4, 5}
+    for iteration in (1, 3):
+        assert os.path.exists(os.path.join(output_dir, f"sim_top_{iteration}_s21.csv"))
+        zip_path = os.path.join(output_dir, ARCHIVE_DIR, f"top_{iteration}.zip")
+        assert os.path.exists(zip_path) == (mode == "zip")
+        if mode == "zip":
+            with zipfile.ZipFile(zip_path) as zf:
+                assert sorted(zf.namelist()) == [f"params_top_{iteration}.json", f"sim_top_{iteration}.aedb/edb.def"]
+
+
+def test_locked_iteration_is_retried_and_forced_on_close(tmp_path):
+    output_dir = str(tmp_path)
+    manager = RetentionManager(output_dir, mode="delete", keep_last=1, keep_best=1, batch_size=1, log=lambda m: None)
+    make_iteration(output_dir, "top", 1, locked=True)
+    manager.add("top", 1, 5.0)
+    make_iteration(output_dir, "top", 2)
+    manager.add("top", 2, 4.0)
+    make_iteration(output_dir, "top", 3)
+    manager.add("top", 3, 3.0)
+    manager.close()
+    assert not os.path.exists(os.path.join(output_dir, "sim_top_1.aedb"))
+    assert not os.path.exists(os.path.join(output_dir, "sim_top_2.aedb"))
+    assert os.path.exists(os.path.join(output_dir, "sim_top_3.aedb"))
+
+
+def test_disk_cap_removes_the_oldest_archives(tmp_path):
+    output_dir = str(tmp_path)
+    messages = []
+    # Incompressible files, so every archive is about as large as the iteration
+    manager = RetentionManager(output_dir, mode="zip", keep_last=1, keep_best=1, max_gb=150e3 / 1024 ** 3,
+                               batch_size=1, log=messages.append)
+    for iteration in range(1, 6):
+        make_iteration(output_dir, "top", iteration, size=60000)
+        manager.add("top", iteration, 10.0 - iteration)
+    manager.close()
+    archives = sorted(os.listdir(os.path.join(output_dir, ARCHIVE_DIR)))
+    assert len(archives) < 4
+    assert "top_4.zip" in archives
+
+
+def test_keep_mode_touches_nothing(tmp_path):
+    output_dir = str(tmp_path)
+    manager = RetentionManager(output_dir, mode="keep", keep_last=1, keep_best=1)
+    for iteration in range(1, 4):
+        make_iteration(output_dir, "top", iteration)
+        manager.add("top", iteration, float(iteration))
+    manager.close()
+    assert all(os.path.exists(os.path.join(output_dir, f"sim_top_{it}.aedb")) for it in range(1, 4))
+
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        RetentionManager(str(tmp_path), mode="archive")
@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from rlgc import (METER_PER_MIL, RLGC_FILE, append_rlgc, extract_rlgc, insertion_s21_db, interpolate_rlgc,
+                  load_rlgc, loss_query)
+from stackup_model import Layer
+
+FREQS_GHZ = np.linspace(0.05, 5, 100)
+# A 100 ohm differential pair with skin-effect R and a constant loss tangent
+R = 20 * np.sqrt(FREQS_GHZ)
+L = 6.2e-7 * np.ones_like(FREQS_GHZ)
+G = 2 * np.pi * FREQS_GHZ * 1e9 * 6.2e-11 * 0.01
+C = 6.2e-11 * np.ones_like(FREQS_GHZ)
+
+
+def line_sdd(length_mil, z0=100):
+    """(freqs, 2, 2) S-parameters of the RLGC line above between z0 ports."""
+    w = 2 * np.pi * FREQS_GHZ * 1e9
+    series, shunt = R + 1j * w * L, G + 1j * w * C
+    zc, gl = np.sqrt(series / shunt), np.sqrt(series * shunt) * length_mil * METER_PER_MIL
+    denom = 2 * zc * z0 * np.cosh(gl) + (zc ** 2 + z0 ** 2) * np.sinh(gl)
+    s11 = (zc ** 2 - z0 ** 2) * np.sinh(gl) / denom
+    s21 = 2 * zc * z0 / denom
+    return np.stack([np.stack([s11, s21], axis=-1), np.stack([s21, s11], axis=-1)], axis=-2)
+
+
+def test_extract_rlgc_recovers_the_line():
+    rlgc = extract_rlgc(FREQS_GHZ, [1000, 500], [line_sdd(1000), line_sdd(500)])
+    for found, expected in zip(rlgc, (R, L, G, C)):
+        np.testing.assert_allclose(found, expected, rtol=1e-6)
+
+
+def test_insertion_loss_scales_to_other_lengths():
+    rlgc = extract_rlgc(FREQS_GHZ, [1000, 500], [line_sdd(1000), line_sdd(500)])
+    expected = 20 * np.log10(np.abs(line_sdd(3000)[:, 1, 0]))
+    np.testing.assert_allclose(insertion_s21_db(FREQS_GHZ, rlgc, 3000, FREQS_GHZ), expected, atol=1e-6)
+
+
+def test_extrapolation_above_the_sweep():
+    r, l, g, c = interpolate_rlgc(FREQS_GHZ, (R, L, G, C), [20.0])
+    assert r[0] == pytest.approx(R[-1] * 2)
+    assert g[0] == pytest.approx(G[-1] * 4)
+    assert (l[0], c[0]) == (L[-1], C[-1])
+
+
+def test_csv_round_trip_picks_the_last_iteration(tmp_path):
+    path = str(tmp_path / RLGC_FILE)
+    append_rlgc(path, "top", 1, FREQS_GHZ, (R, L, G, C))
+    append_rlgc(path, "top", 2, FREQS_GHZ, (2 * R, L, G, C))
+    append_rlgc(path, "in1", 1, FREQS_GHZ, (R, L, G, C))
+    freqs, (r, l, g, c) = load_rlgc(path, "top")
+    np.testing.assert_allclose(freqs, FREQS_GHZ, rtol=1e-8)
+    np.testing.assert_allclose(r, 2 * R, rtol=1e-8)
+    np.testing.assert_allclose(load_rlgc(path, "top", 1)[1][0], R, rtol=1e-8)
+    with pytest.raises(KeyError):
+        load_rlgc(path, "bot")
+
+
+def test_loss_query_defaults():
+    def layer(**cells):
+        return Layer(0, dict({"layername": "top", "type": "conductor"}, **cells))
+    assert loss_query(layer(), 5) is None
+    assert loss_query(layer(loss_length="4000"), 5) == (4000.0, 5.0)
+    assert loss_query(layer(loss_frequency="8"), 5) == (1000.0, 8.0)
+
+
+def test_main_reports_a_run_without_rlgc(tmp_path):
+    script = os.path.join(os.path.dirname(__file__), "..", "src", "rlgc.py")
+    result = subprocess.run([sys.executable, script, str(tmp_path)], capture_output=True, text=True)
+    assert result.returncode == 2
+    assert "rlgc.csv not found" in result.stderr
+    assert "Traceback" not in result.stderr
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+
+from scheduler import SolveSlots, expected_solves, layer_chains
+from stackup_model import Stackup
+
+STACKUP = os.path.join(os.path.dirname(__file__), "..", "stackup_layers_1007.json")
+
+
+def row(name, layer_type):
+    cells = {"layername": name, "type": layer_type, "thickness": "1"}
+    if layer_type == "signal":
+        cells.update(type="conductor", width="4", spacing="8")
+    return cells
+
+
+def test_waiting_solves_are_served_by_priority():
+    async def scenario():
+        slots = SolveSlots(1)
+        served = []
+
+        async def solve(name, priority):
+            async with slots.slot(priority):
+                served.append(name)
+                await asyncio.sleep(0)
+
+        await slots.acquire()
+        assert slots.free == 0
+        tasks = [asyncio.create_task(solve(name, priority)) for name, priority in (("a", 1), ("b", 5), ("c", 3))]
+        await asyncio.sleep(0)
+        assert len(slots.waiting) == 3
+        slots.release()
+        await asyncio.gather(*tasks)
+        assert served == ["b", "c", "a"]
+        assert slots.busy == 0 and slots.free == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario():
+        slots = SolveSlots(2)
+        await slots.acquire()
+        await slots.acquire()
+        waiter = asyncio.create_task(slots.acquire(10))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert slots.waiting == []
+        slots.release()
+        slots.release()
+        assert slots.busy == 0 and slots.free == 2
+
+    asyncio.run(scenario())
+
+
+def test_layers_sharing_a_dielectric_form_one_chain():
+    stackup = Stackup.from_json({"rows": [
+        row("a", "signal"), row("d1", "dielectric"), row("b", "signal"), row("d2", "dielectric"), row("c", "signal"),
+        row("d3", "dielectric"), row("gnd", "conductor"), row("d4", "dielectric"), row("e", "signal"),
+    ]})
+    # b shares d1 with a and d2 with c; e only has d4, beyond the plane
+    assert sorted(layer_chains(stackup, stackup.signal_indices)) == [[0, 2, 4], [8]]
+
+
+def test_reference_stackup_has_independent_layers():
+    with open(STACKUP, "r", encoding="utf-8-sig") as f:
+        stackup = Stackup.from_json(json.load(f))
+    assert sorted(layer_chains(stackup, stackup.signal_indices)) == [[i] for i in stackup.signal_indices]
+
+
+def test_expected_solves():
+    # One probe plus three halvings take an 8x error down to its tolerance
+    assert expected_solves([0.08, 0.005], [0.01, 0.01], 20) == 4
+    assert expected_solves([0.08, 0.04], [0.01, 0.01], 20) == 7
+    assert expected_solves([0.08, 0.04], [0.01, 0.01], 5) == 5
+    assert expected_solves([0.0], [0.01], 20) == 0
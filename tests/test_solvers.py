@@ -0,0 +1,50 @@
+import csv
+import os
+
+import pytest
+
+from characterization_engine import LOG_HEADER
+from solvers import ReplaySolver
+
+
+def write_history(run_dir, rows):
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, "characterization_log.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=LOG_HEADER, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def solve(iteration, dk_up, dk_down=None, s21=-1.0):
+    row = {"iteration": iteration, "layer": "top", "thickness": 1.9, "dk_up": dk_up, "df_up": 0.02,
+           "Zdiff": 100 - 10 * (dk_up - 3.5), "S21": s21}
+    if dk_down is not None:
+        row.update(dk_down=dk_down, df_down=0.02)
+    return row
+
+
+def replay(solver, **values):
+    return solver.evaluate({"layer": "top", "iteration": 1, "values": values}, lambda m: None)
+
+
+def test_recorded_candidates_replay_exactly(tmp_path):
+    write_history(str(tmp_path), [solve(1, 3.5), solve(2, 3.7, s21=-1.1), solve(3, 3.9, s21=-1.2)])
+    solver = ReplaySolver(str(tmp_path))
+    assert replay(solver, thickness=1.9, dk_up=3.7, df_up=0.02) == {"zdiff": pytest.approx(98.0), "dbs21": -1.1}
+    assert replay(solver, thickness=1.9, dk_up=3.8, df_up=0.02)["zdiff"] == pytest.approx(97.0, abs=0.1)
+
+
+def test_runs_with_different_value_keys_fit_on_the_shared_ones(tmp_path):
+    write_history(str(tmp_path / "a"), [solve(1, 3.5, 3.6), solve(2, 3.7, 3.6)])
+    write_history(str(tmp_path / "b"), [solve(1, 3.9)])
+    solver = ReplaySolver([str(tmp_path / "a"), str(tmp_path / "b")])
+    assert solver.records["top"][0] == ["df_up", "dk_up", "thickness"]
+    assert replay(solver, thickness=1.9, dk_up=3.9, df_up=0.02)["zdiff"] == pytest.approx(96.0)
+
+
+def test_candidate_missing_a_fitted_value_names_it(tmp_path):
+    write_history(str(tmp_path), [solve(1, 3.5), solve(2, 3.7)])
+    solver = ReplaySolver(str(tmp_path))
+    with pytest.raises(ValueError, match="top.*dk_up"):
+        replay(solver, thickness=1.9, df_up=0.02)
+
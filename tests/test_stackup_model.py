@@ -0,0 +1,67 @@
+import json
+import os
+
+from stackup_model import Stackup, coupon_geometries, parse_number
+
+STACKUP = os.path.join(os.path.dirname(__file__), "..", "stackup_layers_1007.json")
+
+
+def load():
+    with open(STACKUP, "r", encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+def test_parse_number():
+    assert parse_number("1.5") == 1.5
+    assert parse_number(2) == 2.0
+    assert parse_number("") is None
+    assert parse_number(None) is None
+    assert parse_number("None") is None
+
+
+def test_round_trip_keeps_rows_key_order_and_unknown_cells():
+    data = load()
+    data["rows"][1]["measured_s21"] = "top_s21.csv"
+    stackup = Stackup.from_json(data)
+    assert stackup.to_json() == data
+    assert list(stackup.to_json()) == list(data)
+
+
+def test_signal_layers_neighbours_and_references():
+    stackup = Stackup.from_json(load())
+    assert [stackup.layers[i].name for i in stackup.signal_indices] == ["top", "in1", "in4", "bot"]
+    in1 = stackup.layer("in1")
+    assert stackup.layers[in1.diel_above].name == "dielectric2"
+    assert stackup.layers[in1.diel_below].name == "dielectric3"
+    assert (stackup.layers[in1.ref_above].name, stackup.layers[in1.ref_below].name) == ("gnd1", "gnd2")
+    top = stackup.layer("top")
+    assert top.ref_names == (None, "gnd1")
+    assert top.ref_above is None
+    assert stackup.layer("missing") is None
+
+
+def test_only_changed_values_are_written_back():
+    data = load()
+    stackup = Stackup.from_json(data)
+    stackup.layer("dielectric1").dk = 3.7
+    rows = stackup.to_json()["rows"]
+    assert rows[2]["dk"] == "3.7"
+    # Unchanged cells keep their original text, e.g. the long float of smt
+    assert rows[0]["thickness"] == data["rows"][0]["thickness"]
+    # The copy is independent of the original
+    copied = stackup.copy()
+    copied.layer("dielectric1").dk = 4.0
+    assert stackup.layer("dielectric1").dk == 3.7
+
+
+def test_coupon_geometries_skip_incomplete_entries():
+    row = load()["rows"][1]
+    row["coupons"] = [{"width": "4", "spacing": "8", "impedance_target": "90"},
+                      {"width": "", "spacing": "8"},
+                      {"width": "6"},
+                      {"width": 5, "spacing": 0, "loss_target": "-1.2"}]
+    stackup = Stackup.from_json({"rows": [row]})
+    assert coupon_geometries(stackup.layer("top")) == [
+        {"width": 4.0, "spacing": 8.0, "impedance_target": 90.0, "loss_target": 0},
+        {"width": 5.0, "spacing": 0.0, "impedance_target": 0, "loss_target": -1.2},
+    ]
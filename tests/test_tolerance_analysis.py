@@ -0,0 +1,71 @@
+import csv
+import json
+import os
+import shutil
+
+import numpy as np
+
+from characterization_engine import LAYER_SOURCES_FILE, LOG_HEADER
+from tolerance_analysis import history_source, mirrored_key, run_tolerance_analysis
+
+STACKUP = os.path.join(os.path.dirname(__file__), "..", "stackup_layers_1007.json")
+# top sits between smt (dk 3.5) above and dielectric1 (dk 3.64) below; bot is its mirror image
+TOP_VALUES = {"thickness": 1.9, "etch_factor": 0, "hallhuray_surface_ratio": 0, "nodule_radius": 0,
+              "dk_up": 3.5, "dk_down": 3.64, "df_up": 0.028, "df_down": 0.015}
+
+
+def top_metrics(values):
+    zdiff = 90 + 20 * (values["dk_up"] - 3.5) - 30 * (values["dk_down"] - 3.64) - 4 * (values["thickness"] - 1.9)
+    s21 = -1.0 - 40 * (values["df_up"] - 0.028) - 20 * (values["df_down"] - 0.015)
+    return zdiff, s21
+
+
+def make_run(tmp_path, sources):
+    """A finished run where only top has solves; the others copied it or were never characterized."""
+    run_dir = str(tmp_path)
+    shutil.copy(STACKUP, os.path.join(run_dir, "characterized_stackup.json"))
+    rng = np.random.default_rng(1)
+    with open(os.path.join(run_dir, "characterization_log.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=LOG_HEADER, restval="")
+        writer.writeheader()
+        for iteration in range(1, 21):
+            values = {k: v * (1 + 0.05 * rng.standard_normal()) if v else v for k, v in TOP_VALUES.items()}
+            zdiff, s21 = top_metrics(values)
+            writer.writerow(dict(values, iteration=iteration, layer="top", phase="sweep", Zdiff=zdiff, S21=s21,
+                                 solution="full"))
+    with open(os.path.join(run_dir, LAYER_SOURCES_FILE), "w") as f:
+        json.dump(sources, f)
+    return run_dir
+
+
+def test_mirrored_key_swaps_up_and_down():
+    assert mirrored_key("dk_up") == "dk_down"
+    assert mirrored_key("df_down") == "df_up"
+    assert mirrored_key("thickness") == "thickness"
+
+
+def test_history_source_follows_copies_of_copies():
+    sources = {"bot": {"source": "top", "mirror": True}, "in4": {"source": "bot", "mirror": False},
+               "a": {"source": "b", "mirror": False}, "b": {"source": "a", "mirror": False}}
+    assert history_source("top", sources) == ("top", False)
+    assert history_source("in4", sources) == ("top", True)
+    assert history_source("a", sources)[0] in ("a", "b")
+
+
+def test_mirror_takes_the_source_sensitivities_and_missing_layers_are_listed(tmp_path):
+    run_dir = make_run(tmp_path, {"bot": {"source": "top", "mirror": True}})
+    messages = []
+    report = run_tolerance_analysis(run_dir, samples=2000, log=messages.append)
+
+    rows = {(r["layer"], r.get("metric")): r for r in report}
+    assert abs(rows[("top", "zdiff")]["nominal"] - 90) < 0.5
+    # bot's dk_up is top's dk_down; read unswapped its nominal would be ~97 ohm
+    assert abs(rows[("bot", "zdiff")]["nominal"] - 90) < 0.5
+    assert "sensitivities from top (mirrored)" in rows[("bot", "zdiff")]["note"]
+    for layer in ("in1", "in4"):
+        assert rows[(layer, None)]["note"] == "not analysed: no iteration history"
+    assert any("not analysed in1, in4" in m for m in messages)
+
+    with open(os.path.join(run_dir, "tolerance_analysis.csv"), newline="") as f:
+        written = list(csv.DictReader(f))
+    assert [r["layer"] for r in written] == ["top", "top", "in1", "in4", "bot", "bot"]
@@ -0,0 +1,33 @@
+import os
+
+from characterization_engine import solved_project, warm_start_source
+
+VALUES = {"thickness": 1.3, "etch_factor": 2.5, "dk_up": 3.9, "dk_down": 3.92, "df_up": 0.013, "df_down": 0.013}
+
+
+def make_solve(output_dir, iteration, locked=False, **changes):
+    aedb_path = os.path.join(output_dir, f"sim_in1_{iteration}.aedb")
+    project = os.path.splitext(aedb_path)[0] + ".aedt"
+    open(project, "w").close()
+    if locked:
+        open(project + ".lock", "w").close()
+    return iteration, dict(VALUES, **changes), aedb_path
+
+
+def test_only_candidates_with_the_same_geometry_are_reused(tmp_path):
+    output_dir = str(tmp_path)
+    solved = [make_solve(output_dir, 1, dk_up=3.5),
+              make_solve(output_dir, 2, dk_up=3.8),
+              make_solve(output_dir, 3, dk_up=3.9, thickness=1.31),
+              make_solve(output_dir, 4, dk_up=3.9, etch_factor=2.45)]
+    iteration, project = warm_start_source(solved, VALUES)
+    assert iteration == 2
+    assert project == os.path.join(output_dir, "sim_in1_2.aedt")
+    assert warm_start_source(solved[2:], VALUES) is None
+
+
+def test_projects_still_open_are_skipped(tmp_path):
+    output_dir = str(tmp_path)
+    solved = [make_solve(output_dir, 1, dk_up=3.5), make_solve(output_dir, 2, locked=True)]
+    assert solved_project(solved[1][2]) is None
+    assert warm_start_source(solved, VALUES)[0] == 1